@@ -21,6 +21,7 @@ DEFAULT_OUT = "dist/waf-1.0.zip"
 INCLUDE = [
     "main.py",
     "requirements.txt",
+    "requirements-dl.txt",
     "start-waf.bat",
     "start-waf.sh",
     "deploy.py",
@@ -28,6 +29,7 @@ INCLUDE = [
     "QUICK_START.md",
     "config",
     "src",
+    "scripts",
     "rules",
     "models",
     "docs",
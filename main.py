@@ -8,6 +8,7 @@ import logging
 import logging.handlers
 import argparse
 import json
+import time
 from pathlib import Path
 from datetime import datetime
 
@@ -83,24 +84,30 @@ logger = logging.getLogger(__name__)
 sys.path.insert(0, str(Path(__file__).parent))
 
 from src.core.rule_engine import RuleEngine
+from src.core.rule_watcher import RuleWatcher
 from src.web.app import WAFWebApp
+from src.web.supervisor import WorkerSupervisor
+from src.core.shared_state import SharedState
 from src.utils.web_tools import HTTPRequestParser
+from src.utils.metrics import WAFMetrics
 from src.utils.config_validator import load_and_validate_config
 
 
 class WAFSystem:
     """WAF系统主类 - 客户端请求到规则匹配"""
     
-    def __init__(self, config_path: str = "config/settings.yaml", mode: str = "protection"):
+    def __init__(self, config_path: str = "config/settings.yaml", mode: str = "protection", workers: int = 1):
         """
         初始化WAF系统
         
         Args:
             config_path: 配置文件路径
             mode: 运行模式 (protection/detection)
+            workers: 工作进程数；大于 1 时本实例在主进程中预加载，后台线程推迟到各工作进程 fork 后启动
         """
         self.config_path = config_path
         self.mode = mode
+        self.workers = max(1, int(workers))
 
         # 载入并校验配置
         self.config = load_and_validate_config(self.config_path)
@@ -113,20 +120,60 @@ class WAFSystem:
         
         # 初始化规则引擎
         logger.info("[INIT] Loading rule engine...")
+        self.metrics = WAFMetrics()
         self.rule_engine = RuleEngine(config_path)
+        self.rule_engine.attach_metrics(self.metrics)
         stats = self.rule_engine.get_stats()
         logger.info(f"[OK] Rule engine loaded")
         logger.info(f"  - Total rules: {stats['total_rules']}")
         logger.info(f"  - Enabled rules: {stats['enabled_rules']}")
         logger.info(f"  - Distribution: {stats['by_category']}")
         
+        # 规则文件自动重载；多进程时主进程不能带着后台线程 fork，由各工作进程自行启动
+        self.rule_watcher = None
+        if self.workers == 1:
+            self.start_background()
+        
+        # 深度学习检测器按需加载：仅在启用异常检测时才导入 PyTorch
+        self.dl_detector = None
+        if self.config.detection.anomaly_detection:
+            self.dl_detector = self._load_dl_detector()
+        
         # 初始化Web管理界面
         logger.info("[INIT] Loading web interface...")
-        self.web_app = WAFWebApp(config_path)
+        shared_state = None
+        if self.workers > 1 and not self.config.shared_state.enabled:
+            # 多工作进程时封禁与限流必须跨进程一致，未显式开启也使用共享状态
+            shared_state = SharedState(stripes=self.config.shared_state.stripes,
+                                       counter_slots=self.config.shared_state.counter_slots)
+        self.web_app = WAFWebApp(config_path, rule_engine=self.rule_engine, metrics=self.metrics,
+                                 shared_state=shared_state)
+        if self.dl_detector is not None:
+            self.web_app.model_registry = self.dl_detector.registry
+            self.metrics.registry.gauge_callback(
+                'waf_dl_cache_requests_total', 'DL推理缓存查询（hit/miss）',
+                lambda: {('hit',): self.dl_detector.prediction_cache.hits,
+                         ('miss',): self.dl_detector.prediction_cache.misses},
+                ('result',), kind='counter')
         logger.info("[OK] Web interface ready")
         
         logger.info(f"Mode: {self.mode} | URL: http://localhost:8082")
     
+    def _load_dl_detector(self):
+        """按需加载DL检测器，PyTorch不可用时退化为纯规则模式"""
+        logger.info("[INIT] Loading DL detector...")
+        try:
+            from src import load_dl_module
+            DLDetector, _, _ = load_dl_module()
+            detector = DLDetector(model_path=self.config.detection.model_path,
+                                  cache_size=self.config.detection.dl_cache_size,
+                                  min_canary_accuracy=self.config.detection.canary_min_accuracy)
+        except ImportError as e:
+            logger.warning(f"[WARN] {e}，异常检测已禁用")
+            return None
+        logger.info(f"[OK] DL detector ready (device: {detector.device})")
+        return detector
+    
     def detect_request(self, request_data: dict) -> dict:
         """
         检测HTTP请求 - 使用规则匹配引擎
@@ -143,16 +190,80 @@ class WAFSystem:
                 'details': dict
             }
         """
+        start = time.perf_counter()
+
+        # 白名单：在规范化与规则匹配之前判定，命中直接放行
+        if self.web_app.whitelist_enabled:
+            entry = self.web_app.whitelist.match(request_data)
+            if entry is not None:
+                self.metrics.observe_stage('total', time.perf_counter() - start)
+                self.metrics.requests.inc('allowed', 'whitelisted')
+                return {
+                    'blocked': False,
+                    'rule_triggered': False,
+                    'rule_matches': [],
+                    'dl_confidence': 0.0,
+                    'timestamp': datetime.now().isoformat(),
+                    'reason': f"白名单放行: {entry}",
+                    'severity': 'low',
+                    'category': 'whitelisted'
+                }
+
+        # 封禁名单：封禁期内的来源直接拒绝，不再经过规范化与规则匹配
+        source_ip = request_data.get('source_ip') or ''
+        ban = self.web_app.blacklist.check(source_ip)
+        if ban is not None:
+            self.metrics.observe_stage('total', time.perf_counter() - start)
+            self.metrics.requests.inc('blocked', 'banned')
+            return {
+                'blocked': True,
+                'rule_triggered': False,
+                'rule_matches': [],
+                'dl_confidence': 0.0,
+                'timestamp': datetime.now().isoformat(),
+                'reason': f"来源已封禁: {ban.reason}",
+                'severity': 'high',
+                'category': 'banned'
+            }
+
+        # 限流：令牌耗尽的来源/路径直接拒绝，不计入自动封禁
+        if self.web_app.rate_limiter is not None:
+            limited = self.web_app.rate_limiter.check(request_data)
+            if limited is not None:
+                self.metrics.observe_stage('total', time.perf_counter() - start)
+                self.metrics.requests.inc('blocked', 'rate_limited')
+                return {
+                    'blocked': True,
+                    'rule_triggered': False,
+                    'rule_matches': [],
+                    'dl_confidence': 0.0,
+                    'timestamp': datetime.now().isoformat(),
+                    'reason': f"触发限流: {limited.name}",
+                    'severity': 'medium',
+                    'category': 'rate_limited'
+                }
+
         # 规则匹配检测
         is_attack, rule_matches = self.rule_engine.detect(request_data)
         
-        # 决策：规则触发立即阻止
-        should_block = is_attack
+        # DL检测：规则未触发时再做推理，规则命中的请求无需额外开销
+        dl_attack, dl_confidence = False, 0.0
+        if self.dl_detector is not None and not is_attack:
+            dl_start = time.perf_counter()
+            dl_attack, dl_confidence, _ = self.dl_detector.predict(
+                HTTPRequestParser.request_text(request_data),
+                threshold=self.config.detection.threshold
+            )
+            self.metrics.observe_stage('dl', time.perf_counter() - dl_start)
+        
+        # 决策：规则触发立即阻止，DL 超过阈值同样阻止
+        should_block = is_attack or dl_attack
         
         result = {
             'blocked': should_block,
             'rule_triggered': is_attack,
             'rule_matches': rule_matches,
+            'dl_confidence': dl_confidence,
             'timestamp': datetime.now().isoformat()
         }
         
@@ -160,22 +271,50 @@ class WAFSystem:
             result['reason'] = f"规则匹配: {rule_matches[0].get('rule_name', '未知')}"
             result['severity'] = rule_matches[0].get('severity', 'medium')
             result['category'] = rule_matches[0].get('category', 'unknown')
+        elif dl_attack:
+            result['reason'] = f"DL异常检测: 置信度 {dl_confidence:.2f}"
+            result['severity'] = 'medium'
+            result['category'] = 'anomaly'
         else:
             result['reason'] = '正常请求'
             result['severity'] = 'low'
             result['category'] = 'normal'
         
+        # 自动封禁：窗口内被拦截次数达到阈值的来源进入封禁名单
+        if should_block:
+            self.web_app.blacklist.record_block(source_ip)
+
+        self.metrics.observe_stage('total', time.perf_counter() - start)
+        self.metrics.requests.inc('blocked' if should_block else 'allowed', result['category'])
         return result
     
+    def start_background(self):
+        """启动后台线程（规则文件监视）；多进程时在每个工作进程 fork 后调用"""
+        if self.config.rules.auto_reload and self.rule_watcher is None:
+            self.rule_watcher = RuleWatcher(self.rule_engine, self.config.rules.reload_interval).start()
+
+    def reload(self):
+        """SIGHUP: 主进程重新加载规则，随后滚动重启的工作进程继承新规则"""
+        self.rule_engine.reload_rules(trigger='sighup')
+
     def run_web_server(self, host: str = '0.0.0.0', port: int = 8080, debug: bool = False):
-        """启动Web管理服务器"""
-        self.web_app.run(host=host, port=port, debug=debug)
+        """启动Web管理服务器；workers 大于 1 时由 pre-fork 主进程管理多个工作进程"""
+        if self.workers == 1 or debug:
+            self.web_app.run(host=host, port=port, debug=debug)
+            return
+        shared_state = self.web_app.shared_state
+        WorkerSupervisor(self.web_app.app, host, port, workers=self.workers, timeout=self.config.server.timeout,
+                         max_memory_bytes=parse_size_bytes(self.config.server.max_worker_memory, default=0),
+                         on_reload=self.reload, post_fork=self.start_background,
+                         on_worker_exit=shared_state.flush if shared_state is not None else None).run()
     
     def get_status(self) -> dict:
         """获取系统状态"""
         return {
             'mode': self.mode,
             'rule_engine': self.rule_engine.get_stats(),
+            'rule_watcher': self.rule_watcher.get_status() if self.rule_watcher else 'disabled',
+            'dl_detector': self.dl_detector.get_model_info() if self.dl_detector else 'disabled',
             'web_interface': 'running'
         }
 
@@ -194,12 +333,17 @@ def main():
                        help='配置文件路径')
     parser.add_argument('--debug', action='store_true',
                        help='Debug模式')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='工作进程数（默认取 server.workers；Debug 模式始终单进程）')
     
     args = parser.parse_args()
     
     try:
         # 创建WAF系统实例
-        waf_system = WAFSystem(config_path=args.config, mode=args.mode)
+        workers = args.workers
+        if workers is None:
+            workers = load_and_validate_config(args.config).server.workers
+        waf_system = WAFSystem(config_path=args.config, mode=args.mode, workers=1 if args.debug else workers)
         
         # 显示系统状态
         logger.info("\n[INFO] System Status:")
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""检测性能基准 - 可复现的吞吐/延迟测量与回归门禁
+
+用法:
+  python scripts/benchmark.py                          # 运行并与 benchmarks/baseline.json 对比
+  python scripts/benchmark.py --requests 20000 --rule-scale 0 1000 5000
+  python scripts/benchmark.py --save-baseline          # 以本次结果更新基线
+
+按固定随机种子生成良性与攻击混合语料，逐条计时以下热点并输出 p50/p99/p999 与吞吐：
+  - HTTPRequestParser.normalize_request
+  - RuleEngine.detect（内置规则 + --rule-scale 条合成规则，关闭匹配缓存与剖析）
+  - FeatureExtractor.extract_features
+  - AttackLog.add_log / AttackLog.get_stats
+每项基准重复 --repeat 轮取最优值。结果写入 --output（JSON）；任一门禁指标（p50、p99、吞吐）相对基线超出 --tolerance 时以非零状态码退出。
+基线按校准循环耗时换算到当前机器，减少不同硬件间的误报。
+"""
+import argparse
+import json
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from src.core.features import FeatureExtractor
+from src.core.rule_engine import RuleEngine
+from src.utils.benchmark import (BENCHMARK_FORMAT_VERSION, best_of, calibrate, compare_to_baseline,
+                                 environment, generate_corpus, load_report, save_report, time_calls,
+                                 write_synthetic_rules)
+from src.utils.web_tools import HTTPRequestParser
+from src.web.app import AttackLog
+
+
+def build_engine(work_dir: Path, rule_scale: int, seed: int) -> RuleEngine:
+    """基于 settings.yaml 的规则文件构建独立引擎，附加 rule_scale 条合成规则"""
+    with open(ROOT_DIR / 'config' / 'settings.yaml', 'r', encoding='utf-8-sig') as f:
+        config = yaml.safe_load(f) or {}
+    rule_files = [str(ROOT_DIR / p) for p in config.get('rules', {}).get('directories', [])]
+    if rule_scale:
+        rule_files += write_synthetic_rules(work_dir / f'rules_{rule_scale}', rule_scale, seed)
+    detection = dict(config.get('detection', {}))
+    detection.update({'cache_ttl_seconds': 0, 'rule_profiling': False})
+    config_path = work_dir / f'settings_{rule_scale}.yaml'
+    config_path.write_text(yaml.safe_dump({'rules': {'directories': rule_files, 'bundle_file': ''},
+                                           'detection': detection}), encoding='utf-8')
+    return RuleEngine(str(config_path))
+
+
+def run_benchmarks(args) -> dict:
+    corpus = generate_corpus(args.requests, args.attack_ratio, args.seed)
+    calibration = calibrate()
+    results = {}
+
+    def record(name, func, items, warmup=200):
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            return
+        results[name] = best_of([time_calls(func, items, warmup=min(warmup, len(items)))
+                                 for _ in range(max(1, args.repeat))])
+        r = results[name]
+        print(f"  {name:<32} {r['ops_per_sec']:>11.0f} ops/s  p50 {r['p50_us']:>9.1f}us  "
+              f"p99 {r['p99_us']:>9.1f}us  p999 {r['p999_us']:>9.1f}us")
+
+    record('normalize_request', HTTPRequestParser.normalize_request, corpus)
+
+    with tempfile.TemporaryDirectory(prefix='waf_bench_') as tmp:
+        for scale in args.rule_scale:
+            engine = build_engine(Path(tmp), scale, args.seed)
+            record(f'rule_engine.detect[rules={len(engine.rules)}]', engine.detect, corpus)
+
+    extractor = FeatureExtractor()
+    texts = [HTTPRequestParser.request_text(request) for request in corpus]
+    record('feature_extractor.extract', extractor.extract_features, texts)
+
+    attack_log = AttackLog(max_size=10000)
+    record('attack_log.add_log', attack_log.add_log,
+           [{'category': r['label'], 'severity': 'high', 'source_ip': r['source_ip'],
+             'request_url': r['url'], 'rule': r['label']} for r in corpus])
+    record('attack_log.get_stats', lambda _: attack_log.get_stats(hours=24), range(50), warmup=5)
+
+    return {
+        'format': BENCHMARK_FORMAT_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'calibration_ns': min(calibration, calibrate()),
+        'config': {'requests': args.requests, 'attack_ratio': args.attack_ratio,
+                   'rule_scale': args.rule_scale, 'seed': args.seed, 'repeat': args.repeat},
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WAF 检测性能基准')
+    parser.add_argument('--requests', type=int, default=5000, help='语料请求数')
+    parser.add_argument('--attack-ratio', type=float, default=0.2, help='攻击请求比例')
+    parser.add_argument('--rule-scale', type=int, nargs='+', default=[0],
+                        help='额外合成规则数，可给多个值分别测量')
+    parser.add_argument('--seed', type=int, default=1234, help='语料随机种子')
+    parser.add_argument('--repeat', type=int, default=3, help='每项基准的测量轮数（取最优）')
+    parser.add_argument('--only', nargs='*', default=[], help='只运行名称以这些前缀开头的基准')
+    parser.add_argument('--output', default='benchmarks/results/latest.json', help='结果JSON路径')
+    parser.add_argument('--baseline', default='benchmarks/baseline.json', help='基线JSON路径')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='允许的相对退化（0.5 即 50%%）')
+    parser.add_argument('--save-baseline', action='store_true', help='以本次结果覆盖基线')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    print(f"语料 {args.requests} 条（攻击 {args.attack_ratio:.0%}），种子 {args.seed}")
+    report = run_benchmarks(args)
+    save_report(report, ROOT_DIR / args.output)
+    print(f"结果已写入 {args.output}")
+
+    if args.save_baseline:
+        save_report(report, ROOT_DIR / args.baseline)
+        print(f"基线已更新: {args.baseline}")
+        return
+
+    baseline = load_report(ROOT_DIR / args.baseline)
+    if baseline is None:
+        print(f"未找到基线 {args.baseline}，跳过回归对比（使用 --save-baseline 生成）")
+        return
+    if baseline.get('config', {}).get('requests') != args.requests:
+        print("警告: 基线语料规模与本次不同，分位数可比性下降")
+    regressions = compare_to_baseline(report, baseline, args.tolerance)
+    report['regressions'] = regressions
+    save_report(report, ROOT_DIR / args.output)
+    if regressions:
+        print(f"✗ 检测到 {len(regressions)} 项性能回归（容差 {args.tolerance:.0%}）:")
+        for item in regressions:
+            print(f"  {item['benchmark']} {item['metric']}: 基线 {item['baseline']} -> "
+                  f"当前 {item['current']} ({item['change']:+.0%})")
+        sys.exit(1)
+    print(f"✓ 无性能回归（容差 {args.tolerance:.0%}）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""流量回放 - 用抓包流量做容量评估与规则变更验证
+
+用法:
+  python scripts/replay.py traffic.jsonl --workers 8                 # 尽可能快地回放
+  python scripts/replay.py captures/ --workers 4 --rate 2000         # 按 2000 req/s 回放
+  python scripts/replay.py traffic.jsonl --candidate-config config/settings.next.yaml --fail-on-diff
+
+输入为NDJSON（每行 method/url/headers/body，或 ``raw`` 原始报文）或原始HTTP报文文件
+（经 src.utils.http_parser 按字节解析，多个请求以 ``###`` 行分隔），也可以是包含这些文件的目录。
+每个工作进程各自构造 WAFSystem 并调用 detect_request，报告：
+  - 吞吐、检测延迟分位（按速率回放时另报含排队的响应延迟）
+  - 各判定类别的CPU耗时
+  - 指定 --candidate-config 时，两个规则集版本的判定差异
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from src.utils.replay import ReplayRecord, diff_verdicts, load_traffic, summarize_replay
+
+# 每个工作进程一个 WAFSystem，在进程初始化时构造
+_WORKER_SYSTEM = {}
+
+
+def _init_worker(config_path: str, barrier=None):
+    from main import WAFSystem
+
+    system = WAFSystem(config_path=config_path, mode='detection')
+    if system.rule_watcher is not None:
+        system.rule_watcher.stop()
+    logging.getLogger().setLevel(logging.WARNING)
+    _WORKER_SYSTEM['system'] = system
+    if barrier is not None:
+        barrier.wait()
+
+
+def _replay_chunk(chunk, start_at_ns: int = 0, rate: float = 0.0):
+    """回放一批 (序号, 请求)；指定速率时每条请求按 start_at_ns + 序号/rate 的计划时刻发出"""
+    system = _WORKER_SYSTEM['system']
+    perf, cpu, wall = time.perf_counter_ns, time.thread_time_ns, time.time_ns
+    records = []
+    for index, request in chunk:
+        lag = 0
+        if rate:
+            scheduled = start_at_ns + int(index * 1e9 / rate)
+            delay = scheduled - wall()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+            else:
+                lag = -delay
+        cpu_start, start = cpu(), perf()
+        result = system.detect_request(request)
+        latency, cpu_used = perf() - start, cpu() - cpu_start
+        matches = result.get('rule_matches') or []
+        records.append(ReplayRecord(index, bool(result.get('blocked')), result.get('category', 'normal'),
+                                    matches[0].get('rule_name', '') if matches else '',
+                                    latency, cpu_used, lag))
+    return records
+
+
+def replay(config_path: str, requests, workers: int, rate: float, chunk_size: int):
+    """用指定配置回放全部请求，返回 (按序号排序的结果, 墙钟耗时秒)"""
+    indexed = list(enumerate(requests))
+    chunks = [indexed[i:i + chunk_size] for i in range(0, len(indexed), chunk_size)]
+    if workers <= 1:
+        _init_worker(config_path)
+        start = time.perf_counter()
+        start_at = time.time_ns()
+        records = [r for chunk in chunks for r in _replay_chunk(chunk, start_at, rate)]
+        return records, time.perf_counter() - start
+
+    # 所有工作进程完成 WAFSystem 初始化后再开始计时，避免冷启动计入吞吐
+    barrier = multiprocessing.Barrier(workers + 1)
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(config_path, barrier)) as pool:
+        barrier.wait()
+        start = time.perf_counter()
+        start_at = time.time_ns()
+        records = []
+        for batch in pool.starmap(_replay_chunk, [(chunk, start_at, rate) for chunk in chunks], chunksize=1):
+            records.extend(batch)
+        elapsed = time.perf_counter() - start
+    records.sort(key=lambda r: r.index)
+    return records, elapsed
+
+
+def print_summary(title: str, summary: dict):
+    latency = summary['latency_us']
+    print(f"\n[{title}] {summary['requests']} 条，拦截 {summary['blocked']}，"
+          f"耗时 {summary['wall_seconds']}s，吞吐 {summary['throughput_rps']:.0f} req/s，"
+          f"CPU {summary['cpu_seconds']}s")
+    print(f"  检测延迟(us)  p50 {latency['p50']}  p90 {latency['p90']}  p99 {latency['p99']}  "
+          f"p99.9 {latency['p99.9']}  max {latency['max']}")
+    if 'response_us' in summary:
+        response = summary['response_us']
+        print(f"  响应延迟(us)  p50 {response['p50']}  p99 {response['p99']}  max {response['max']}（含排队）")
+    print(f"  {'类别':<24}{'请求数':>10}{'CPU(ms)':>12}{'us/请求':>10}{'占比':>8}")
+    for category, entry in summary['cpu_by_category'].items():
+        print(f"  {category:<24}{entry['requests']:>10}{entry['cpu_ms']:>12.1f}"
+              f"{entry['cpu_us_per_request']:>10.1f}{entry['cpu_share']:>8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WAF 流量回放')
+    parser.add_argument('inputs', nargs='+', help='NDJSON / 原始HTTP报文文件或目录')
+    parser.add_argument('--config', default='config/settings.yaml', help='基准规则集配置')
+    parser.add_argument('--candidate-config', default=None, help='待验证规则集配置，指定后输出判定差异')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='回放进程数')
+    parser.add_argument('--rate', type=float, default=0.0, help='目标速率 req/s（0 表示尽可能快）')
+    parser.add_argument('--limit', type=int, default=None, help='最多回放的请求数')
+    parser.add_argument('--chunk-size', type=int, default=200, help='每次分发给工作进程的请求数')
+    parser.add_argument('--max-diffs', type=int, default=20, help='差异样例数上限')
+    parser.add_argument('--output', default=None, help='结果JSON路径')
+    parser.add_argument('--fail-on-diff', action='store_true', help='存在判定差异时以非零状态码退出')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    stats = {}
+    requests = load_traffic(args.inputs, args.limit, stats)
+    print(f"读取 {stats['records']} 条请求（跳过 {stats['skipped']} 条），"
+          f"{args.workers} 个进程，速率 {args.rate or '不限'}")
+    if not requests:
+        sys.exit(1)
+
+    report = {'config': vars(args), 'runs': {}}
+    baseline, elapsed = replay(args.config, requests, args.workers, args.rate, args.chunk_size)
+    report['runs']['baseline'] = summarize_replay(baseline, elapsed)
+    print_summary(f'基准 {args.config}', report['runs']['baseline'])
+
+    diff = None
+    if args.candidate_config:
+        candidate, elapsed = replay(args.candidate_config, requests, args.workers, args.rate, args.chunk_size)
+        report['runs']['candidate'] = summarize_replay(candidate, elapsed)
+        print_summary(f'候选 {args.candidate_config}', report['runs']['candidate'])
+        diff = report['diff'] = diff_verdicts(requests, baseline, candidate, args.max_diffs)
+        print(f"\n判定差异: {diff['changed']} / {diff['compared']}（新增拦截 {diff['newly_blocked']}，"
+              f"新增放行 {diff['newly_allowed']}，类别变化 {diff['category_changed']}）")
+        for transition, count in diff['transitions'].items():
+            print(f"  {transition}: {count}")
+        for sample in diff['samples']:
+            print(f"  #{sample['index']} {sample['method']} {sample['url'][:80]}  "
+                  f"{sample['baseline']['rule'] or '-'} -> {sample['candidate']['rule'] or '-'}")
+
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, ensure_ascii=False, indent=2) + '\n', encoding='utf-8')
+        print(f"\n结果已写入 {args.output}")
+    if args.fail_on_diff and diff and diff['changed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""启动耗时基准 - 验证纯规则模式下 main.py 的冷启动时间
+
+用法:
+  python scripts/startup_benchmark.py --runs 5 --max-seconds 1.0
+
+每轮在全新子进程中以 ``python -X importtime`` 导入 main 并构造 WAFSystem
+（强制 detection.anomaly_detection=false），统计：
+  - 进程从启动到 WAFSystem 就绪的总耗时（含解释器启动）
+  - 按顶层包汇总的导入耗时排名
+  - 是否意外导入了 torch 等深度学习依赖
+任一轮超过阈值或导入了深度学习依赖时以非零状态码退出，可直接用于 CI。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# 纯规则模式下不允许出现的模块
+FORBIDDEN_MODULES = ('torch', 'torchvision', 'tensorboard', 'pandas', 'matplotlib')
+
+CHILD_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+waf = main.WAFSystem(config_path=sys.argv[1])
+ready = time.perf_counter() - start
+forbidden = [m for m in {forbidden!r} if m in sys.modules]
+print(json.dumps({{'ready_seconds': ready, 'forbidden_loaded': forbidden,
+                  'dl_enabled': waf.dl_detector is not None}}))
+"""
+
+
+def make_rule_only_config(config_path: Path) -> Path:
+    """复制配置并强制关闭异常检测，返回临时配置文件路径"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    config.setdefault('detection', {})['anomaly_detection'] = False
+    fd, tmp_path = tempfile.mkstemp(prefix='waf_startup_', suffix='.yaml')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+    return Path(tmp_path)
+
+
+def parse_importtime(stderr: str, top: int):
+    """解析 -X importtime 输出，按顶层包汇总自身耗时，返回 [(包名, 毫秒)]"""
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        package = parts[2].strip().split('.')[0]
+        totals[package] = totals.get(package, 0.0) + int(parts[0]) / 1000.0
+    return sorted(totals.items(), key=lambda x: x[1], reverse=True)[:top]
+
+
+def run_once(config_path: Path, top: int):
+    """在子进程中执行一次冷启动"""
+    code = CHILD_CODE.format(forbidden=FORBIDDEN_MODULES)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code, str(config_path)],
+        cwd=str(ROOT_DIR), capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"子进程启动失败:\n{proc.stderr[-2000:]}")
+    report = json.loads(proc.stdout.strip().splitlines()[-1])
+    report['wall_seconds'] = wall
+    report['top_imports'] = parse_importtime(proc.stderr, top)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WAF 纯规则模式冷启动基准')
+    parser.add_argument('--config', default='config/settings.yaml', help='配置文件路径')
+    parser.add_argument('--runs', type=int, default=5, help='测量轮数')
+    parser.add_argument('--max-seconds', type=float, default=1.0,
+                        help='单轮冷启动耗时上限（秒）')
+    parser.add_argument('--top', type=int, default=10, help='展示导入耗时前N的顶层包')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+
+    config_path = make_rule_only_config(ROOT_DIR / args.config)
+    try:
+        reports = [run_once(config_path, args.top) for _ in range(max(1, args.runs))]
+    finally:
+        config_path.unlink(missing_ok=True)
+
+    walls = [r['wall_seconds'] for r in reports]
+    summary = {
+        'runs': len(reports),
+        'wall_seconds_median': statistics.median(walls),
+        'wall_seconds_max': max(walls),
+        'ready_seconds_median': statistics.median(r['ready_seconds'] for r in reports),
+        'forbidden_loaded': sorted({m for r in reports for m in r['forbidden_loaded']}),
+        'top_imports': reports[-1]['top_imports'],
+        'max_seconds': args.max_seconds,
+    }
+    summary['passed'] = (summary['wall_seconds_max'] < args.max_seconds
+                         and not summary['forbidden_loaded'])
+
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print(f"冷启动 {summary['runs']} 轮: 中位数 {summary['wall_seconds_median'] * 1000:.1f}ms, "
+              f"最大 {summary['wall_seconds_max'] * 1000:.1f}ms (上限 {args.max_seconds * 1000:.0f}ms)")
+        print(f"main 导入+初始化中位数: {summary['ready_seconds_median'] * 1000:.1f}ms")
+        print("导入耗时最高的顶层包:")
+        for name, ms in summary['top_imports']:
+            print(f"  {ms:8.1f}ms  {name}")
+        if summary['forbidden_loaded']:
+            print(f"✗ 纯规则模式下导入了深度学习依赖: {summary['forbidden_loaded']}")
+        print('✓ PASS' if summary['passed'] else '✗ FAIL')
+
+    sys.exit(0 if summary['passed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""DL检测模型训练 CLI - 从带标签的NDJSON请求日志训练 DLDetector
+
+用法:
+  python scripts/train_dl.py --train data/raw/train.jsonl --val data/raw/val.jsonl \\
+      --epochs 10 --workers 8
+
+NDJSON 每行一个请求，例如:
+  {"method": "GET", "url": "/api/user?id=1 OR 1=1", "body": "", "label": "attack"}
+  {"text": "GET /index.html", "label": 0}
+
+流程:
+  1. 多进程流式提取特征，写入 --cache-dir 下的 .npy 分片（内容不变时直接复用）
+  2. 以内存映射方式读取分片，构造 IterableDataset 喂给 DLDetector.train
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.core.dataset import build_feature_cache
+
+logger = logging.getLogger('train_dl')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DL检测模型训练')
+    parser.add_argument('--train', nargs='+', required=True, help='训练集NDJSON文件')
+    parser.add_argument('--val', nargs='*', default=[], help='验证集NDJSON文件')
+    parser.add_argument('--label-field', default='label', help='标签字段名')
+    parser.add_argument('--cache-dir', default='data/cache/features', help='特征缓存目录')
+    parser.add_argument('--shard-size', type=int, default=50000, help='每个分片的样本数')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='特征提取进程数（默认CPU核数）')
+    parser.add_argument('--loader-workers', type=int, default=0,
+                        help='DataLoader 读取分片的进程数')
+    parser.add_argument('--feature-dim', type=int, default=256, help='特征维度')
+    parser.add_argument('--batch-size', type=int, default=256, help='批大小')
+    parser.add_argument('--epochs', type=int, default=10, help='训练轮数')
+    parser.add_argument('--lr', type=float, default=0.001, help='学习率')
+    parser.add_argument('--model-path', default='models/saved/dl_model.pth', help='模型保存路径')
+    parser.add_argument('--device', default=None, help='cpu 或 cuda（默认自动选择）')
+    parser.add_argument('--extract-only', action='store_true', help='只生成特征缓存，不训练')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    # 先完成特征提取，工作进程不需要导入 PyTorch
+    train_manifest = build_feature_cache(args.train, args.cache_dir, args.feature_dim,
+                                         args.shard_size, args.workers, args.label_field)
+    val_manifest = None
+    if args.val:
+        val_manifest = build_feature_cache(args.val, args.cache_dir, args.feature_dim,
+                                           args.shard_size, args.workers, args.label_field)
+    logger.info(f"训练样本: {train_manifest.total} (攻击 {train_manifest.attacks})")
+    if train_manifest.total == 0:
+        logger.error("训练集中没有可用的带标签样本")
+        sys.exit(1)
+    if args.extract_only:
+        return
+
+    from torch.utils.data import DataLoader
+    from src.core.dl_detector import DLDetector, ShardedFeatureDataset
+
+    train_loader = DataLoader(
+        ShardedFeatureDataset(train_manifest, batch_size=args.batch_size, shuffle=True),
+        batch_size=None, num_workers=args.loader_workers
+    )
+    val_loader = None
+    if val_manifest is not None and val_manifest.total > 0:
+        val_loader = DataLoader(
+            ShardedFeatureDataset(val_manifest, batch_size=args.batch_size, shuffle=False),
+            batch_size=None, num_workers=args.loader_workers
+        )
+
+    detector = DLDetector(model_path=args.model_path, feature_dim=args.feature_dim,
+                          device=args.device)
+    detector.train(train_loader, val_loader, epochs=args.epochs, learning_rate=args.lr,
+                   save_interval=max(1, args.epochs))
+    detector.save_model()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""
+封禁名单 - 手动封禁与自动封禁
+- 在窗口内被拦截达到阈值的来源 IP 自动封禁 ban_seconds 秒
+- 封禁判定只是一次哈希表查询，在白名单之后、规则匹配之前执行，重复探测的攻击者几乎零开销被拒绝
+- 过期由哈希时间轮（hashed timer wheel）惰性清理：每个 tick 只处理一个槽位，不需要后台线程
+"""
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TICK_SECONDS = 1.0
+DEFAULT_WHEEL_SLOTS = 512
+
+
+class TimerWheel:
+    """
+    哈希时间轮：到期时刻按 tick 取整后散列到槽位，超出一圈的条目留在槽中直到轮到其到期 tick
+
+    schedule/advance 的均摊开销与条目总数无关；条目被提前删除或续期时不从轮中移除，
+    由调用方在到期回调时自行核对（惰性删除）。
+    """
+
+    def __init__(self, tick_seconds: float = DEFAULT_TICK_SECONDS, slots: int = DEFAULT_WHEEL_SLOTS,
+                 now: Optional[float] = None):
+        self.tick_seconds = tick_seconds
+        self._slots: List[List[Tuple[int, Hashable]]] = [[] for _ in range(slots)]
+        self.current_tick = int((time.monotonic() if now is None else now) / tick_seconds)
+        self.pending = 0
+
+    def schedule(self, key: Hashable, deadline: float):
+        due = max(math.ceil(deadline / self.tick_seconds), self.current_tick + 1)
+        self._slots[due % len(self._slots)].append((due, key))
+        self.pending += 1
+
+    def advance(self, now: float) -> List[Hashable]:
+        """推进到 now，返回到期的键"""
+        target = int(now / self.tick_seconds)
+        if target <= self.current_tick:
+            return []
+        size = len(self._slots)
+        if target - self.current_tick >= size:
+            indexes = range(size)
+        else:
+            indexes = [t % size for t in range(self.current_tick + 1, target + 1)]
+        expired = []
+        for index in indexes:
+            slot = self._slots[index]
+            if not slot:
+                continue
+            keep = []
+            for due, key in slot:
+                if due <= target:
+                    expired.append(key)
+                else:
+                    keep.append((due, key))
+            self._slots[index] = keep
+        self.current_tick = target
+        self.pending -= len(expired)
+        return expired
+
+
+@dataclass
+class BanEntry:
+    ip: str
+    reason: str
+    source: str  # manual / auto
+    created_at: float  # 墙钟时间
+    expires_at: Optional[float]  # monotonic 时刻，None 为永久封禁
+    hits: int = 0
+
+    def remaining(self, now: float) -> Optional[float]:
+        return None if self.expires_at is None else max(0.0, self.expires_at - now)
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        remaining = self.remaining(now)
+        return {
+            'ip': self.ip,
+            'reason': self.reason,
+            'source': self.source,
+            'created_at': self.created_at,
+            'expires_in': round(remaining, 1) if remaining is not None else None,
+            'permanent': self.expires_at is None,
+            'hits': self.hits,
+        }
+
+
+@dataclass
+class _Offense:
+    count: int
+    window_end: float
+
+
+@dataclass
+class BanStats:
+    hits: int = 0
+    auto_bans: int = 0
+    manual_bans: int = 0
+    expired: int = 0
+    offenses: int = 0
+
+
+class BanList:
+    """
+    封禁名单
+
+    Args:
+        auto_ban: 是否启用自动封禁
+        threshold: 窗口内被拦截多少次后封禁
+        window_seconds: 计数窗口（固定窗口，从首次拦截起算）
+        ban_seconds: 自动封禁时长
+    """
+
+    def __init__(self, auto_ban: bool = True, threshold: int = 10, window_seconds: float = 60,
+                 ban_seconds: float = 600, tick_seconds: float = DEFAULT_TICK_SECONDS,
+                 clock=time.monotonic):
+        self.auto_ban = auto_ban
+        self.threshold = max(1, int(threshold))
+        self.window_seconds = float(window_seconds)
+        self.ban_seconds = float(ban_seconds)
+        self._clock = clock
+        self._bans: Dict[str, BanEntry] = {}
+        self._offenses: Dict[str, _Offense] = {}
+        self._wheel = TimerWheel(tick_seconds, now=clock())
+        self._lock = threading.Lock()
+        self.stats = BanStats()
+
+    # ---- 热路径 ----
+
+    def check(self, ip: str) -> Optional[BanEntry]:
+        """来源 IP 处于封禁期内时返回封禁项并累加命中计数
+
+        未封禁（绝大多数请求）只做一次无锁的字典查找；命中后在锁内累加计数，避免并发请求丢失计数。
+        """
+        if not ip:
+            return None
+        now = self._clock()
+        if int(now / self._wheel.tick_seconds) != self._wheel.current_tick:
+            self._expire(now)
+        entry = self._bans.get(ip)
+        if entry is None or (entry.expires_at is not None and entry.expires_at <= now):
+            return None
+        with self._lock:
+            entry.hits += 1
+            self.stats.hits += 1
+        return entry
+
+    def record_block(self, ip: str) -> Optional[BanEntry]:
+        """记录一次拦截；窗口内达到阈值时自动封禁并返回新封禁项"""
+        if not self.auto_ban or not ip:
+            return None
+        now = self._clock()
+        with self._lock:
+            offense = self._offenses.get(ip)
+            if offense is None or offense.window_end <= now:
+                offense = self._offenses[ip] = _Offense(0, now + self.window_seconds)
+                self._wheel.schedule(('offense', ip), offense.window_end)
+            offense.count += 1
+            self.stats.offenses += 1
+            if offense.count < self.threshold:
+                return None
+            del self._offenses[ip]
+        entry = self.ban(ip, self.ban_seconds,
+                         f"{self.window_seconds:g}s 内被拦截 {offense.count} 次", source='auto')
+        logger.warning(f"自动封禁 {ip} {self.ban_seconds:g}s: {entry.reason}")
+        return entry
+
+    # ---- 管理 ----
+
+    def ban(self, ip: str, ttl_seconds: Optional[float] = None, reason: str = '',
+            source: str = 'manual') -> BanEntry:
+        """封禁 IP；ttl_seconds 为 None 或 0 时永久封禁，已封禁时按新参数续期"""
+        now = self._clock()
+        expires_at = now + ttl_seconds if ttl_seconds else None
+        with self._lock:
+            entry = self._bans.get(ip)
+            if entry is None:
+                entry = BanEntry(ip, reason, source, time.time(), expires_at)
+                self._bans[ip] = entry
+            else:
+                entry.reason, entry.source, entry.expires_at = reason or entry.reason, source, expires_at
+            if expires_at is not None:
+                self._wheel.schedule(('ban', ip), expires_at)
+            if source == 'auto':
+                self.stats.auto_bans += 1
+            else:
+                self.stats.manual_bans += 1
+        return entry
+
+    def unban(self, ip: str) -> bool:
+        with self._lock:
+            self._offenses.pop(ip, None)
+            return self._bans.pop(ip, None) is not None
+
+    def _expire(self, now: float):
+        """推进时间轮，清理已到期的封禁与计数窗口；拿不到锁时留给下一次调用"""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            for kind, ip in self._wheel.advance(now):
+                if kind == 'ban':
+                    entry = self._bans.get(ip)
+                    # 续期或已解除的封禁在轮中留有旧条目，按实际到期时刻核对
+                    if entry is not None and entry.expires_at is not None and entry.expires_at <= now:
+                        del self._bans[ip]
+                        self.stats.expired += 1
+                else:
+                    offense = self._offenses.get(ip)
+                    if offense is not None and offense.window_end <= now:
+                        del self._offenses[ip]
+        finally:
+            self._lock.release()
+
+    def list_bans(self) -> List[Dict[str, Any]]:
+        now = self._clock()
+        self._expire(now)
+        entries = [e for e in list(self._bans.values()) if e.expires_at is None or e.expires_at > now]
+        return [e.to_dict(now) for e in sorted(entries, key=lambda e: -e.created_at)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._expire(self._clock())
+        return {
+            'active': len(self._bans),
+            'tracked_offenders': len(self._offenses),
+            'hits': self.stats.hits,
+            'auto_bans': self.stats.auto_bans,
+            'manual_bans': self.stats.manual_bans,
+            'expired': self.stats.expired,
+            'auto_ban': {'enabled': self.auto_ban, 'threshold': self.threshold,
+                         'window_seconds': self.window_seconds, 'ban_seconds': self.ban_seconds},
+        }
+
+    # ---- 兼容原先的 set 接口 ----
+
+    def add(self, ip: str):
+        self.ban(ip)
+
+    def discard(self, ip: str):
+        self.unban(ip)
+
+    def __contains__(self, ip) -> bool:
+        entry = self._bans.get(ip)
+        return entry is not None and (entry.expires_at is None or entry.expires_at > self._clock())
+
+    def __len__(self) -> int:
+        return len(self._bans)
+
+    def __iter__(self):
+        return iter(list(self._bans))
+
+
+class SharedBanList(BanList):
+    """
+    跨进程封禁名单：封禁项、拦截计数窗口与统计都存放在 SharedState 的共享表中，
+    任一工作进程的封禁或拦截立即对所有工作进程生效
+
+    共享表定长，过期条目在访问时惰性删除，表满时优先淘汰最早到期的条目，不使用时间轮。
+    封禁原因最多保存 REASON_BYTES 字节。
+    """
+
+    REASON_BYTES = 96
+    _SOURCES = ('manual', 'auto')
+
+    def __init__(self, shared, slots: int = 65536, auto_ban: bool = True, threshold: int = 10,
+                 window_seconds: float = 60, ban_seconds: float = 600, clock=time.monotonic):
+        self.auto_ban = auto_ban
+        self.threshold = max(1, int(threshold))
+        self.window_seconds = float(window_seconds)
+        self.ban_seconds = float(ban_seconds)
+        self._clock = clock
+        # 封禁: (到期时刻, 创建时间, 命中数, 来源)，永久封禁的到期时刻为 inf
+        self._shared_bans = shared.table(slots, 4, evict_field=0, text_bytes=self.REASON_BYTES)
+        # 拦截计数: (次数, 窗口结束时刻)
+        self._shared_offenses = shared.table(slots, 2, evict_field=1)
+        self._counters = shared.counters
+
+    @property
+    def stats(self) -> BanStats:
+        get = self._counters.get
+        return BanStats(hits=get('ban.hits'), auto_bans=get('ban.auto_bans'), manual_bans=get('ban.manual_bans'),
+                        expired=get('ban.expired'), offenses=get('ban.offenses'))
+
+    def _entry(self, ip: str, values, reason: str) -> BanEntry:
+        expires_at, created_at, hits, source = values
+        return BanEntry(ip, reason, self._SOURCES[int(source)], created_at,
+                        None if math.isinf(expires_at) else expires_at, int(hits))
+
+    def check(self, ip: str) -> Optional[BanEntry]:
+        if not ip or not len(self._shared_bans):
+            return None
+        now = self._clock()
+        expired = []
+
+        def hit(values):
+            if values is None:
+                return None
+            if values[0] <= now:
+                expired.append(True)
+                return None
+            return values[0], values[1], values[2] + 1, values[3]
+
+        result = self._shared_bans.update(ip, hit)
+        if expired:
+            self._counters.add('ban.expired')
+        if result is None:
+            return None
+        self._counters.add('ban.hits')
+        return self._entry(ip, *result)
+
+    def record_block(self, ip: str) -> Optional[BanEntry]:
+        if not self.auto_ban or not ip:
+            return None
+        now = self._clock()
+
+        def count(values):
+            if values is None or values[1] <= now:
+                values = (0, now + self.window_seconds)
+            if values[0] + 1 >= self.threshold:
+                return None
+            return values[0] + 1, values[1]
+
+        self._counters.add('ban.offenses')
+        if self._shared_offenses.update(ip, count) is not None:
+            return None
+        entry = self.ban(ip, self.ban_seconds,
+                         f"{self.window_seconds:g}s 内被拦截 {self.threshold} 次", source='auto')
+        logger.warning(f"自动封禁 {ip} {self.ban_seconds:g}s: {entry.reason}")
+        return entry
+
+    def ban(self, ip: str, ttl_seconds: Optional[float] = None, reason: str = '',
+            source: str = 'manual') -> BanEntry:
+        expires_at = self._clock() + ttl_seconds if ttl_seconds else math.inf
+        created_at = time.time()
+
+        def put(values):
+            if values is None:
+                return expires_at, created_at, 0, self._SOURCES.index(source)
+            return expires_at, values[1], values[2], self._SOURCES.index(source)
+
+        result = self._shared_bans.update(ip, put, text=reason or None)
+        self._counters.add('ban.auto_bans' if source == 'auto' else 'ban.manual_bans')
+        return self._entry(ip, *result)
+
+    def unban(self, ip: str) -> bool:
+        self._shared_offenses.delete(ip)
+        return self._shared_bans.delete(ip)
+
+    def _expire(self, now: float):
+        """共享表在访问时惰性清理，不需要时间轮"""
+
+    def _active(self) -> List[BanEntry]:
+        now = self._clock()
+        return [self._entry(ip, values, reason) for ip, values, reason in self._shared_bans.items()
+                if values[0] > now]
+
+    def list_bans(self) -> List[Dict[str, Any]]:
+        now = self._clock()
+        return [e.to_dict(now) for e in sorted(self._active(), key=lambda e: -e.created_at)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.stats
+        return {
+            'active': len(self._active()),
+            'tracked_offenders': len(self._shared_offenses),
+            'hits': stats.hits,
+            'auto_bans': stats.auto_bans,
+            'manual_bans': stats.manual_bans,
+            'expired': stats.expired,
+            'shared': True,
+            'auto_ban': {'enabled': self.auto_ban, 'threshold': self.threshold,
+                         'window_seconds': self.window_seconds, 'ban_seconds': self.ban_seconds},
+        }
+
+    def __contains__(self, ip) -> bool:
+        entry = self._shared_bans.get(ip) if ip else None
+        return entry is not None and entry[0][0] > self._clock()
+
+    def __len__(self) -> int:
+        return len(self._shared_bans)
+
+    def __iter__(self):
+        return iter([e.ip for e in self._active()])
@@ -0,0 +1,260 @@
+"""
+训练数据管道 - 流式读取带标签的NDJSON请求，多进程提取特征并缓存为 .npy 分片
+仅依赖 numpy，特征提取工作进程不会导入 PyTorch
+"""
+import hashlib
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from src.core.features import FeatureExtractor
+from src.utils.web_tools import HTTPRequestParser
+
+logger = logging.getLogger(__name__)
+
+# 特征提取逻辑或分片格式变化时递增，使旧缓存自动失效
+CACHE_FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+ATTACK_LABELS = {'1', 'attack', 'malicious', 'true', 'block', 'blocked'}
+NORMAL_LABELS = {'0', 'normal', 'benign', 'false', 'allow', 'allowed'}
+
+# 每个工作进程复用一个特征提取器
+_WORKER_EXTRACTORS: Dict[int, FeatureExtractor] = {}
+
+
+def parse_label(value: Any) -> Optional[int]:
+    """将多种标签写法统一为 0（正常）/ 1（攻击），无法识别时返回 None"""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return int(value) if value in (0, 1) else None
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in ATTACK_LABELS:
+            return 1
+        if text in NORMAL_LABELS:
+            return 0
+    return None
+
+
+def iter_labeled_requests(paths: Iterable[str], label_field: str = 'label',
+                          stats: Optional[Dict[str, int]] = None) -> Iterator[Tuple[str, int]]:
+    """
+    逐行流式读取NDJSON请求文件
+    
+    每行一个JSON对象：包含 ``text`` 字段时直接使用，否则与在线推理一致，由
+    ``HTTPRequestParser.request_text`` 按 method/url/body 拼接请求文本（不含请求头）；
+    标签取自 ``label_field``。
+    
+    Args:
+        paths: NDJSON文件路径列表
+        label_field: 标签字段名
+        stats: 可选的计数字典，累计 records/skipped
+        
+    Yields:
+        (请求文本, 标签)
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault('records', 0)
+    stats.setdefault('skipped', 0)
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"{path}:{line_no} 不是合法的JSON，已跳过")
+                    stats['skipped'] += 1
+                    continue
+                label = parse_label(record.get(label_field)) if isinstance(record, dict) else None
+                if label is None:
+                    stats['skipped'] += 1
+                    continue
+                text = record.get('text')
+                if not isinstance(text, str):
+                    text = HTTPRequestParser.request_text(record)
+                stats['records'] += 1
+                yield text, label
+
+
+def iter_chunks(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """将迭代器切分为定长列表，最后一块可能不足 size"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def file_digest(path: str, block_size: int = 1 << 20) -> str:
+    """流式计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dataset_fingerprint(paths: Iterable[str], feature_dim: int, shard_size: int,
+                        label_field: str = 'label') -> str:
+    """根据输入文件内容和提取参数计算缓存键"""
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_FORMAT_VERSION}|{feature_dim}|{shard_size}|{label_field}".encode())
+    for path in paths:
+        digest.update(b'|')
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def _save_npy(path: Path, array: np.ndarray):
+    """先写临时文件再原子替换，避免中断留下半个分片"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _featurize_shard(root: str, index: int, texts: List[str], labels: List[int],
+                     feature_dim: int) -> Dict[str, Any]:
+    """工作进程入口：提取一个分片的特征并写入磁盘"""
+    extractor = _WORKER_EXTRACTORS.get(feature_dim)
+    if extractor is None:
+        extractor = _WORKER_EXTRACTORS[feature_dim] = FeatureExtractor(feature_dim)
+    features = extractor.extract_batch(texts)
+    label_array = np.asarray(labels, dtype=np.int64)
+
+    features_name = f"shard_{index:06d}_x.npy"
+    labels_name = f"shard_{index:06d}_y.npy"
+    _save_npy(Path(root) / features_name, features)
+    _save_npy(Path(root) / labels_name, label_array)
+    return {
+        'features': features_name,
+        'labels': labels_name,
+        'count': int(label_array.shape[0]),
+        'attacks': int(label_array.sum()),
+    }
+
+
+@dataclass
+class FeatureCacheManifest:
+    """特征缓存清单 - 记录分片文件及其样本数，清单最后写入，存在即代表缓存完整"""
+    root: Path
+    key: str
+    feature_dim: int
+    shards: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return sum(s['count'] for s in self.shards)
+
+    @property
+    def attacks(self) -> int:
+        return sum(s.get('attacks', 0) for s in self.shards)
+
+    @classmethod
+    def load(cls, root: Path) -> Optional['FeatureCacheManifest']:
+        """读取清单，不存在或损坏时返回 None"""
+        path = Path(root) / MANIFEST_NAME
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != CACHE_FORMAT_VERSION:
+                return None
+            return cls(root=Path(root), key=data['key'],
+                       feature_dim=data['feature_dim'], shards=data['shards'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self):
+        """原子写入清单"""
+        path = self.root / MANIFEST_NAME
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': CACHE_FORMAT_VERSION,
+                'key': self.key,
+                'feature_dim': self.feature_dim,
+                'total': self.total,
+                'shards': self.shards,
+            }, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def load_shard(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """以内存映射方式打开分片，返回 (特征矩阵, 标签)"""
+        shard = self.shards[index]
+        features = np.load(self.root / shard['features'], mmap_mode='r')
+        labels = np.load(self.root / shard['labels'], mmap_mode='r')
+        return features, labels
+
+
+def build_feature_cache(paths: List[str], cache_dir: str = 'data/cache/features',
+                        feature_dim: int = 256, shard_size: int = 50000,
+                        workers: Optional[int] = None,
+                        label_field: str = 'label') -> FeatureCacheManifest:
+    """
+    构建（或复用）特征缓存
+    
+    输入文件内容与参数不变时直接返回已有清单，跳过特征提取。
+    同时在途的分片数限制为 2 * workers，内存占用与数据总量无关。
+    
+    Args:
+        paths: NDJSON文件路径列表
+        cache_dir: 缓存根目录
+        feature_dim: 特征维度
+        shard_size: 每个分片的样本数
+        workers: 特征提取进程数，<=1 时在当前进程内执行
+        label_field: 标签字段名
+        
+    Returns:
+        特征缓存清单
+    """
+    key = dataset_fingerprint(paths, feature_dim, shard_size, label_field)
+    root = Path(cache_dir) / key[:16]
+    manifest = FeatureCacheManifest.load(root)
+    if manifest is not None and manifest.key == key:
+        logger.info(f"命中特征缓存: {root} ({manifest.total} 条样本)")
+        return manifest
+
+    root.mkdir(parents=True, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    stats: Dict[str, int] = {}
+    chunks = iter_chunks(iter_labeled_requests(paths, label_field, stats), shard_size)
+    shards = []
+
+    if workers <= 1:
+        for index, chunk in enumerate(chunks):
+            texts, labels = zip(*chunk)
+            shards.append(_featurize_shard(str(root), index, list(texts), list(labels), feature_dim))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for index, chunk in enumerate(chunks):
+                texts, labels = zip(*chunk)
+                pending.append(pool.submit(_featurize_shard, str(root), index,
+                                           list(texts), list(labels), feature_dim))
+                if len(pending) >= workers * 2:
+                    shards.append(pending.popleft().result())
+            while pending:
+                shards.append(pending.popleft().result())
+
+    manifest = FeatureCacheManifest(root=root, key=key, feature_dim=feature_dim, shards=shards)
+    manifest.save()
+    logger.info(f"特征缓存已生成: {root} ({manifest.total} 条样本, {len(shards)} 个分片, "
+                f"跳过 {stats.get('skipped', 0)} 行)")
+    return manifest
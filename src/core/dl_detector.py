@@ -5,13 +5,23 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
+from torch.utils.data import IterableDataset, get_worker_info
 from typing import Tuple, List, Dict, Any
 import numpy as np
 from pathlib import Path
 import logging
 import json
+import hashlib
+import threading
+import time
+import copy
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
+from src.core.features import FeatureExtractor
+from src.core.dataset import FeatureCacheManifest
+
 logger = logging.getLogger(__name__)
 
 
@@ -63,67 +73,298 @@ class DLDetectionModel(nn.Module):
         return x
 
 
-class FeatureExtractor:
-    """从HTTP请求中提取特征"""
-    
-    def __init__(self, feature_dim: int = 256):
-        """初始化特征提取器"""
-        self.feature_dim = feature_dim
-        self.char_set = set()
-        self._build_char_set()
+class ShardedFeatureDataset(IterableDataset):
+    """基于特征缓存分片的流式数据集 - 内存映射读取，直接按批次产出张量
     
-    def _build_char_set(self):
-        """构建字符集"""
-        # 包括常见的Web攻击特征字符
-        self.char_set = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
-                           '!@#$%^&*()_+-=[]{}|;:\'",.<>?/\\`~ ')
-        self.char_to_idx = {char: idx for idx, char in enumerate(sorted(self.char_set))}
+    配合 ``DataLoader(dataset, batch_size=None, num_workers=k)`` 使用，
+    多个加载进程时按分片均分，任意时刻只有当前批次被读入内存。
+    """
     
-    def extract_features(self, request_text: str) -> np.ndarray:
+    def __init__(self, manifest: FeatureCacheManifest, batch_size: int = 256,
+                 shuffle: bool = True, seed: int = 0):
         """
-        从请求文本提取特征向量
-        
         Args:
-            request_text: HTTP请求的文本表示
-            
-        Returns:
-            特征向量 (feature_dim,)
+            manifest: 特征缓存清单（见 src.core.dataset.build_feature_cache）
+            batch_size: 批大小
+            shuffle: 是否打乱分片顺序与分片内样本顺序
+            seed: 随机种子
         """
-        features = np.zeros(self.feature_dim)
-        # 仅保留允许字符并限制长度，防止异常字符和超长输入
-        text = request_text.lower()[:1000]
-        text = ''.join(ch for ch in text if ch in self.char_set)
-        
-        # 特征1-5: 基本统计
-        features[0] = len(text)  # 请求长度
-        features[1] = text.count('select') + text.count('insert') + text.count('delete')  # SQL关键字
-        features[2] = text.count('<') + text.count('>')  # HTML标签
-        features[3] = text.count('%') + text.count('\\x')  # 编码字符
-        features[4] = text.count('../') + text.count('..\\')  # 目录遍历
-        
-        # 特征5-10: 特殊字符统计
-        features[5] = text.count(';')
-        features[6] = text.count('(') + text.count(')')
-        features[7] = text.count('\'') + text.count('"')
-        features[8] = text.count('=')
-        features[9] = text.count('&')
-        
-        # 特征10+: 字符频率（简化版）
-        for i, char in enumerate(sorted(self.char_set)[:self.feature_dim-10]):
-            features[10 + i] = text.count(char)
+        self.manifest = manifest
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+    
+    def __len__(self) -> int:
+        """批次数"""
+        return sum(-(-s['count'] // self.batch_size) for s in self.manifest.shards)
+    
+    def __iter__(self):
+        worker = get_worker_info()
+        shard_ids = list(range(len(self.manifest.shards)))
+        if worker is None:
+            seed = self.seed + self.epoch
+            self.epoch += 1
+        else:
+            # DataLoader 每轮为加载进程生成新的种子，保证各轮顺序不同
+            seed = worker.seed % (2 ** 32)
+        rng = np.random.default_rng(seed)
+        if self.shuffle:
+            rng.shuffle(shard_ids)
+        if worker is not None:
+            shard_ids = shard_ids[worker.id::worker.num_workers]
         
-        # 归一化
-        max_val = np.max(np.abs(features)) + 1e-6
-        features = features / max_val
+        for shard_id in shard_ids:
+            features, labels = self.manifest.load_shard(shard_id)
+            count = labels.shape[0]
+            order = rng.permutation(count) if self.shuffle else np.arange(count)
+            for start in range(0, count, self.batch_size):
+                # 批内索引排序，提高内存映射读取的局部性
+                idx = np.sort(order[start:start + self.batch_size])
+                yield (torch.from_numpy(np.ascontiguousarray(features[idx])),
+                       torch.from_numpy(np.asarray(labels[idx], dtype=np.int64)))
+
+
+class PredictionCache:
+    """推理结果缓存 - 规范化请求文本哈希 -> (特征, 攻击概率)，LRU淘汰
+    
+    缓存项绑定模型版本，模型权重变化（加载新检查点、训练、保存）时整体失效。
+    """
+    
+    def __init__(self, max_size: int = 10000):
+        """初始化缓存，max_size<=0 时禁用"""
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.model_version = None
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(normalized_text: str) -> bytes:
+        """计算规范化文本的快速哈希"""
+        return hashlib.blake2b(normalized_text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+    
+    def get(self, key: bytes):
+        """查询缓存，命中时返回 (features, attack_prob)"""
+        if self.max_size <= 0:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def put(self, key: bytes, features: np.ndarray, attack_prob: float, model_version):
+        """写入缓存；模型版本已变化时丢弃过期结果"""
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            if model_version != self.model_version:
+                return
+            self.entries[key] = (features, attack_prob)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+    
+    def reset(self, model_version):
+        """模型变化时清空缓存并记录新版本"""
+        with self.lock:
+            self.entries.clear()
+            self.model_version = model_version
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """命中率统计"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'capacity': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'model_version': self.model_version,
+            }
+
+
+class ModelHandle:
+    """已发布模型的引用计数句柄 - 被替换后等在途推理全部结束再释放"""
+    
+    def __init__(self, model: DLDetectionModel, version: str):
+        self.model = model
+        self.version = version
+        self.refcount = 0
+        self.retired = False
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        with self.lock:
+            self.refcount += 1
+    
+    def release(self):
+        with self.lock:
+            self.refcount -= 1
+            should_free = self.retired and self.refcount == 0
+        if should_free:
+            self._free()
+    
+    def retire(self):
+        """标记为已下线，无在途引用时立即释放"""
+        with self.lock:
+            self.retired = True
+            should_free = self.refcount == 0
+        if should_free:
+            self._free()
+    
+    def _free(self):
+        model, self.model = self.model, None
+        if model is not None:
+            del model
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            logger.info(f"旧模型已释放: {self.version}")
+
+
+class ModelRegistry:
+    """模型注册表 - 后台加载、预热、金丝雀校验新检查点，校验通过后原子替换
+    
+    推理方通过 ``acquire()`` 获得当前模型句柄，替换只交换引用，
+    在途推理继续使用旧模型直到结束，不会看到半加载的权重。
+    """
+    
+    # 金丝雀样本：(请求文本, 标签)
+    DEFAULT_CANARY = [
+        ('GET /index.html', 0),
+        ('GET /api/users?page=2&size=20', 0),
+        ('POST /login username=alice&remember=1', 0),
+        ("GET /api/user?id=1' OR '1'='1", 1),
+        ('POST /search <script>alert(document.cookie)</script>', 1),
+        ('GET /download?file=../../../../etc/passwd', 1),
+    ]
+    
+    def __init__(self, detector: 'DLDetector', canary: List[Tuple[str, int]] = None,
+                 min_canary_accuracy: float = 0.0, warmup_rounds: int = 3):
+        """
+        Args:
+            detector: 所属检测器（提供设备、特征提取器与缓存）
+            canary: 金丝雀样本，默认使用 DEFAULT_CANARY
+            min_canary_accuracy: 金丝雀样本最低准确率，0 表示只检查输出合法
+            warmup_rounds: 预热推理轮数
+        """
+        self.detector = detector
+        self.canary = canary or self.DEFAULT_CANARY
+        self.min_canary_accuracy = min_canary_accuracy
+        self.warmup_rounds = warmup_rounds
+        self.current: ModelHandle = None
+        self.lock = threading.Lock()
+        self.loader_thread: threading.Thread = None
+        self.status: Dict[str, Any] = {'state': 'idle', 'last_error': None,
+                                       'last_swap': None, 'last_validation': None}
+    
+    @contextmanager
+    def acquire(self):
+        """获取当前模型句柄，退出上下文时释放引用"""
+        with self.lock:
+            handle = self.current
+            handle.acquire()
+        try:
+            yield handle
+        finally:
+            handle.release()
+    
+    def publish(self, model: DLDetectionModel, version: str):
+        """原子替换当前模型，旧模型在引用归零后释放"""
+        model.eval()
+        handle = ModelHandle(model, version)
+        with self.lock:
+            old, self.current = self.current, handle
+        self.detector.prediction_cache.reset(version)
+        self.status['last_swap'] = datetime.now().isoformat()
+        if old is not None:
+            old.retire()
+        logger.info(f"模型已切换: {old.version if old else None} -> {version}")
+    
+    def build_candidate(self, model_path: Path) -> Tuple[DLDetectionModel, str, List[Dict[str, Any]]]:
+        """从检查点构建新模型实例，不触碰在用模型"""
+        checkpoint = torch.load(model_path, map_location=self.detector.device)
+        model = DLDetectionModel(input_size=self.detector.feature_dim)
+        model.load_state_dict(checkpoint['model_state_dict'])
+        model.to(self.detector.device)
+        model.eval()
+        return model, DLDetector._checkpoint_version(model_path), checkpoint.get('history', [])
+    
+    def validate(self, model: DLDetectionModel) -> Dict[str, Any]:
+        """预热并在金丝雀样本上校验，不合格时抛出 ValueError"""
+        texts = [text for text, _ in self.canary]
+        labels = [label for _, label in self.canary]
+        x = torch.tensor(self.detector.feature_extractor.extract_batch(texts)).to(self.detector.device)
+        start = time.perf_counter()
+        with torch.no_grad():
+            for _ in range(max(1, self.warmup_rounds)):
+                probs = torch.softmax(model(x), dim=1)
+        latency_ms = (time.perf_counter() - start) * 1000 / max(1, self.warmup_rounds)
         
-        return features
+        if probs.shape != (len(texts), 2) or not torch.isfinite(probs).all():
+            raise ValueError("金丝雀校验失败: 模型输出不合法")
+        predicted = (probs[:, 1] > 0.5).long().tolist()
+        accuracy = sum(int(p == l) for p, l in zip(predicted, labels)) / len(labels)
+        if accuracy < self.min_canary_accuracy:
+            raise ValueError(f"金丝雀校验失败: 准确率 {accuracy:.2f} < {self.min_canary_accuracy:.2f}")
+        return {'canary_accuracy': accuracy, 'batch_latency_ms': latency_ms,
+                'samples': len(texts)}
+    
+    def reload(self, model_path: Path = None) -> Dict[str, Any]:
+        """同步加载、校验并切换到新检查点"""
+        model_path = Path(model_path or self.detector.model_path)
+        self.status['state'] = 'loading'
+        try:
+            model, version, history = self.build_candidate(model_path)
+            report = self.validate(model)
+            self.publish(model, version)
+            self.detector.training_history = history
+        except Exception as e:
+            self.status.update({'state': 'failed', 'last_error': str(e)})
+            raise
+        self.status.update({'state': 'ready', 'last_error': None, 'last_validation': report})
+        return report
+    
+    def reload_async(self, model_path: Path = None) -> bool:
+        """在后台线程中重新加载，已有加载任务时返回 False"""
+        with self.lock:
+            if self.loader_thread is not None and self.loader_thread.is_alive():
+                return False
+            self.status['state'] = 'loading'
+            self.loader_thread = threading.Thread(target=self._reload_in_background,
+                                                  args=(model_path,), name='model-reload', daemon=True)
+            self.loader_thread.start()
+        return True
+    
+    def _reload_in_background(self, model_path: Path):
+        try:
+            self.reload(model_path)
+        except Exception as e:
+            logger.error(f"模型热更新失败，继续使用当前模型: {e}")
+    
+    def get_status(self) -> Dict[str, Any]:
+        """注册表状态"""
+        handle = self.current
+        status = dict(self.status)
+        status.update({
+            'version': handle.version if handle else None,
+            'in_flight': handle.refcount if handle else 0,
+        })
+        return status
 
 
 class DLDetector:
     """深度学习检测器 - 管理模型训练和推理"""
     
     def __init__(self, model_path: str = "models/saved/dl_model.pth",
-                 feature_dim: int = 256, device: str = None):
+                 feature_dim: int = 256, device: str = None, cache_size: int = 10000,
+                 min_canary_accuracy: float = 0.0):
         """
         初始化检测器
         
@@ -131,39 +372,61 @@ class DLDetector:
             model_path: 模型保存路径
             feature_dim: 特征维度
             device: 使用的设备（cpu或cuda）
+            cache_size: 推理结果缓存容量，0 表示禁用
+            min_canary_accuracy: 热更新时金丝雀样本最低准确率
         """
         self.model_path = Path(model_path)
         self.feature_dim = feature_dim
         self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
         
         self.feature_extractor = FeatureExtractor(feature_dim)
-        self.model = DLDetectionModel(input_size=feature_dim)
-        self.model.to(self.device)
-        
         self.training_history = []
+        self.prediction_cache = PredictionCache(cache_size)
+        self.registry = ModelRegistry(self, min_canary_accuracy=min_canary_accuracy)
         self.load_model()
     
+    @property
+    def model(self) -> DLDetectionModel:
+        """当前在用的模型（不持有引用，并发替换后可能已被释放；使用期间须通过 registry.acquire() 持有句柄）"""
+        return self.registry.current.model
+    
+    @staticmethod
+    def _checkpoint_version(path: Path) -> str:
+        """检查点文件内容哈希，作为模型版本号"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()[:16]
+    
     def load_model(self):
-        """加载已训练的模型"""
+        """加载已训练的模型：构建新实例并整体替换，不原地修改在用模型"""
         if self.model_path.exists():
             try:
-                checkpoint = torch.load(self.model_path, map_location=self.device)
-                self.model.load_state_dict(checkpoint['model_state_dict'])
-                self.training_history = checkpoint.get('history', [])
+                self.registry.reload(self.model_path)
                 logger.info(f"模型加载成功: {self.model_path}")
+                return
             except Exception as e:
+                if self.registry.current is not None:
+                    logger.warning(f"加载模型失败: {e}，保留当前模型")
+                    return
                 logger.warning(f"加载模型失败: {e}，使用随机初始化")
-                self._initialize_model()
-        else:
+        if self.registry.current is None:
             self._initialize_model()
     
     def _initialize_model(self):
         """初始化模型权重"""
-        for param in self.model.parameters():
+        model = DLDetectionModel(input_size=self.feature_dim)
+        for name, param in model.named_parameters():
             if len(param.shape) > 1:
                 nn.init.xavier_uniform_(param)
+            elif name.startswith('bn') and name.endswith('.weight'):
+                # BatchNorm 缩放系数置零会让整个网络输出常量，训练无法收敛
+                nn.init.ones_(param)
             else:
                 nn.init.zeros_(param)
+        model.to(self.device)
+        self.registry.publish(model, f"init-{datetime.now().timestamp()}")
     
     def predict(self, request_text: str, threshold: float = 0.5) -> Tuple[bool, float, Dict[str, Any]]:
         """
@@ -176,30 +439,47 @@ class DLDetector:
         Returns:
             (是否为攻击, 攻击置信度, 详细信息)
         """
-        self.model.eval()
-        
         try:
-            # 特征提取
-            features = self.feature_extractor.extract_features(request_text)
-            x = torch.tensor(features, dtype=torch.float32).unsqueeze(0).to(self.device)
-            
-            # 推理
-            with torch.no_grad():
-                logits = self.model(x)
-                probs = torch.softmax(logits, dim=1)
-            
-            # 获取预测结果
-            attack_prob = probs[0, 1].item()  # 类别1：攻击
-            is_attack = attack_prob > threshold
-            
-            details = {
-                'confidence': attack_prob,
-                'threshold': threshold,
-                'normal_prob': probs[0, 0].item(),
-                'request_length': len(request_text)
-            }
-            
-            return is_attack, attack_prob, details
+            with self.registry.acquire() as handle:
+                # 规范化文本相同的请求直接复用缓存的特征和推理结果
+                normalized = self.feature_extractor.normalize_text(request_text)
+                cache_key = PredictionCache.make_key(normalized)
+                cached = self.prediction_cache.get(cache_key)
+                if cached is not None:
+                    attack_prob = cached[1]
+                    return attack_prob > threshold, attack_prob, {
+                        'confidence': attack_prob,
+                        'threshold': threshold,
+                        'normal_prob': 1.0 - attack_prob,
+                        'request_length': len(request_text),
+                        'model_version': handle.version,
+                        'cache_hit': True
+                    }
+                
+                # 特征提取
+                features = self.feature_extractor.extract_features(request_text)
+                x = torch.tensor(features, dtype=torch.float32).unsqueeze(0).to(self.device)
+                
+                # 推理
+                with torch.no_grad():
+                    logits = handle.model(x)
+                    probs = torch.softmax(logits, dim=1)
+                
+                # 获取预测结果
+                attack_prob = probs[0, 1].item()  # 类别1：攻击
+                is_attack = attack_prob > threshold
+                self.prediction_cache.put(cache_key, features, attack_prob, handle.version)
+                
+                details = {
+                    'confidence': attack_prob,
+                    'threshold': threshold,
+                    'normal_prob': probs[0, 0].item(),
+                    'request_length': len(request_text),
+                    'model_version': handle.version,
+                    'cache_hit': False
+                }
+                
+                return is_attack, attack_prob, details
         
         except Exception as e:
             logger.error(f"模型预测失败: {e}")
@@ -210,6 +490,8 @@ class DLDetector:
         """
         训练模型
         
+        在当前模型的副本上训练，结束后整体替换，训练期间推理不受影响。
+        
         Args:
             train_loader: 训练数据加载器
             val_loader: 验证数据加载器
@@ -217,23 +499,27 @@ class DLDetector:
             learning_rate: 学习率
             save_interval: 保存间隔（轮）
         """
+        # 复制期间持有句柄，并发的热更新不会释放正在复制的模型
+        with self.registry.acquire() as handle:
+            model = copy.deepcopy(handle.model)
         criterion = nn.CrossEntropyLoss()
-        optimizer = optim.Adam(self.model.parameters(), lr=learning_rate)
+        optimizer = optim.Adam(model.parameters(), lr=learning_rate)
         scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=3)
         
-        self.model.train()
+        model.train()
         
         for epoch in range(epochs):
             train_loss = 0.0
             correct = 0
             total = 0
+            num_batches = 0
             
             for features, labels in train_loader:
                 features = features.to(self.device)
                 labels = labels.to(self.device)
                 
                 # 前向传播
-                outputs = self.model(features)
+                outputs = model(features)
                 loss = criterion(outputs, labels)
                 
                 # 反向传播
@@ -246,15 +532,17 @@ class DLDetector:
                 _, predicted = torch.max(outputs, 1)
                 correct += (predicted == labels).sum().item()
                 total += labels.size(0)
+                num_batches += 1
             
             train_acc = correct / total if total > 0 else 0
-            avg_loss = train_loss / len(train_loader) if train_loader else 0
+            # 流式数据集不一定支持 len()，按实际批次数求平均
+            avg_loss = train_loss / num_batches if num_batches else 0
             
             # 验证
             val_loss = 0.0
             val_acc = 0.0
-            if val_loader:
-                val_loss, val_acc = self._validate(val_loader, criterion)
+            if val_loader is not None:
+                val_loss, val_acc = self._validate(model, val_loader, criterion)
                 scheduler.step(val_loss)
             
             # 记录
@@ -272,49 +560,60 @@ class DLDetector:
             
             # 定期保存
             if (epoch + 1) % save_interval == 0:
-                self.save_model()
+                self.save_model(model)
+        
+        self.registry.publish(model, f"train-{datetime.now().timestamp()}")
     
-    def _validate(self, val_loader, criterion) -> Tuple[float, float]:
+    def _validate(self, model: DLDetectionModel, val_loader, criterion) -> Tuple[float, float]:
         """验证模型"""
-        self.model.eval()
+        model.eval()
         val_loss = 0.0
         correct = 0
         total = 0
+        num_batches = 0
         
         with torch.no_grad():
             for features, labels in val_loader:
                 features = features.to(self.device)
                 labels = labels.to(self.device)
                 
-                outputs = self.model(features)
+                outputs = model(features)
                 loss = criterion(outputs, labels)
                 val_loss += loss.item()
                 
                 _, predicted = torch.max(outputs, 1)
                 correct += (predicted == labels).sum().item()
                 total += labels.size(0)
+                num_batches += 1
         
-        self.model.train()
-        return val_loss / len(val_loader) if val_loader else 0, correct / total if total > 0 else 0
+        model.train()
+        return val_loss / num_batches if num_batches else 0, correct / total if total > 0 else 0
     
-    def save_model(self):
-        """保存模型"""
+    def save_model(self, model: DLDetectionModel = None):
+        """保存模型（默认保存当前在用的模型）"""
+        if model is None:
+            with self.registry.acquire() as handle:
+                return self.save_model(handle.model)
         self.model_path.parent.mkdir(parents=True, exist_ok=True)
         
         checkpoint = {
-            'model_state_dict': self.model.state_dict(),
+            'model_state_dict': model.state_dict(),
             'history': self.training_history,
             'feature_dim': self.feature_dim,
             'timestamp': datetime.now().isoformat()
         }
         
-        torch.save(checkpoint, self.model_path)
+        # 先写临时文件再替换，热更新不会读到写了一半的检查点
+        tmp_path = self.model_path.with_name(self.model_path.name + '.tmp')
+        torch.save(checkpoint, tmp_path)
+        tmp_path.replace(self.model_path)
         logger.info(f"模型已保存: {self.model_path}")
     
     def get_model_info(self) -> Dict[str, Any]:
         """获取模型信息"""
-        total_params = sum(p.numel() for p in self.model.parameters())
-        trainable_params = sum(p.numel() for p in self.model.parameters() if p.requires_grad)
+        with self.registry.acquire() as handle:
+            total_params = sum(p.numel() for p in handle.model.parameters())
+            trainable_params = sum(p.numel() for p in handle.model.parameters() if p.requires_grad)
         
         return {
             'model_path': str(self.model_path),
@@ -323,5 +622,7 @@ class DLDetector:
             'total_parameters': total_params,
             'trainable_parameters': trainable_params,
             'training_epochs': len(self.training_history),
-            'model_exists': self.model_path.exists()
+            'model_exists': self.model_path.exists(),
+            'prediction_cache': self.prediction_cache.get_stats(),
+            'registry': self.registry.get_status()
         }
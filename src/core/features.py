@@ -0,0 +1,81 @@
+"""
+特征提取模块 - 将HTTP请求文本转换为定长特征向量
+仅依赖 numpy，训练数据管道的工作进程和推理侧共用，无需导入 PyTorch
+"""
+from typing import Iterable
+import numpy as np
+
+
+class FeatureExtractor:
+    """从HTTP请求中提取特征"""
+    
+    def __init__(self, feature_dim: int = 256):
+        """初始化特征提取器"""
+        self.feature_dim = feature_dim
+        self.char_set = set()
+        self._build_char_set()
+    
+    def _build_char_set(self):
+        """构建字符集"""
+        # 包括常见的Web攻击特征字符
+        self.char_set = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+                           '!@#$%^&*()_+-=[]{}|;:\'",.<>?/\\`~ ')
+        self.char_to_idx = {char: idx for idx, char in enumerate(sorted(self.char_set))}
+    
+    def normalize_text(self, request_text: str) -> str:
+        """特征提取前的规范化文本，规范化结果相同的请求特征必然相同"""
+        # 仅保留允许字符并限制长度，防止异常字符和超长输入
+        text = request_text.lower()[:1000]
+        return ''.join(ch for ch in text if ch in self.char_set)
+    
+    def extract_features(self, request_text: str) -> np.ndarray:
+        """
+        从请求文本提取特征向量
+        
+        Args:
+            request_text: HTTP请求的文本表示
+            
+        Returns:
+            特征向量 (feature_dim,)
+        """
+        features = np.zeros(self.feature_dim)
+        text = self.normalize_text(request_text)
+        
+        # 特征1-5: 基本统计
+        features[0] = len(text)  # 请求长度
+        features[1] = text.count('select') + text.count('insert') + text.count('delete')  # SQL关键字
+        features[2] = text.count('<') + text.count('>')  # HTML标签
+        features[3] = text.count('%') + text.count('\\x')  # 编码字符
+        features[4] = text.count('../') + text.count('..\\')  # 目录遍历
+        
+        # 特征5-10: 特殊字符统计
+        features[5] = text.count(';')
+        features[6] = text.count('(') + text.count(')')
+        features[7] = text.count('\'') + text.count('"')
+        features[8] = text.count('=')
+        features[9] = text.count('&')
+        
+        # 特征10+: 字符频率（简化版）
+        for i, char in enumerate(sorted(self.char_set)[:self.feature_dim-10]):
+            features[10 + i] = text.count(char)
+        
+        # 归一化
+        max_val = np.max(np.abs(features)) + 1e-6
+        features = features / max_val
+        
+        return features
+
+    def extract_batch(self, request_texts: Iterable[str]) -> np.ndarray:
+        """
+        批量提取特征
+        
+        Args:
+            request_texts: 请求文本序列
+            
+        Returns:
+            特征矩阵 (n, feature_dim)，float32
+        """
+        rows = [self.extract_features(text) for text in request_texts]
+        if not rows:
+            return np.zeros((0, self.feature_dim), dtype=np.float32)
+        return np.stack(rows).astype(np.float32, copy=False)
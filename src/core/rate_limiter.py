@@ -0,0 +1,207 @@
+"""
+限流 - 按来源 IP、路径前缀或 IP+路径的令牌桶
+在规则匹配之前执行，洪泛流量直接拒绝，不进入 RuleEngine.detect。
+令牌桶按键散列到多个分片，每个分片是容量固定的 LRU（OrderedDict），键的基数再高内存也有上界。
+多进程部署时令牌桶与计数放在 SharedState 的共享表中，所有工作进程共用同一组桶。
+"""
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from src.core.shared_state import LocalCounters
+
+logger = logging.getLogger(__name__)
+
+KEY_TYPES = ('ip', 'path', 'ip_path')
+
+
+class TokenBucketTable:
+    """
+    分片 LRU 令牌桶表
+
+    桶状态为 [剩余令牌, 上次补充时刻]。不加锁：单个字典操作在 GIL 下是原子的，
+    并发线程间的竞争最多让令牌计数出现轻微偏差，换取每次判定只有几次字典操作。
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000, shards: int = 16,
+                 clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(max(burst, 1))
+        shards = 1 << max(0, int(shards) - 1).bit_length()  # 取 2 的幂，便于位运算取模
+        self._mask = shards - 1
+        self._shards: List[OrderedDict] = [OrderedDict() for _ in range(shards)]
+        self._per_shard = max(1, int(max_keys) // shards)
+        self._clock = clock
+        self.evictions = 0
+
+    def allow(self, key: str, cost: float = 1.0) -> bool:
+        """消耗 cost 个令牌；令牌不足时返回 False（cost 超过桶容量的请求永远不会放行）"""
+        if cost > self.burst:
+            return False
+        now = self._clock()
+        shard = self._shards[hash(key) & self._mask]
+        bucket = shard.get(key)
+        if bucket is None:
+            shard[key] = [self.burst - cost, now]
+            if len(shard) > self._per_shard:
+                shard.popitem(last=False)
+                self.evictions += 1
+            return True
+        shard.move_to_end(key)
+        tokens = bucket[0] + (now - bucket[1]) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        bucket[1] = now
+        if tokens < cost:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - cost
+        return True
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+
+class SharedTokenBucketTable:
+    """
+    共享内存令牌桶表，接口与 TokenBucketTable 一致
+
+    桶状态 (剩余令牌, 上次补充时刻) 在条带锁内读-改-写，多个进程的扣减不会互相覆盖；
+    表满时淘汰探测范围内最久未访问的桶。时刻取自 time.monotonic，同一主机上各进程一致。
+    """
+
+    def __init__(self, table, rate: float, burst: float, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(max(burst, 1))
+        self._table = table
+        self._clock = clock
+
+    def allow(self, key: str, cost: float = 1.0) -> bool:
+        if cost > self.burst:
+            return False
+        now = self._clock()
+        allowed = [True]
+
+        def refill(bucket):
+            if bucket is None:
+                return self.burst - cost, now
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens < cost:
+                allowed[0] = False
+                return tokens, now
+            return tokens - cost, now
+
+        self._table.update(key, refill)
+        return allowed[0]
+
+    @property
+    def evictions(self) -> int:
+        return self._table.evictions
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+
+@dataclass
+class RateLimitRule:
+    """
+    单条限流规则
+
+    Attributes:
+        key: ip（每个来源 IP 一个桶）、path（每个路径一个桶，配置 path_prefix 时整个前缀共用一个桶）、
+             ip_path（每个 IP 在每个路径上一个桶）
+        rate: 每秒补充的令牌数（持续速率）
+        burst: 桶容量（允许的突发）
+        path_prefix: 仅对以此开头的路径生效
+    """
+    name: str
+    key: str = 'ip'
+    rate: float = 100.0
+    burst: float = 200.0
+    path_prefix: str = ''
+
+    def __post_init__(self):
+        if self.key not in KEY_TYPES:
+            raise ValueError(f"限流规则 {self.name} 的 key 必须是 {'/'.join(KEY_TYPES)}")
+        if self.rate <= 0 or self.burst < 1:
+            raise ValueError(f"限流规则 {self.name} 的 rate 须大于 0，burst 须不小于 1")
+
+
+class RateLimiter:
+    """
+    按规则顺序判定，任一规则的桶耗尽即拒绝
+
+    Args:
+        shared: SharedState；提供时令牌桶与放行/拒绝计数放在共享内存中，各工作进程共用
+    """
+
+    def __init__(self, rules: List[RateLimitRule], max_keys: int = 100000, shards: int = 16,
+                 clock=time.monotonic, shared=None):
+        self.rules = list(rules)
+        if shared is not None:
+            self._tables = [SharedTokenBucketTable(shared.table(max_keys, 2, evict_field=1), rule.rate, rule.burst,
+                                                   clock)
+                            for rule in self.rules]
+            self._counters = shared.counters
+        else:
+            self._tables = [TokenBucketTable(rule.rate, rule.burst, max_keys, shards, clock) for rule in self.rules]
+            self._counters = LocalCounters()
+        self._plan = list(zip(self.rules, self._tables))
+
+    @property
+    def allowed(self) -> int:
+        return self._counters.get('rate.allowed')
+
+    @property
+    def rejected(self) -> Dict[str, int]:
+        return {rule.name: self._counters.get(f'rate.rejected.{rule.name}') for rule in self.rules}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], shared=None) -> Optional['RateLimiter']:
+        """由 settings.yaml 的 rate_limit 段构建；未启用或没有规则时返回 None"""
+        config = config or {}
+        if not config.get('enabled', False) or not config.get('rules'):
+            return None
+        rules = [RateLimitRule(name=str(r.get('name') or f"rule_{i}"), key=r.get('key', 'ip'),
+                               rate=float(r.get('rate', 100)), burst=float(r.get('burst', 200)),
+                               path_prefix=r.get('path_prefix') or '')
+                 for i, r in enumerate(config['rules'])]
+        return cls(rules, config.get('max_keys', 100000), config.get('shards', 16), shared=shared)
+
+    def check(self, request: Dict[str, Any]) -> Optional[RateLimitRule]:
+        """放行时返回 None，限流时返回触发的规则"""
+        ip = request.get('source_ip') or ''
+        path = None
+        for rule, table in self._plan:
+            if rule.key != 'ip' or rule.path_prefix:
+                if path is None:
+                    path = (request.get('url') or '').split('?', 1)[0]
+                if rule.path_prefix and not path.startswith(rule.path_prefix):
+                    continue
+            if rule.key == 'ip':
+                if not ip:
+                    continue
+                key = ip
+            elif rule.key == 'path':
+                key = rule.path_prefix or path
+            else:
+                if not ip:
+                    continue
+                key = f"{ip}|{rule.path_prefix or path}"
+            if not table.allow(key):
+                self._counters.add(f'rate.rejected.{rule.name}')
+                return rule
+        self._counters.add('rate.allowed')
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+            'rules': [{'name': rule.name, 'key': rule.key, 'rate': rule.rate, 'burst': rule.burst,
+                       'path_prefix': rule.path_prefix, 'tracked_keys': len(table),
+                       'evictions': table.evictions}
+                      for rule, table in self._plan],
+        }
@@ -0,0 +1,191 @@
+"""
+正则安全 - ReDoS 防护
+- 可选使用第三方 ``regex`` 模块执行匹配，支持单次匹配超时
+- 加载时静态分析规则正则，标记嵌套量词（指数级回溯）与多段无界通配（多项式回溯），
+  并用构造的恶意输入实测每条正则的最坏耗时；风险等级只由解析树决定，实测耗时随机器负载波动，仅作诊断
+"""
+import logging
+import re
+import sre_constants
+import sre_parse
+import time
+from typing import Any, Dict, List
+
+try:
+    import regex as regex_module
+except ImportError:  # pragma: no cover - regex 在 requirements.txt 中，缺失时退化为标准库 re
+    regex_module = None
+
+logger = logging.getLogger(__name__)
+
+HAS_REGEX = regex_module is not None
+
+# 风险等级：safe < polynomial < exponential
+RISK_SAFE = 'safe'
+RISK_POLYNOMIAL = 'polynomial'
+RISK_EXPONENTIAL = 'exponential'
+
+# 实测探针长度与单次探针超时（秒）
+PROBE_LENGTH = 2048
+PROBE_TIMEOUT = 0.2
+# 实测最坏耗时超过该值（毫秒）时在加载日志中提示（不改变风险等级）
+SLOW_PATTERN_MS = 10.0
+# auto 模式下多项式风险的正则仅在输入达到该长度时才使用 regex+超时
+POLYNOMIAL_GUARD_LENGTH = 512
+
+_UNBOUNDED = sre_constants.MAXREPEAT
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+
+def resolve_engine(name: str) -> str:
+    """
+    将配置中的 regex_engine 解析为实际使用的引擎
+
+    - re: 全部使用标准库 re（无超时）
+    - regex: 全部使用 regex 模块并启用超时
+    - auto: 分析为有回溯风险的正则使用 regex+超时，其余仍用更快的 re
+    未安装 regex 模块时一律退化为 re。
+    """
+    if name not in ('re', 'regex', 'auto'):
+        name = 'auto'
+    if name != 're' and not HAS_REGEX:
+        if name == 'regex':
+            logger.warning("未安装 regex 模块，正则匹配退化为标准库 re（无超时保护）")
+        return 're'
+    return name
+
+
+def compile_pattern(pattern: str, engine: str = 're'):
+    """按引擎（re/regex）编译正则（均忽略大小写），语法错误抛出 re.error / regex.error"""
+    if engine == 'regex':
+        return regex_module.compile(pattern, regex_module.IGNORECASE)
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def pattern_errors() -> tuple:
+    """两种引擎的正则语法异常类型"""
+    return (re.error, regex_module.error) if HAS_REGEX else (re.error,)
+
+
+def _is_broad(item) -> bool:
+    """能匹配绝大多数字符的原子：``.``、``[^x]``、``\\S`` 等"""
+    op, av = item
+    if op in (sre_constants.ANY, sre_constants.NOT_LITERAL):
+        return True
+    if op == sre_constants.IN:
+        return any(sub_op == sre_constants.NEGATE or
+                   (sub_op == sre_constants.CATEGORY and 'NOT' in str(sub_av))
+                   for sub_op, sub_av in av)
+    return False
+
+
+def _children(op, av) -> List[Any]:
+    """子模式列表（每项为 SubPattern 或其 data 列表）"""
+    if op in _REPEATS:
+        return [av[2]]
+    if op == sre_constants.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_constants.BRANCH:
+        return list(av[1])
+    if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return [av[1]]
+    return []
+
+
+def _contains_unbounded(items) -> bool:
+    for op, av in items:
+        if op in _REPEATS and av[1] == _UNBOUNDED:
+            return True
+        if any(_contains_unbounded(child) for child in _children(op, av)):
+            return True
+    return False
+
+
+def _walk(items, reasons: List[str], literals: List[str]):
+    """递归检查解析树，收集风险原因和字面量片段"""
+    items = list(items)
+    run = []
+    for index, (op, av) in enumerate(items):
+        if op == sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            literals.append(''.join(run))
+            run = []
+        if op in _REPEATS and av[1] == _UNBOUNDED:
+            body = list(av[2])
+            if _contains_unbounded(body):
+                reasons.append('nested_quantifier')
+            elif any(sub_op == sre_constants.BRANCH for sub_op, _ in body) or \
+                    any(sub_op == sre_constants.SUBPATTERN and
+                        any(o == sre_constants.BRANCH for o, _ in sub_av[-1])
+                        for sub_op, sub_av in body):
+                reasons.append('quantified_alternation')
+            elif len(body) == 1 and _is_broad(body[0]) and index + 1 < len(items):
+                # 无界通配后仍有必须匹配的内容：search 在每个起点都会扫到输入末尾
+                reasons.append('unbounded_wildcard')
+        for child in _children(op, av):
+            _walk(child, reasons, literals)
+    if run:
+        literals.append(''.join(run))
+
+
+def analyze_pattern(pattern: str, engine: str = 're', measure: bool = True) -> Dict[str, Any]:
+    """
+    静态分析单条正则的回溯风险，并可选实测最坏耗时
+
+    risk 与 reasons 只取决于正则本身，同一正则在任何机器上结果相同（可随规则包缓存）；
+    worst_case_ms / timed_out 为本机实测值，只用于诊断。
+
+    Returns:
+        {'pattern', 'risk', 'reasons', 'worst_case_ms', 'timed_out'}
+    """
+    report = {'pattern': pattern, 'risk': RISK_SAFE, 'reasons': [],
+              'worst_case_ms': None, 'timed_out': False}
+    literals: List[str] = []
+    try:
+        _walk(sre_parse.parse(pattern), report['reasons'], literals)
+    except (re.error, RecursionError) as e:
+        report['reasons'].append(f'unparsable: {e}')
+        return report
+    report['reasons'] = sorted(set(report['reasons']))
+    if {'nested_quantifier', 'quantified_alternation'} & set(report['reasons']):
+        report['risk'] = RISK_EXPONENTIAL
+    elif report['reasons']:
+        report['risk'] = RISK_POLYNOMIAL
+
+    # 标准库 re 没有超时，指数级正则实测可能永不返回，只依赖静态结论
+    if measure and (engine == 'regex' or report['risk'] != RISK_EXPONENTIAL):
+        worst, timed_out = _measure(pattern, engine, literals)
+        report['worst_case_ms'] = round(worst, 3)
+        report['timed_out'] = timed_out
+    return report
+
+
+def probe_inputs(literals: List[str], length: int = PROBE_LENGTH) -> List[str]:
+    """构造恶意探针：重复正则中的字面量片段且不给出完整匹配，逼迫引擎反复回溯"""
+    probes = ['a' * length, '<' * length]
+    for fragment in sorted(set(f for f in literals if f.strip()), key=len, reverse=True)[:4]:
+        unit = fragment + ' '
+        probes.append((unit * (length // len(unit) + 1))[:length])
+    return probes
+
+
+def _measure(pattern: str, engine: str, literals: List[str]):
+    try:
+        compiled = compile_pattern(pattern, engine)
+    except pattern_errors():
+        return 0.0, False
+    worst = 0.0
+    for probe in probe_inputs(literals):
+        start = time.perf_counter()
+        try:
+            if engine == 'regex':
+                compiled.search(probe, timeout=PROBE_TIMEOUT)
+            else:
+                compiled.search(probe)
+        except TimeoutError:
+            return PROBE_TIMEOUT * 1000, True
+        worst = max(worst, (time.perf_counter() - start) * 1000)
+    return worst, False
+
@@ -0,0 +1,303 @@
+"""
+规则包缓存 - 将 YAML 规则解析、校验后的结果序列化为带内容哈希的 JSON 产物
+启动和重载时源文件未变化则直接加载规则包，跳过 YAML 解析与校验
+"""
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from src.core.regex_safety import HAS_REGEX, RISK_EXPONENTIAL, SLOW_PATTERN_MS, analyze_pattern
+
+logger = logging.getLogger(__name__)
+
+# 规则包格式或规范化逻辑变化时递增，使旧规则包自动失效
+BUNDLE_FORMAT_VERSION = 5
+
+# libyaml 可用时使用 C 实现的加载器，速度约为纯 Python 版本的 5-10 倍
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+COST_RANK = {"fast": 0, "accurate": 1, "expensive": 2}
+
+RULE_DEFAULTS = {
+    'name': '',
+    'category': '',
+    'patterns': [],
+    'severity': 'medium',
+    'enabled': True,
+    'priority': 999,
+    'confidence': 1.0,
+    'cost_level': 'accurate',
+    'targets': [],
+}
+
+# 规则可限定的检查位置（RuleEngine.detect 中检查目标的类别），targets 为空表示全部位置
+TARGET_KINDS = ('url', 'method', 'query', 'body', 'header', 'cookie',
+                'field', 'field_name', 'filename', 'file')
+
+
+def load_yaml(stream) -> Any:
+    """使用最快的可用安全加载器解析 YAML"""
+    return yaml.load(stream, Loader=YAML_LOADER)
+
+
+def read_sources(rule_files: List[str]) -> Dict[str, Optional[bytes]]:
+    """读取规则源文件内容，不存在的文件记为 None"""
+    sources = {}
+    for rule_file in rule_files:
+        try:
+            with open(rule_file, 'rb') as f:
+                sources[rule_file] = f.read()
+        except FileNotFoundError:
+            sources[rule_file] = None
+    return sources
+
+
+def content_hash(data: Optional[bytes]) -> Optional[str]:
+    """单个文件的内容哈希"""
+    return hashlib.sha256(data).hexdigest() if data is not None else None
+
+
+def sources_hash(rule_files: List[str], sources: Dict[str, Optional[bytes]]) -> str:
+    """按文件顺序组合所有源文件哈希，作为规则包的版本标识"""
+    digest = hashlib.sha256(f"v{BUNDLE_FORMAT_VERSION}".encode())
+    for rule_file in rule_files:
+        digest.update(f"|{rule_file}|{content_hash(sources.get(rule_file))}".encode())
+    return digest.hexdigest()
+
+
+def normalize_rule(rule_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """补全默认值并统一字段类型，非法字段抛出 ValueError"""
+    if not isinstance(rule_dict, dict):
+        raise ValueError(f"规则必须是映射类型: {rule_dict!r}")
+    rule = {key: rule_dict.get(key, default) for key, default in RULE_DEFAULTS.items()}
+    patterns = rule['patterns']
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    if not isinstance(patterns, list) or not all(isinstance(p, str) for p in patterns):
+        raise ValueError(f"规则 {rule['name']} 的 patterns 必须是字符串列表")
+    rule['patterns'] = list(patterns)
+    rule['name'] = str(rule['name'])
+    rule['category'] = str(rule['category'])
+    rule['severity'] = str(rule['severity'])
+    rule['cost_level'] = str(rule['cost_level'])
+    rule['enabled'] = bool(rule['enabled'])
+    rule['priority'] = int(rule['priority'])
+    rule['confidence'] = float(rule['confidence'])
+    targets = rule['targets'] or []
+    if isinstance(targets, str):
+        targets = [targets]
+    unknown = [t for t in targets if t not in TARGET_KINDS]
+    if unknown:
+        raise ValueError(f"规则 {rule['name']} 的 targets 无效: {unknown}，可选 {', '.join(TARGET_KINDS)}")
+    rule['targets'] = list(targets)
+    return rule
+
+
+def invalid_patterns(rule: Dict[str, Any]) -> List[str]:
+    """返回规则中无法编译的正则"""
+    bad = []
+    for pattern in rule['patterns']:
+        try:
+            re.compile(pattern, re.IGNORECASE)
+        except re.error:
+            bad.append(pattern)
+    return bad
+
+
+def analyze_file(rule_file: str, entry: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """对文件中每条合法正则做回溯风险分析并实测最坏耗时，结果随规则包持久化（风险等级只来自静态分析）"""
+    analysis = {}
+    invalid = set(entry['invalid_patterns'])
+    for rule in entry['rules']:
+        for pattern in rule['patterns']:
+            if pattern in analysis or pattern in invalid:
+                continue
+            report = analyze_pattern(pattern, 'regex' if HAS_REGEX else 're')
+            report['rule'] = rule['name']
+            analysis[pattern] = report
+            if report['risk'] == RISK_EXPONENTIAL:
+                logger.warning(f"规则 {rule['name']} 的正则存在灾难性回溯风险: {pattern} "
+                               f"({', '.join(report['reasons'])})")
+            elif report['timed_out'] or (report['worst_case_ms'] or 0) > SLOW_PATTERN_MS:
+                logger.warning(f"规则 {rule['name']} 的正则探针实测较慢: {pattern} "
+                               f"({report['worst_case_ms']}ms{'，超时' if report['timed_out'] else ''})")
+    return analysis
+
+
+def plan_key(rule: Dict[str, Any]) -> Tuple[int, int]:
+    return COST_RANK.get(rule['cost_level'], 1), rule['priority']
+
+
+def plan_order(rules: List[Dict[str, Any]]) -> List[int]:
+    """预计算执行顺序：fast -> accurate -> expensive，同层按优先级"""
+    return sorted(range(len(rules)), key=lambda i: plan_key(rules[i]))
+
+
+def merge_plans(files: List[Dict[str, Any]]) -> List[int]:
+    """
+    将各文件已排好序的局部执行计划归并为全局计划（下标指向按文件顺序展开的规则）
+    
+    heapq.merge 是稳定的，结果与对全部规则做一次 plan_order 完全一致，
+    但只有变化的文件需要重新排序。
+    """
+    runs = []
+    offset = 0
+    for entry in files:
+        rules = entry['rules']
+        runs.append([(plan_key(rules[i]), offset + i) for i in entry['plan']])
+        offset += len(rules)
+    return [index for _, index in heapq.merge(*runs, key=lambda item: item[0])]
+
+
+@dataclass
+class RuleBundle:
+    """编译后的规则包"""
+    source_hash: str
+    files: List[Dict[str, Any]] = field(default_factory=list)
+    plan: List[int] = field(default_factory=list)
+    created_at: float = 0.0
+    from_cache: bool = False
+
+    @property
+    def rules(self) -> List[Dict[str, Any]]:
+        """按文件顺序展开的规范化规则"""
+        return [rule for entry in self.files for rule in entry['rules']]
+
+    @property
+    def file_hashes(self) -> Dict[str, Optional[str]]:
+        """各源文件路径到内容哈希的映射"""
+        return {entry['path']: entry['sha256'] for entry in self.files}
+
+    @staticmethod
+    def parse_file(rule_file: str, data: Optional[bytes]) -> Dict[str, Any]:
+        """解析并校验单个 YAML 源文件，返回规则包中的文件条目"""
+        entry = {'path': rule_file, 'sha256': content_hash(data), 'metadata': {},
+                 'rules': [], 'plan': [], 'errors': [], 'invalid_patterns': [],
+                 'pattern_analysis': {}}
+        if data is None:
+            entry['errors'].append('file not found')
+            return entry
+        try:
+            rule_data = load_yaml(data) or {}
+            entry['metadata'] = rule_data.get('metadata') or {}
+            for rule_dict in rule_data.get('rules') or []:
+                try:
+                    rule = normalize_rule(rule_dict)
+                except (ValueError, TypeError) as e:
+                    entry['errors'].append(str(e))
+                    continue
+                entry['invalid_patterns'].extend(invalid_patterns(rule))
+                entry['rules'].append(rule)
+        except Exception as e:
+            entry['errors'].append(str(e))
+        entry['plan'] = plan_order(entry['rules'])
+        entry['pattern_analysis'] = analyze_file(rule_file, entry)
+        return entry
+
+    @classmethod
+    def build(cls, rule_files: List[str], sources: Dict[str, Optional[bytes]],
+              previous: Optional['RuleBundle'] = None) -> 'RuleBundle':
+        """
+        解析并校验 YAML 源文件，生成规则包
+        
+        Args:
+            previous: 上一版规则包；内容哈希未变的文件直接复用其条目，只解析变化的文件
+        """
+        reusable = {}
+        if previous is not None:
+            reusable = {(entry['path'], entry['sha256']): entry
+                        for entry in previous.files if entry['sha256'] is not None}
+        files = []
+        for rule_file in rule_files:
+            data = sources.get(rule_file)
+            entry = reusable.get((rule_file, content_hash(data)))
+            files.append(entry if entry is not None else cls.parse_file(rule_file, data))
+        bundle = cls(source_hash=sources_hash(rule_files, sources), files=files,
+                     created_at=time.time())
+        bundle.plan = merge_plans(files)
+        return bundle
+
+    def payload(self) -> Dict[str, Any]:
+        return {
+            'format': BUNDLE_FORMAT_VERSION,
+            'source_hash': self.source_hash,
+            'created_at': self.created_at,
+            'files': self.files,
+            'plan': self.plan,
+        }
+
+    @staticmethod
+    def _payload_hash(payload: Dict[str, Any]) -> str:
+        canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def save(self, path: str):
+        """原子写入规则包，附带负载哈希用于加载时校验完整性"""
+        path = Path(path)
+        payload = self.payload()
+        document = {'payload_hash': self._payload_hash(payload), 'payload': payload}
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(document, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入规则包失败: {e}")
+
+    @classmethod
+    def load(cls, path: str, expected_source_hash: str) -> Optional['RuleBundle']:
+        """加载并校验规则包；格式、完整性或源文件哈希不符时返回 None"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                document = json.load(f)
+            payload = document['payload']
+            if payload.get('format') != BUNDLE_FORMAT_VERSION:
+                return None
+            if payload.get('source_hash') != expected_source_hash:
+                return None
+            if cls._payload_hash(payload) != document.get('payload_hash'):
+                logger.warning(f"规则包校验失败，忽略: {path}")
+                return None
+            files = payload['files']
+            plan = payload['plan']
+            if sorted(plan) != list(range(sum(len(e['rules']) for e in files))):
+                return None
+            return cls(source_hash=payload['source_hash'], files=files, plan=plan,
+                       created_at=payload.get('created_at', 0.0), from_cache=True)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+
+def load_bundle(rule_files: List[str], bundle_file: Optional[str] = None,
+                sources: Optional[Dict[str, Optional[bytes]]] = None,
+                previous: Optional[RuleBundle] = None) -> Tuple[RuleBundle, bool]:
+    """
+    获取与当前源文件一致的规则包
+    
+    Args:
+        previous: 当前使用中的规则包，需要重建时用于复用未变化文件的解析结果
+    
+    Returns:
+        (规则包, 是否由 YAML 重新构建)
+    """
+    if sources is None:
+        sources = read_sources(rule_files)
+    expected = sources_hash(rule_files, sources)
+    if bundle_file:
+        bundle = RuleBundle.load(bundle_file, expected)
+        if bundle is not None:
+            return bundle, False
+    bundle = RuleBundle.build(rule_files, sources, previous)
+    if bundle_file:
+        bundle.save(bundle_file)
+    return bundle, True
@@ -2,18 +2,39 @@
 规则匹配引擎 - 传统WAF核心
 基于YAML规则文件进行HTTP请求检测
 """
-import yaml
+import codecs
 import re
 import time
-from typing import List, Dict, Any, Tuple
+import threading
+from typing import List, Dict, Any, Tuple, Optional
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 import logging
 
-from src.utils.web_tools import HTTPRequestParser
+from src.utils.decompress import (DEFAULT_MAX_OUTPUT_BYTES, DEFAULT_MAX_RATIO, DecompressionError,
+                                  DecompressionLimitError, iter_decompressed, parse_content_encoding)
+from src.utils.body_parser import (BodyParseError, iter_json_leaves, iter_multipart, looks_binary,
+                                   parse_boundary, parse_json_body)
+from src.utils.web_tools import DEFAULT_DECODE_DEPTH, HTTPRequestParser, URLDecoder
+from src.core.regex_safety import (POLYNOMIAL_GUARD_LENGTH, RISK_POLYNOMIAL, RISK_SAFE, compile_pattern,
+                                   pattern_errors, resolve_engine)
+from src.core.rule_bundle import RuleBundle, load_bundle, load_yaml, read_sources, sources_hash
 
 logger = logging.getLogger(__name__)
 
+# 逐个检查的请求头（detection.inspect_headers 未配置时）；其余请求头（accept-encoding 等）不参与匹配
+DEFAULT_INSPECT_HEADERS = ('cookie', 'user-agent', 'referer', 'x-forwarded-for', 'x-real-ip',
+                           'origin', 'host', 'content-type')
+# 普通 Cookie 名、表单字段名与 JSON 路径不单独检查，含其他字符时才作为检查目标
+_COOKIE_NAME_TOKEN = re.compile(r'[A-Za-z0-9_.\-]*')
+_FIELD_PATH_TOKEN = re.compile(r'[A-Za-z0-9_.\-\[\]]*')
+DEFAULT_FILE_SNIFF_BYTES = 4096
+# 原始 URL 含编码的 # / & 分隔符（或可再解码出它们的 %25）时，规范化先解码再拆分会截断 fragment 之后的内容，
+# 需另外按原始 URL 与查询串整体解码后检查
+_RAW_URL_SEPARATORS = re.compile(r'%(?:23|26|25)|#', re.IGNORECASE)
+# 压缩请求体逐块解压匹配时，相邻块之间重叠的字符数，跨块的载荷在重叠范围内仍能命中
+STREAM_OVERLAP_CHARS = 1024
+
 
 @dataclass
 class Rule:
@@ -26,24 +47,133 @@ class Rule:
     priority: int = 999  # 优先级（1最高，999最低），用于排序检测顺序
     confidence: float = 1.0  # 置信度（0.0-1.0），未来可用于DL融合
     cost_level: str = "accurate"  # fast, accurate, expensive
+    targets: Tuple[str, ...] = ()  # 限定检查位置（见 rule_bundle.TARGET_KINDS），为空表示全部
+    # 正则执行选项（见 regex_safety.resolve_engine）：engine 为 re/regex/auto，auto 时只有
+    # pattern_risks 中标记为有风险的正则走 regex 模块；timeout（秒）仅对这些正则生效
+    engine: str = field(default="re", repr=False, compare=False)
+    timeout: Optional[float] = field(default=None, repr=False, compare=False)
+    timeout_blocks: bool = field(default=True, repr=False, compare=False)
+    pattern_risks: Dict[str, str] = field(default_factory=dict, repr=False, compare=False)
 
     def __post_init__(self):
+        self.targets = tuple(self.targets)
+        self.target_set = frozenset(self.targets) or None
+        # (re 编译结果, regex 编译结果或 None, 输入长度达到该值才走 regex)
         self.compiled_patterns = []
+        self.timeouts = 0
         for pattern in self.patterns:
+            guard_from = self._guard_length(pattern)
             try:
-                self.compiled_patterns.append(re.compile(pattern, re.IGNORECASE))
-            except re.error as e:
+                fast = compile_pattern(pattern, 're') if guard_from != 0 else None
+                guarded = compile_pattern(pattern, 'regex') if guard_from is not None else None
+                self.compiled_patterns.append((fast or guarded, guarded, guard_from or 0))
+            except pattern_errors() as e:
                 logger.error(f"规则 {self.name} 正则表达式错误: {e}")
+        self.reset_profile()
+
+    def _guard_length(self, pattern: str) -> Optional[int]:
+        """regex+超时保护的最小输入长度；None 表示始终使用标准库 re
+        
+        多项式回溯的正则在短输入上代价有限，只对长输入启用超时以免拖慢常规请求。
+        """
+        if self.engine == 'regex':
+            return 0
+        if self.engine != 'auto':
+            return None
+        risk = self.pattern_risks.get(pattern, RISK_SAFE)
+        if risk == RISK_SAFE:
+            return None
+        return POLYNOMIAL_GUARD_LENGTH if risk == RISK_POLYNOMIAL else 0
+    
+    def reset_profile(self):
+        """清零性能剖析计数（见 RuleEngine.get_rule_profile）"""
+        self.evaluations = 0  # 被评估的请求数
+        self.matches = 0  # 命中的请求数
+        self.sampled = 0  # 参与计时采样的请求数
+        self.sampled_ns = 0  # 采样请求上的累计耗时
+        self.pattern_ns = [0] * len(self.compiled_patterns)
+        self.pattern_hits = [0] * len(self.compiled_patterns)
+
+    def _search(self, entry, text: str) -> bool:
+        fast, guarded, guard_from = entry
+        if guarded is None or len(text) < guard_from:
+            return fast.search(text) is not None
+        try:
+            return guarded.search(text, timeout=self.timeout) is not None
+        except TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"规则 {self.name} 正则匹配超时 ({len(text)} 字符): {guarded.pattern}")
+            return self.timeout_blocks
     
     def match(self, text: str) -> bool:
-        """检查文本是否匹配规则"""
+        """检查文本是否匹配规则
+        
+        regex 模块下单次匹配超时视为可疑输入：timeout_blocks 为真时按命中处理，否则跳过该正则。
+        """
         if not self.enabled:
             return False
-        for pattern in self.compiled_patterns:
-            if pattern.search(text):
+        for fast, guarded, guard_from in self.compiled_patterns:
+            if guarded is None or len(text) < guard_from:
+                if fast.search(text):
+                    return True
+                continue
+            try:
+                if guarded.search(text, timeout=self.timeout):
+                    return True
+            except TimeoutError:
+                self.timeouts += 1
+                logger.warning(f"规则 {self.name} 正则匹配超时 ({len(text)} 字符): {guarded.pattern}")
+                if self.timeout_blocks:
+                    return True
+        return False
+
+    def match_profiled(self, text: str) -> bool:
+        """与 match 语义相同，同时记录每条正则的耗时与命中（仅用于采样请求）"""
+        if not self.enabled:
+            return False
+        for index, entry in enumerate(self.compiled_patterns):
+            start = time.perf_counter_ns()
+            hit = self._search(entry, text)
+            self.pattern_ns[index] += time.perf_counter_ns() - start
+            if hit:
+                self.pattern_hits[index] += 1
                 return True
         return False
 
+    @classmethod
+    def from_dict(cls, rule_dict: Dict[str, Any], **regex_options) -> 'Rule':
+        """由规范化的规则字典（见 rule_bundle.normalize_rule）构建规则
+        
+        Args:
+            regex_options: engine / timeout / timeout_blocks / pattern_risks，见 RuleEngine.regex_options
+        """
+        return cls(
+            name=rule_dict['name'],
+            category=rule_dict['category'],
+            patterns=rule_dict['patterns'],
+            severity=rule_dict['severity'],
+            enabled=rule_dict['enabled'],
+            priority=rule_dict['priority'],
+            confidence=rule_dict['confidence'],
+            cost_level=rule_dict['cost_level'],
+            targets=tuple(rule_dict.get('targets') or ()),
+            **regex_options
+        )
+
+    def match_info(self, location: str, text: str) -> Dict[str, Any]:
+        """命中结果条目"""
+        return {
+            'rule_id': self.name,
+            'rule_name': self.name,
+            'category': self.category,
+            'severity': self.severity,
+            'priority': self.priority,
+            'confidence': self.confidence,
+            'cost_level': self.cost_level,
+            'location': location,
+            'matched_text': text[:100]  # 仅保留前100字符
+        }
+
     def to_dict(self) -> Dict[str, Any]:
         """将 Rule 对象转换为字典表示，便于序列化和兼容旧代码"""
         return {
@@ -52,7 +182,8 @@ class Rule:
             'patterns': list(self.patterns),
             'severity': self.severity,
             'enabled': self.enabled,
-            'cost_level': self.cost_level
+            'cost_level': self.cost_level,
+            'targets': list(self.targets)
         }
 
     def __contains__(self, key: str) -> bool:
@@ -62,65 +193,470 @@ class Rule:
         return hasattr(self, key)
 
 
+class RuleSetValidationError(ValueError):
+    """新规则集未通过校验，继续使用当前规则集"""
+
+
+@dataclass(frozen=True)
+class RuleSet:
+    """不可变规则集 - 重载时在旁路构建完整的新规则集，再以一次引用赋值发布
+    
+    检测时只读取一次 ``RuleEngine.ruleset``，在途请求始终在同一个规则集上完成。
+    ``compiled`` 按 (文件路径, 内容哈希) 保存各文件已编译的规则，重载时内容未变的文件直接复用；
+    正则执行选项（``regex_options``）变化时全部重新编译。
+    """
+    generation: int
+    rules: Tuple[Rule, ...] = ()
+    compiled: Tuple[Tuple[Tuple[str, Optional[str]], Tuple[Rule, ...]], ...] = ()
+    execution_plan: Tuple[Rule, ...] = ()
+    metadata: Tuple[Dict[str, Any], ...] = ()
+    bundle: Optional[RuleBundle] = None
+    load_errors: Tuple[str, ...] = ()
+    regex_options: Tuple[Tuple[str, Any], ...] = ()
+
+
 class RuleEngine:
     """WAF规则引擎"""
     
     def __init__(self, config_path: str = "config/settings.yaml"):
         """初始化规则引擎"""
         self.config_path = Path(config_path)
-        self.rules: List[Rule] = []
+        self.ruleset = RuleSet(generation=0)
         self.rule_files: List[str] = []
-        self.rule_metadata: List[Dict[str, Any]] = []
         self.severity_levels = {"critical": 4, "high": 3, "medium": 2, "low": 1}
         self.cost_rank = {"fast": 0, "accurate": 1, "expensive": 2}
         self.cache_ttl_seconds = 5
-        self.match_cache: Dict[str, Tuple[float, Tuple[bool, List[Dict[str, Any]]]]] = {}
+        self.decode_max_depth = DEFAULT_DECODE_DEPTH
+        self.inspect_headers = frozenset(DEFAULT_INSPECT_HEADERS)  # 为空表示检查全部请求头
+        self.skip_headers = frozenset()
+        self.structured_body = True
+        self.file_sniff_bytes = DEFAULT_FILE_SNIFF_BYTES
+        self.decompress_bodies = True
+        self.decompress_max_bytes = DEFAULT_MAX_OUTPUT_BYTES
+        self.decompress_max_ratio = DEFAULT_MAX_RATIO
+        self.decompress_limit_blocks = True
+        self.decompress_stats = {'bodies': 0, 'limited': 0, 'invalid': 0}
+        # 缓存项: key -> (规则集代数, 时间戳, 结果)，代数不符即视为失效
+        self.match_cache: Dict[str, Tuple[int, float, Tuple[bool, List[Dict[str, Any]]]]] = {}
         self.load_duration_ms = 0
-        self.load_config()
+        self.bundle_file = "cache/rule_bundle.json"
+        self.regex_options: Dict[str, Any] = {'engine': 're', 'timeout': None, 'timeout_blocks': True}
+        self.profiling = False
+        self.profile_sample_every = 64
+        self._profile_counter = 0
+        self.first_match = False
+        self.adaptive_ordering = False
+        self.adaptive_interval_seconds = 30
+        self._next_optimize = 0.0
+        self.plan_stats: Dict[str, Any] = {'optimizations': 0, 'last_optimized': None}
+        self.metrics = None  # 可选的 WAFMetrics，见 attach_metrics
+        self._tier_stage = {level: f'rules_{level}' for level in self.cost_rank}
+        self.reload_stats: Dict[str, Any] = {'reloads': 0, 'failed_reloads': 0, 'last_reload': None}
+        self.recompiled_rules = 0
+        self._reload_lock = threading.Lock()
+        try:
+            self.load_config()
+        except RuleSetValidationError:
+            # 启动时没有可沿用的规则集（WAFSystem 启动前已校验配置），以空规则集启动
+            pass
         self.load_rules()
     
-    def load_config(self):
-        """从配置文件加载规则文件列表"""
+    @property
+    def rules(self) -> List[Rule]:
+        """当前规则集的规则列表（副本）"""
+        return list(self.ruleset.rules)
+    
+    @property
+    def rule_metadata(self) -> List[Dict[str, Any]]:
+        return list(self.ruleset.metadata)
+    
+    @property
+    def execution_plan(self) -> Tuple[Rule, ...]:
+        return self.ruleset.execution_plan
+    
+    @property
+    def bundle(self) -> Optional[RuleBundle]:
+        return self.ruleset.bundle
+    
+    def load_config(self) -> Dict[str, Any]:
+        """从配置文件加载规则文件列表与检测参数
+        
+        配置先完整解析为一组新设置，全部成功后才替换当前设置；配置无法读取或解析时
+        保持当前设置不变并抛出 RuleSetValidationError，避免以空规则文件列表发布空规则集。
+        
+        Returns:
+            被替换前的设置，新规则集被拒绝时用于回滚
+        """
         try:
             with open(self.config_path, 'r', encoding='utf-8') as f:
-                config = yaml.safe_load(f)
-                self.rule_files = config.get('rules', {}).get('directories', [])
-                self.cache_ttl_seconds = int(config.get('detection', {}).get('cache_ttl_seconds', 5))
-                logger.info(f"加载规则文件配置: {self.rule_files}")
+                config = load_yaml(f)
+            settings = self._parse_config(config)
         except Exception as e:
             logger.error(f"加载配置文件失败: {e}")
-            self.rule_files = []
+            raise RuleSetValidationError(f"加载配置文件失败，继续使用当前配置与规则: {e}") from e
+        previous = {name: getattr(self, name) for name in settings}
+        for name, value in settings.items():
+            setattr(self, name, value)
+        if self.adaptive_ordering and not (self.first_match and self.profiling):
+            logger.warning("自适应规则排序需要 match_mode: first 且启用 rule_profiling，当前不生效")
+        logger.info(f"加载规则文件配置: {self.rule_files}")
+        return previous
+
+    def _parse_config(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        """将 settings.yaml 解析为引擎设置（属性名 -> 值），不修改当前设置"""
+        if not isinstance(config, dict):
+            raise ValueError("配置文件为空或不是映射")
+        rules = config.get('rules', {}) or {}
+        rule_files = rules.get('directories') or []
+        if not isinstance(rule_files, list):
+            raise ValueError("rules.directories 必须是列表")
+        detection = config.get('detection', {}) or {}
+        timeout_ms = detection.get('regex_timeout_ms', 100)
+        adaptive_interval_seconds = max(1, int(detection.get('adaptive_interval_seconds', 30)))
+        inspect_headers = detection.get('inspect_headers', DEFAULT_INSPECT_HEADERS)
+        return {
+            'rule_files': [str(path) for path in rule_files],
+            'bundle_file': rules.get('bundle_file', self.bundle_file),
+            'cache_ttl_seconds': int(detection.get('cache_ttl_seconds', 5)),
+            'decode_max_depth': max(0, int(detection.get('decode_max_depth', DEFAULT_DECODE_DEPTH))),
+            'inspect_headers': frozenset(str(h).lower() for h in inspect_headers or ()),
+            'skip_headers': frozenset(str(h).lower() for h in detection.get('skip_headers') or ()),
+            'structured_body': bool(detection.get('structured_body', True)),
+            'file_sniff_bytes': max(0, int(detection.get('file_sniff_bytes', DEFAULT_FILE_SNIFF_BYTES))),
+            'decompress_bodies': bool(detection.get('decompress_bodies', True)),
+            'decompress_max_bytes': max(0, int(detection.get('decompress_max_bytes', DEFAULT_MAX_OUTPUT_BYTES))),
+            'decompress_max_ratio': max(0.0, float(detection.get('decompress_max_ratio', DEFAULT_MAX_RATIO))),
+            'decompress_limit_blocks': detection.get('decompress_limit_action', 'block') == 'block',
+            'profiling': bool(detection.get('rule_profiling', True)),
+            'profile_sample_every': max(1, int(detection.get('profile_sample_every', 64))),
+            'first_match': detection.get('match_mode', 'all') == 'first',
+            'adaptive_ordering': bool(detection.get('adaptive_ordering', False)),
+            'adaptive_interval_seconds': adaptive_interval_seconds,
+            '_next_optimize': time.monotonic() + adaptive_interval_seconds,
+            'regex_options': {
+                'engine': resolve_engine(detection.get('regex_engine', 'auto')),
+                'timeout': timeout_ms / 1000.0 if timeout_ms else None,
+                'timeout_blocks': detection.get('regex_timeout_action', 'block') == 'block',
+            },
+        }
     
-    def load_rules(self):
-        """从YAML文件加载所有规则"""
-        start_time = time.monotonic()
-        for rule_file in self.rule_files:
-            try:
-                with open(rule_file, 'r', encoding='utf-8') as f:
-                    rule_data = yaml.safe_load(f) or {}
-                    metadata = rule_data.get('metadata') or {}
-                    if metadata:
-                        self.rule_metadata.append(metadata)
-                    if 'rules' in rule_data:
-                        for rule_dict in rule_data['rules']:
-                            rule = Rule(
-                                name=rule_dict.get('name', ''),
-                                category=rule_dict.get('category', ''),
-                                patterns=rule_dict.get('patterns', []),
-                                severity=rule_dict.get('severity', 'medium'),
-                                enabled=rule_dict.get('enabled', True),
-                                priority=rule_dict.get('priority', 999),  # 新增：支持优先级
-                                confidence=rule_dict.get('confidence', 1.0),  # 新增：支持置信度
-                                cost_level=rule_dict.get('cost_level', 'accurate')
-                            )
-                            self.rules.append(rule)
-                logger.info(f"从 {rule_file} 加载 {len(rule_data.get('rules', []))} 条规则")
-            except FileNotFoundError:
-                logger.warning(f"规则文件不存在: {rule_file}")
-            except Exception as e:
-                logger.error(f"加载规则文件 {rule_file} 失败: {e}")
-        self.load_duration_ms = int((time.monotonic() - start_time) * 1000)
+    def load_rules(self, trigger: str = 'startup'):
+        """加载所有规则：源文件未变化时直接复用，优先读取规则包，必要时回退到YAML
+        
+        新规则集在旁路构建并校验，通过后才替换当前规则集；首次加载时始终发布。
+        内容哈希未变的文件复用当前规则包中的解析结果，只重新解析变化的文件。
+        
+        Args:
+            trigger: 触发来源（startup/manual/watcher/sighup），记录在重载统计中
+        
+        Raises:
+            RuleSetValidationError: 重载得到的规则集未通过校验（当前规则集保持不变）
+        """
+        with self._reload_lock:
+            start_time = time.monotonic()
+            current = self.ruleset
+            sources = read_sources(self.rule_files)
+            if current.bundle is not None and \
+               current.bundle.source_hash == sources_hash(self.rule_files, sources) and \
+               current.regex_options == tuple(sorted(self.regex_options.items())):
+                logger.info("规则源文件未变化，跳过重新编译")
+                self.load_duration_ms = int((time.monotonic() - start_time) * 1000)
+                return
+
+            bundle, rebuilt = load_bundle(self.rule_files, self.bundle_file, sources, current.bundle)
+            ruleset = self._build_ruleset(bundle, current.generation + 1, current)
+            if current.generation > 0:
+                try:
+                    self._validate_ruleset(ruleset)
+                except RuleSetValidationError:
+                    self._record_rejection(trigger)
+                    raise
+            else:
+                for error in ruleset.load_errors:
+                    logger.error(error)
+            self._publish(ruleset)
+            self.load_duration_ms = int((time.monotonic() - start_time) * 1000)
+            self._record_reload(current, ruleset, trigger)
+            logger.info(f"规则{'由YAML编译' if rebuilt else '从规则包加载'}: {len(ruleset.rules)} 条, "
+                        f"第 {ruleset.generation} 代, {self.load_duration_ms}ms")
+    
+    def _build_ruleset(self, bundle: RuleBundle, generation: int,
+                       previous: Optional[RuleSet] = None) -> RuleSet:
+        """由规则包构建新的规则集，不触碰当前规则集
+        
+        内容哈希与上一代相同的文件复用已编译的 Rule 对象，只编译变化的文件；
+        执行计划由规则包中各文件的局部计划归并而来。
+        """
+        regex_options = tuple(sorted(self.regex_options.items()))
+        reusable = {}
+        if previous is not None and previous.regex_options == regex_options:
+            reusable = dict(previous.compiled)
+        rules: List[Rule] = []
+        compiled = []
+        metadata: List[Dict[str, Any]] = []
+        errors: List[str] = []
+        recompiled = 0
+        for entry in bundle.files:
+            if entry['sha256'] is None:
+                logger.warning(f"规则文件不存在: {entry['path']}")
+                errors.append(f"规则文件不存在: {entry['path']}")
+                continue
+            for error in entry['errors']:
+                errors.append(f"加载规则文件 {entry['path']} 失败: {error}")
+            for pattern in entry.get('invalid_patterns', []):
+                errors.append(f"规则文件 {entry['path']} 含有非法正则: {pattern}")
+            if entry['metadata']:
+                metadata.append(entry['metadata'])
+            key = (entry['path'], entry['sha256'])
+            file_rules = reusable.get(key)
+            if file_rules is None:
+                risks = {pattern: report['risk'] for pattern, report in entry.get('pattern_analysis', {}).items()}
+                file_rules = tuple(Rule.from_dict(rule_dict, pattern_risks=risks, **self.regex_options)
+                                   for rule_dict in entry['rules'])
+                recompiled += len(file_rules)
+                logger.info(f"从 {entry['path']} 加载 {len(file_rules)} 条规则")
+            compiled.append((key, file_rules))
+            rules.extend(file_rules)
+        self.recompiled_rules = recompiled
+        # 分层执行计划：fast -> accurate -> expensive，在规则包中预先计算
+        return RuleSet(
+            generation=generation,
+            rules=tuple(rules),
+            compiled=tuple(compiled),
+            execution_plan=tuple(rules[i] for i in bundle.plan),
+            metadata=tuple(metadata),
+            bundle=bundle,
+            load_errors=tuple(errors),
+            regex_options=regex_options,
+        )
     
+    def _validate_ruleset(self, ruleset: RuleSet):
+        """校验新规则集：任一文件缺失、解析失败或含非法正则都拒绝发布"""
+        if ruleset.load_errors:
+            for error in ruleset.load_errors:
+                logger.error(error)
+            raise RuleSetValidationError(
+                f"新规则集校验失败，继续使用第 {self.ruleset.generation} 代规则: {ruleset.load_errors[0]}"
+            )
+        if self.rule_files and not ruleset.rules:
+            raise RuleSetValidationError("新规则集为空，继续使用当前规则")
+        # 去掉全部规则文件或禁用全部规则等同于关闭防护，当前有规则时不接受
+        if self.ruleset.rules and not any(rule.enabled for rule in ruleset.rules):
+            raise RuleSetValidationError(
+                f"新规则集没有启用的规则（规则文件 {len(self.rule_files)} 个），"
+                f"继续使用第 {self.ruleset.generation} 代规则"
+            )
+
+    def _record_rejection(self, trigger: str):
+        """记录一次被拒绝的重载（配置无效或新规则集未通过校验）"""
+        self.reload_stats['failed_reloads'] += 1
+        if self.metrics is not None:
+            self.metrics.reloads.inc(trigger, 'rejected')
+    
+    def _record_reload(self, previous: RuleSet, ruleset: RuleSet, trigger: str):
+        """记录本次发布的耗时、规则数变化与变化的文件"""
+        old_hashes = previous.bundle.file_hashes if previous.bundle else {}
+        changed = [path for path, sha in ruleset.bundle.file_hashes.items()
+                   if old_hashes.get(path) != sha]
+        if ruleset.generation > 1:
+            self.reload_stats['reloads'] += 1
+        if self.metrics is not None:
+            self.metrics.reload_seconds.observe(self.load_duration_ms / 1000.0, trigger)
+            self.metrics.reloads.inc(trigger, 'published')
+        self.reload_stats['last_reload'] = {
+            'trigger': trigger,
+            'generation': ruleset.generation,
+            'duration_ms': self.load_duration_ms,
+            'rule_count': len(ruleset.rules),
+            'rule_delta': len(ruleset.rules) - len(previous.rules),
+            'changed_files': changed,
+            'recompiled_rules': self.recompiled_rules,
+            'timestamp': time.time(),
+        }
+    
+    def _publish(self, ruleset: RuleSet):
+        """以一次引用赋值发布规则集，并丢弃旧代的匹配缓存"""
+        self.ruleset = ruleset
+        self.match_cache = {}
+    
+    @staticmethod
+    def _selectivity_score(rule: Rule, default_us: float) -> float:
+        """期望代价 / 命中概率：首个命中即停止时，按该值升序执行可使平均评估成本最小
+        
+        命中率做拉普拉斯平滑；尚无采样的规则使用同层平均耗时，以便尽快被测量。
+        """
+        cost_us = rule.sampled_ns / rule.sampled / 1000 if rule.sampled else default_us
+        hit_rate = (rule.matches + 1) / (rule.evaluations + 2)
+        return cost_us / hit_rate
+    
+    def optimize_plan(self) -> bool:
+        """
+        按实测耗时与命中率在各成本层内重排执行计划（层间 fast -> accurate -> expensive 不变）
+        
+        新计划以同代规则集的副本整体发布，检测线程无需加锁；与重载冲突时放弃本次优化。
+        
+        Returns:
+            执行顺序是否发生变化
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            ruleset = self.ruleset
+            tiers: Dict[int, List[Rule]] = {}
+            for rule in ruleset.execution_plan:
+                tiers.setdefault(self.cost_rank.get(rule.cost_level, 1), []).append(rule)
+            plan: List[Rule] = []
+            for rank in sorted(tiers):
+                rules = tiers[rank]
+                measured = [r.sampled_ns / r.sampled / 1000 for r in rules if r.sampled]
+                default_us = sum(measured) / len(measured) if measured else 0.0
+                plan.extend(sorted(rules, key=lambda r: (self._selectivity_score(r, default_us), r.priority)))
+            self.plan_stats['optimizations'] += 1
+            self.plan_stats['last_optimized'] = time.time()
+            if all(a is b for a, b in zip(plan, ruleset.execution_plan)):
+                return False
+            self.ruleset = replace(ruleset, execution_plan=tuple(plan))
+            logger.debug(f"规则执行计划已按命中率重排: {[r.name for r in plan]}")
+            return True
+        finally:
+            self._reload_lock.release()
+    
+    def _append_header_targets(self, targets: List[Tuple[str, str, str]], headers: Dict[str, str]):
+        """按 inspect_headers/skip_headers 逐个加入请求头；Cookie 拆成名/值对，命中可归属到具体 Cookie"""
+        inspect, skip = self.inspect_headers, self.skip_headers
+        for name, value in headers.items():
+            if not value or name in skip or (inspect and name not in inspect):
+                continue
+            if name != 'cookie':
+                targets.append((f'header:{name}', 'header', value))
+                continue
+            for cookie_name, cookie_value in HTTPRequestParser.parse_cookies(value):
+                location = f'cookie:{cookie_name}'
+                if cookie_value:
+                    targets.append((location, 'cookie', cookie_value))
+                if not _COOKIE_NAME_TOKEN.fullmatch(cookie_name):
+                    targets.append((location, 'cookie', cookie_name))
+
+    def _append_field(self, targets: List[Tuple[str, str, str]], name: str, value: str):
+        location = f'field:{name}'
+        if value:
+            targets.append((location, 'field', HTTPRequestParser.normalize_text(value)))
+        if not _FIELD_PATH_TOKEN.fullmatch(name):
+            targets.append((location, 'field_name', HTTPRequestParser.normalize_text(name)))
+
+    def _structured_body_targets(self, body, content_type: str) -> Optional[List[Tuple[str, str, str]]]:
+        """
+        multipart 按分段、JSON 按叶子拆成检查目标；文件内容不整体扫描，只嗅探开头 file_sniff_bytes，
+        二进制内容跳过。不是这两种类型或无法解析时返回 None，由调用方整体扫描请求体。
+
+        content_type 为原始请求头值：媒体类型不区分大小写，boundary 区分大小写。
+        """
+        targets: List[Tuple[str, str, str]] = []
+        media_type = content_type.split(';', 1)[0].strip().lower()
+        try:
+            if media_type == 'multipart/form-data':
+                boundary = parse_boundary(content_type)
+                if not boundary:
+                    return None
+                for part in iter_multipart(body, boundary):
+                    if not part.is_file:
+                        value = part.value()
+                        self._append_field(targets, part.name, value if isinstance(value, str) else
+                                           value.decode('utf-8', 'replace'))
+                        continue
+                    for filename in part.filenames:
+                        if filename:
+                            targets.append((f'filename:{part.name}', 'filename',
+                                            HTTPRequestParser.normalize_text(filename)))
+                    if not _FIELD_PATH_TOKEN.fullmatch(part.name):
+                        targets.append((f'field:{part.name}', 'field_name', HTTPRequestParser.normalize_text(part.name)))
+                    head = part.head(self.file_sniff_bytes) if self.file_sniff_bytes else ''
+                    if head and not looks_binary(head):
+                        if not isinstance(head, str):
+                            head = head.decode('utf-8', 'replace')
+                        targets.append((f'file:{part.name}', 'file', HTTPRequestParser.normalize_text(head)))
+            elif 'json' in media_type:
+                for path, value in iter_json_leaves(parse_json_body(body)):
+                    self._append_field(targets, path, value)
+            else:
+                return None
+        except BodyParseError as e:
+            logger.debug(f"请求体无法结构化解析，整体扫描: {e}")
+            return None
+        return targets
+
+    def _match_stream_window(self, ruleset: 'RuleSet', raw_text: str, location: str,
+                             matches: Dict[str, Dict[str, Any]]) -> bool:
+        """
+        对解压流的一个窗口做与请求体相同的规范化与多层解码，评估尚未命中的规则
+
+        Returns:
+            first_match 模式下已有命中、无需继续解压时返回 True
+        """
+        first_match = self.first_match
+        if first_match and matches:
+            return True
+        text = HTTPRequestParser.normalize_text(raw_text)
+        variants = [text]
+        if self.decode_max_depth:
+            decoded = URLDecoder.canonicalize(text, self.decode_max_depth)
+            if decoded != text:
+                variants.append(decoded)
+        for rule in ruleset.execution_plan:
+            if rule.name in matches or (rule.target_set is not None and 'body' not in rule.target_set):
+                continue
+            for variant in variants:
+                if rule.match(variant):
+                    matches[rule.name] = rule.match_info(location, variant)
+                    if first_match:
+                        return True
+                    break
+        return False
+
+    def _scan_compressed_body(self, ruleset: 'RuleSet', body, encodings: List[str]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Content-Encoding 为 gzip/deflate 的请求体逐块解压并匹配，不拼出完整的解压结果
+
+        解压输出或膨胀比超限时停止解压：decompress_limit_action 为 block 时按命中处理，否则只保留已有结果。
+        body 不是压缩数据（无法解码）时返回 None，由调用方按原文扫描。
+        """
+        if isinstance(body, str):
+            try:
+                body = body.encode('latin-1')
+            except UnicodeEncodeError:
+                return None
+        location = f"body:{'+'.join(encodings)}"
+        matches: Dict[str, Dict[str, Any]] = {}
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        tail = ''
+        produced = False
+        self.decompress_stats['bodies'] += 1
+        try:
+            for chunk in iter_decompressed(body, encodings, self.decompress_max_bytes, self.decompress_max_ratio):
+                produced = True
+                window = tail + decoder.decode(chunk)
+                if self._match_stream_window(ruleset, window, location, matches):
+                    return list(matches.values())
+                tail = window[-STREAM_OVERLAP_CHARS:]
+            window = tail + decoder.decode(b'', final=True)
+            if len(window) > len(tail):
+                self._match_stream_window(ruleset, window, location, matches)
+        except DecompressionLimitError as e:
+            self.decompress_stats['limited'] += 1
+            logger.warning(f"请求体解压超限: {e}")
+            if self.decompress_limit_blocks:
+                matches['DECOMPRESSION_LIMIT'] = {
+                    'rule_id': 'DECOMPRESSION_LIMIT', 'rule_name': 'DECOMPRESSION_LIMIT',
+                    'category': 'decompression_bomb', 'severity': 'high', 'priority': 0,
+                    'confidence': 1.0, 'cost_level': 'fast', 'location': location, 'matched_text': str(e)[:100],
+                }
+        except DecompressionError as e:
+            self.decompress_stats['invalid'] += 1
+            logger.debug(f"请求体无法解压，按原文扫描: {e}")
+            if not produced:
+                return None
+        return list(matches.values())
+
     def detect(self, request_data: Dict[str, Any]) -> Tuple[bool, List[Dict[str, Any]]]:
         """
         检测请求是否包含攻击
@@ -132,47 +668,126 @@ class RuleEngine:
             (是否检测到攻击, 匹配的规则列表)
         """
         matched_rules = []
+        # 整个检测过程只使用这一份规则集快照，重载不会影响在途请求
+        ruleset = self.ruleset
+        match_cache = self.match_cache
+        metrics = self.metrics
 
         # 命中缓存：同一 URI + IP 短时间内直接复用结果
         src_ip = request_data.get('source_ip', '') or ''
         uri = request_data.get('url', '') or ''
         cache_key = f"{src_ip}|{uri}"
         now = time.monotonic()
-        cached = self.match_cache.get(cache_key)
-        if cached and (now - cached[0]) <= self.cache_ttl_seconds:
-            return cached[1]
+        cached = match_cache.get(cache_key)
+        if cached and cached[0] == ruleset.generation and (now - cached[1]) <= self.cache_ttl_seconds:
+            if metrics is not None:
+                metrics.rule_cache.inc('hit')
+            return cached[2]
         if cached:
-            self.match_cache.pop(cache_key, None)
+            match_cache.pop(cache_key, None)
+        if metrics is not None:
+            metrics.rule_cache.inc('miss')
+            stage_start = time.perf_counter()
         
+        # 压缩请求体逐块解压匹配；结构化请求体（multipart/JSON）按字段检查。
+        # 两种情况都不再对整个请求体做规范化与扫描
+        body_targets = None
+        stream_matches = None
+        body = request_data.get('body')
+        if body:
+            content_type = content_encoding = ''
+            for name, value in (request_data.get('headers') or {}).items():
+                name = str(name).lower()
+                if name == 'content-type':
+                    content_type = str(value).strip()
+                elif name == 'content-encoding':
+                    content_encoding = str(value)
+            encodings = parse_content_encoding(content_encoding) if self.decompress_bodies else []
+            if encodings:
+                stream_matches = self._scan_compressed_body(ruleset, body, encodings)
+            elif content_type and self.structured_body:
+                body_targets = self._structured_body_targets(body, content_type)
+            if body_targets is not None or stream_matches is not None:
+                request_data = dict(request_data, body='')
+
         normalized = HTTPRequestParser.normalize_request(request_data)
-        check_strings = [
-            normalized.get('url', ''),
-            normalized.get('method', ''),
-            str(normalized.get('headers', {})),
-            normalized.get('body', ''),
-            normalized.get('query_string', ''),
-        ]
-
-        # 分层匹配：fast -> accurate -> expensive
-        sorted_rules = sorted(
-            self.rules,
-            key=lambda r: (self.cost_rank.get(r.cost_level, 1), r.priority)
-        )
-        
-        for rule in sorted_rules:
-            for check_str in check_strings:
-                if rule.match(check_str):
-                    matched_rules.append({
-                        'rule_id': rule.name,
-                        'rule_name': rule.name,
-                        'category': rule.category,
-                        'severity': rule.severity,
-                        'priority': rule.priority,
-                        'confidence': rule.confidence,
-                        'cost_level': rule.cost_level,
-                        'matched_text': check_str[:100]  # 仅保留前100字符
-                    })
+        # 检查目标: (位置, 类别, 文本)，位置随命中结果返回，如 url、header:user-agent、filename:upload；
+        # 规则的 targets 按类别限定检查范围
+        targets = [('url', 'url', normalized.get('url', '')), ('method', 'method', normalized.get('method', ''))]
+        self._append_header_targets(targets, normalized.get('headers') or {})
+        if body_targets is not None:
+            targets.extend(body_targets)
+        else:
+            targets.append(('body', 'body', normalized.get('body', '')))
+        targets.append(('query', 'query', normalized.get('query_string', '')))
+        targets = [target for target in targets if target[2]]
+        # 多层解码：规范形式与规范化结果不同时追加检查（双重编码、HTML实体、\xNN 等），
+        # 同一请求内相同文本只解码一次
+        if self.decode_max_depth:
+            memo: Dict[str, str] = {}
+            for location, kind, text in list(targets):
+                if kind == 'method':
+                    continue
+                decoded = URLDecoder.canonicalize(text, self.decode_max_depth, memo)
+                if decoded != text:
+                    targets.append((location, kind, decoded))
+            raw_url = str(uri)
+            if _RAW_URL_SEPARATORS.search(raw_url):
+                raw_query = raw_url.partition('?')[2] or str(request_data.get('query_string') or '')
+                for kind, text in (('url', raw_url), ('query', raw_query)):
+                    if text:
+                        targets.append((kind, kind, URLDecoder.canonicalize(text.lower(), self.decode_max_depth, memo)))
+
+        # 剖析：每个请求累加评估/命中计数，每 profile_sample_every 个请求计时一次
+        profiling = self.profiling
+        sampled = False
+        if profiling:
+            self._profile_counter += 1
+            sampled = self._profile_counter % self.profile_sample_every == 0
+
+        # 分层匹配：fast -> accurate -> expensive（执行计划加载时已排好序）
+        # first_match 模式下命中第一条规则即停止，只返回该规则
+        first_match = self.first_match
+        tier = None
+        if metrics is not None:
+            tier_start = time.perf_counter()
+            metrics.observe_stage('normalize', tier_start - stage_start)
+        # 解压流中已命中时，first_match 模式不再评估其余目标
+        execution_plan = () if first_match and stream_matches else ruleset.execution_plan
+        for rule in execution_plan:
+            if metrics is not None and rule.cost_level != tier:
+                if tier is not None:
+                    tier_end = time.perf_counter()
+                    metrics.observe_stage(self._tier_stage.get(tier, 'rules_other'), tier_end - tier_start)
+                    tier_start = tier_end
+                tier = rule.cost_level
+            matched = False
+            if sampled:
+                start = time.perf_counter_ns()
+            rule_targets = rule.target_set
+            for location, kind, check_str in targets:
+                if rule_targets is not None and kind not in rule_targets:
+                    continue
+                if rule.match_profiled(check_str) if sampled else rule.match(check_str):
+                    matched = True
+                    matched_rules.append(rule.match_info(location, check_str))
+                    if first_match:
+                        break
+            if profiling:
+                rule.evaluations += 1
+                if matched:
+                    rule.matches += 1
+                if sampled:
+                    rule.sampled += 1
+                    rule.sampled_ns += time.perf_counter_ns() - start
+            if matched and first_match:
+                break
+        if tier is not None:
+            metrics.observe_stage(self._tier_stage.get(tier, 'rules_other'), time.perf_counter() - tier_start)
         
+        if stream_matches:
+            matched_rules.extend(stream_matches)
+
         # 去重：按规则名称去重，保留最高严重级别
         unique_rules = {}
         for rule in matched_rules:
@@ -184,14 +799,32 @@ class RuleEngine:
         
         matched_rules = list(unique_rules.values())
         result = (len(matched_rules) > 0, matched_rules)
-        self.match_cache[cache_key] = (now, result)
+        match_cache[cache_key] = (ruleset.generation, now, result)
+        
+        # 周期性重排执行计划：由越过期限的请求顺带完成，拿不到锁时直接跳过
+        if self.adaptive_ordering and first_match and profiling and now >= self._next_optimize:
+            self._next_optimize = now + self.adaptive_interval_seconds
+            self.optimize_plan()
         return result
     
-    def reload_rules(self):
-        """重新加载规则"""
-        self.rules.clear()
-        self.load_config()
-        self.load_rules()
+    def reload_rules(self, trigger: str = 'manual'):
+        """重新读取配置并加载规则
+        
+        Raises:
+            RuleSetValidationError: 配置无效或新规则集未通过校验（当前配置与规则集保持不变）
+        """
+        try:
+            previous = self.load_config()
+        except RuleSetValidationError:
+            self._record_rejection(trigger)
+            raise
+        try:
+            self.load_rules(trigger)
+        except RuleSetValidationError:
+            # 新规则集被拒绝：设置回到与当前规则集一致的状态，之后的文件监视仍按原规则文件列表进行
+            for name, value in previous.items():
+                setattr(self, name, value)
+            raise
         logger.info("规则已重新加载")
 
     def get_all_rules(self) -> List[Dict[str, Any]]:
@@ -199,24 +832,120 @@ class RuleEngine:
 
         如果内部使用的是对象列表，会将每个 Rule 转换为字典。
         """
-        return [r.to_dict() if hasattr(r, 'to_dict') else r for r in self.rules]
+        return [r.to_dict() if hasattr(r, 'to_dict') else r for r in self.ruleset.rules]
     
     def get_rules_by_category(self, category: str) -> List[Rule]:
         """按类别获取规则"""
-        return [r for r in self.rules if r.category == category]
+        return [r for r in self.ruleset.rules if r.category == category]
+    
+    def attach_metrics(self, metrics):
+        """接入 WAFMetrics：记录缓存命中、规范化与各成本层耗时、重载耗时，并导出规则集状态"""
+        self.metrics = metrics
+        registry = metrics.registry
+        registry.gauge_callback('waf_rules_loaded', '当前规则集的规则数（按是否启用）',
+                                lambda: {('true',): sum(1 for r in self.ruleset.rules if r.enabled),
+                                         ('false',): sum(1 for r in self.ruleset.rules if not r.enabled)},
+                                ('enabled',))
+        registry.gauge_callback('waf_rule_generation', '当前规则集代数', lambda: self.ruleset.generation)
+        registry.gauge_callback('waf_regex_timeouts_total', '正则匹配超时次数（当前规则集）',
+                                lambda: sum(r.timeouts for r in self.ruleset.rules), kind='counter')
+        if self.ruleset.generation > 0:
+            metrics.reload_seconds.observe(self.load_duration_ms / 1000.0, 'startup')
+    
+    def get_rule_profile(self, sort_by: str = 'cost', limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        规则级与正则级性能剖析
+        
+        耗时来自采样请求，``est_total_ms`` 按平均耗时外推到全部评估次数，
+        用于依据真实流量调整 cost_level / priority。
+        
+        Args:
+            sort_by: cost（估算总耗时）、avg（单次平均耗时）、hits（命中数）、evaluations、name
+            limit: 返回的规则数上限
+        """
+        sort_keys = {
+            'cost': lambda r: -r['est_total_ms'],
+            'avg': lambda r: -r['avg_us'],
+            'hits': lambda r: -r['matches'],
+            'evaluations': lambda r: -r['evaluations'],
+            'name': lambda r: r['name'],
+        }
+        if sort_by not in sort_keys:
+            raise ValueError(f"不支持的排序字段: {sort_by}，可选 {sorted(sort_keys)}")
+        
+        rules = []
+        for rule in self.ruleset.rules:
+            avg_us = rule.sampled_ns / rule.sampled / 1000 if rule.sampled else 0.0
+            patterns = []
+            for index, (fast, _, _) in enumerate(rule.compiled_patterns):
+                patterns.append({
+                    'pattern': fast.pattern,
+                    'sampled_hits': rule.pattern_hits[index],
+                    'avg_us': round(rule.pattern_ns[index] / rule.sampled / 1000, 3) if rule.sampled else 0.0,
+                })
+            rules.append({
+                'name': rule.name,
+                'category': rule.category,
+                'cost_level': rule.cost_level,
+                'priority': rule.priority,
+                'enabled': rule.enabled,
+                'evaluations': rule.evaluations,
+                'matches': rule.matches,
+                'hit_rate': rule.matches / rule.evaluations if rule.evaluations else 0.0,
+                'never_fired': rule.evaluations > 0 and rule.matches == 0,
+                'sampled': rule.sampled,
+                'avg_us': round(avg_us, 3),
+                'est_total_ms': round(avg_us * rule.evaluations / 1000, 3),
+                'timeouts': rule.timeouts,
+                'patterns': sorted(patterns, key=lambda p: -p['avg_us']),
+            })
+        rules.sort(key=sort_keys[sort_by])
+        return {
+            'enabled': self.profiling,
+            'sample_every': self.profile_sample_every,
+            'generation': self.ruleset.generation,
+            'sort_by': sort_by,
+            'rules': rules[:limit] if limit else rules,
+        }
+    
+    def reset_rule_profile(self):
+        """清零所有规则的剖析计数"""
+        for rule in self.ruleset.rules:
+            rule.reset_profile()
+    
+    def get_regex_report(self, include_safe: bool = False) -> List[Dict[str, Any]]:
+        """
+        加载时正则分析结果（回溯风险与实测最坏耗时），按最坏耗时降序
+        
+        Args:
+            include_safe: 是否包含无风险的正则
+        """
+        ruleset = self.ruleset
+        if ruleset.bundle is None:
+            return []
+        reports = [dict(report, file=entry['path'])
+                   for entry in ruleset.bundle.files
+                   for report in entry.get('pattern_analysis', {}).values()
+                   if include_safe or report['risk'] != RISK_SAFE]
+        return sorted(reports, key=lambda r: r['worst_case_ms'] or 0.0, reverse=True)
     
     def get_stats(self) -> Dict[str, Any]:
         """获取规则统计信息"""
+        ruleset = self.ruleset
         categories = {}
         severity_dist = {}
         
-        for rule in self.rules:
+        for rule in ruleset.rules:
             categories[rule.category] = categories.get(rule.category, 0) + 1
             severity_dist[rule.severity] = severity_dist.get(rule.severity, 0) + 1
         
+        risk_dist = {}
+        for report in self.get_regex_report(include_safe=True):
+            risk_dist[report['risk']] = risk_dist.get(report['risk'], 0) + 1
+        
         latest_version = None
         latest_release = None
-        for meta in self.rule_metadata:
+        for meta in ruleset.metadata:
             version = meta.get('version')
             release_date = meta.get('release_date')
             if version and (latest_version is None or version > latest_version):
@@ -225,11 +954,30 @@ class RuleEngine:
                 latest_release = release_date
 
         return {
-            'total_rules': len(self.rules),
-            'enabled_rules': sum(1 for r in self.rules if r.enabled),
+            'total_rules': len(ruleset.rules),
+            'enabled_rules': sum(1 for r in ruleset.rules if r.enabled),
             'by_category': categories,
             'by_severity': severity_dist,
             'latest_rule_version': latest_version,
             'latest_rule_release_date': latest_release,
-            'load_duration_ms': self.load_duration_ms
+            'decompression': dict(self.decompress_stats),
+            'load_duration_ms': self.load_duration_ms,
+            'generation': ruleset.generation,
+            'reload': dict(self.reload_stats),
+            'matching': {
+                'mode': 'first' if self.first_match else 'all',
+                'adaptive_ordering': self.adaptive_ordering,
+                'plan_optimizations': self.plan_stats['optimizations'],
+                'last_optimized': self.plan_stats['last_optimized'],
+            },
+            'regex': {
+                'engine': self.regex_options['engine'],
+                'timeout_ms': self.regex_options['timeout'] * 1000 if self.regex_options['timeout'] else None,
+                'patterns_by_risk': risk_dist,
+                'timeouts': sum(r.timeouts for r in ruleset.rules),
+            },
+            'rule_bundle': {
+                'source_hash': ruleset.bundle.source_hash[:16] if ruleset.bundle else None,
+                'from_cache': ruleset.bundle.from_cache if ruleset.bundle else False,
+            }
         }
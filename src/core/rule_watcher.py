@@ -0,0 +1,158 @@
+"""
+规则文件监视器 - 实现 rules.auto_reload
+后台线程按 rules.reload_interval 轮询规则文件与配置文件的 mtime/size，
+发生变化时再比对内容哈希，确有变化才触发重载；未变化文件的解析结果由规则包复用。
+"""
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.core.rule_bundle import content_hash
+from src.core.rule_engine import RuleEngine, RuleSetValidationError
+
+logger = logging.getLogger(__name__)
+
+# 轮询间隔下限（秒），避免配置为 0 时空转
+MIN_POLL_INTERVAL = 1.0
+
+
+def _stat_signature(path: str) -> Optional[Tuple[int, int]]:
+    """文件的 (mtime_ns, size)，文件不存在时返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _read_hash(path: str) -> Optional[str]:
+    try:
+        with open(path, 'rb') as f:
+            return content_hash(f.read())
+    except OSError:
+        return None
+
+
+class RuleWatcher:
+    """规则文件监视器"""
+
+    def __init__(self, engine: RuleEngine, interval: float = 300):
+        self.engine = engine
+        self.interval = max(float(interval), MIN_POLL_INTERVAL)
+        self._signatures: Dict[str, Optional[Tuple[int, int]]] = {}
+        self._config_hash: Optional[str] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.polls = 0
+        self.last_error: Optional[str] = None
+        self._snapshot()
+
+    def _watched_files(self) -> List[str]:
+        return [str(self.engine.config_path)] + list(self.engine.rule_files)
+
+    def _snapshot(self):
+        """记录当前所有被监视文件的签名"""
+        self._signatures = {path: _stat_signature(path) for path in self._watched_files()}
+        self._config_hash = _read_hash(str(self.engine.config_path))
+
+    def changed_files(self) -> List[str]:
+        """
+        返回内容确实发生变化的规则文件
+
+        先用 mtime/size 快速筛选，签名变化的文件再与当前规则包中的内容哈希比对，
+        仅 touch 或写回相同内容不会触发重载。
+        """
+        bundle = self.engine.bundle
+        known = bundle.file_hashes if bundle else {}
+        changed = []
+        for path in self.engine.rule_files:
+            signature = _stat_signature(path)
+            if signature == self._signatures.get(path):
+                continue
+            self._signatures[path] = signature
+            if _read_hash(path) != known.get(path):
+                changed.append(path)
+        return changed
+
+    def config_changed(self) -> bool:
+        """配置文件内容变化（规则文件列表可能增减）"""
+        config_path = str(self.engine.config_path)
+        signature = _stat_signature(config_path)
+        if signature == self._signatures.get(config_path):
+            return False
+        self._signatures[config_path] = signature
+        config_hash = _read_hash(config_path)
+        if config_hash == self._config_hash:
+            return False
+        self._config_hash = config_hash
+        return True
+
+    def poll(self) -> bool:
+        """
+        执行一次检查，有变化时重载规则
+
+        Returns:
+            是否发布了新的规则集
+        """
+        self.polls += 1
+        config_changed = self.config_changed()
+        changed = self.changed_files()
+        if not config_changed and not changed:
+            return False
+
+        generation = self.engine.ruleset.generation
+        try:
+            if config_changed:
+                logger.info("配置文件已变化，重新加载规则配置")
+                self.engine.reload_rules(trigger='watcher')
+                self._snapshot()
+            else:
+                logger.info(f"检测到规则文件变化: {changed}")
+                self.engine.load_rules(trigger='watcher')
+            self.last_error = None
+        except RuleSetValidationError as e:
+            # 文件可能仍在编辑中，保留当前规则集，等待下一次写入
+            self.last_error = str(e)
+            logger.warning(f"自动重载被拒绝: {e}")
+            return False
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"自动重载失败: {e}")
+            return False
+
+        published = self.engine.ruleset.generation != generation
+        if published:
+            last = self.engine.reload_stats['last_reload']
+            logger.info(f"规则自动重载完成: 第 {last['generation']} 代, {last['duration_ms']}ms, "
+                        f"规则数变化 {last['rule_delta']:+d}, 变化文件 {last['changed_files']}")
+        return published
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.poll()
+
+    def start(self) -> 'RuleWatcher':
+        """启动后台监视线程（守护线程）"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='rule-watcher', daemon=True)
+            self._thread.start()
+            logger.info(f"规则自动重载已启用: 每 {self.interval:g}s 检查 {len(self.engine.rule_files)} 个规则文件")
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        """停止监视线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'interval_seconds': self.interval,
+            'watched_files': self._watched_files(),
+            'polls': self.polls,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,392 @@
+"""
+跨进程共享状态 - 基于 multiprocessing.shared_memory 的定长哈希表
+多个工作进程（fork 自同一主进程）共享封禁名单、拦截计数与限流令牌桶，无需外部服务。
+
+- 表按键哈希分成若干条带（stripe），每个条带一把进程间锁，探测只在条带内进行
+- 槽位定长：键哈希 + 完整键的摘要（判定是否同一个键）+ 键文本（截断，仅用于展示）+ 若干 float 字段 + 可选的定长文本
+- 插入时最多探测 max_probe 个槽位，没有空位则淘汰其中 evict_field 最小的条目（令牌桶即最久未访问）
+- 共享内存与锁必须在 fork 之前由主进程创建，工作进程继承后直接使用
+- 条带锁记录持有者 pid：持有者被 SIGKILL 后由等待者接管；持有者存活但超过 lock_timeout 仍未释放时
+  本次操作放弃（读不到条目、写入丢弃，即封禁与限流放行）并记录错误，不会让所有工作进程一起卡死
+"""
+import atexit
+import hashlib
+import logging
+import multiprocessing
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EMPTY, DELETED = 0, 1
+DEFAULT_KEY_BYTES = 64
+# 计数器名（含指标标签值）在 snapshot 中按保存的键文本还原，保存更长的键文本
+COUNTER_KEY_BYTES = 256
+# 键摘要长度：前 8 字节兼作槽位哈希，整个摘要相同才视为同一个键
+DIGEST_BYTES = 16
+DEFAULT_MAX_PROBE = 16
+# 等待条带锁时每隔这么久检查一次持有者是否已退出；超过 DEFAULT_LOCK_TIMEOUT 放弃本次操作
+LOCK_POLL_SECONDS = 0.05
+DEFAULT_LOCK_TIMEOUT = 2.0
+
+Values = Tuple[float, ...]
+
+
+def key_digest(data: bytes) -> Tuple[int, bytes]:
+    """
+    完整键的跨进程稳定摘要（内置 hash() 每个解释器随机化），返回 (64 位槽位哈希, 摘要)
+
+    槽位哈希取摘要前 8 字节，0/1 保留给空槽与删除标记。键按摘要判定是否相同，
+    超过 key_bytes 的长键（如带长路径的限流键）只是展示文本被截断，不会与共享前缀的其他键混为一个。
+    """
+    digest = hashlib.blake2b(data, digest_size=DIGEST_BYTES).digest()
+    value = int.from_bytes(digest[:8], 'little')
+    return (value if value > DELETED else value + 2), digest
+
+
+def _pid_alive(pid: int) -> bool:
+    """进程是否仍在运行（僵尸进程视为已退出）"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            return f.read().rsplit(b')', 1)[1].split()[0] != b'Z'
+    except (OSError, IndexError):
+        return True
+
+
+class SharedTable:
+    """
+    共享内存中的定长开放寻址哈希表
+
+    Args:
+        slots: 槽位总数（按条带数向下取整）
+        fields: 每个条目的 float 字段数
+        evict_field: 探测范围内没有空位时，淘汰该字段值最小的条目
+        text_bytes: 每个条目附带的定长文本字节数（UTF-8，超出截断）
+        lock_timeout: 条带锁被存活进程占用超过该秒数时放弃本次操作
+    """
+
+    def __init__(self, slots: int, fields: int, stripes: int = 16, evict_field: int = 0,
+                 text_bytes: int = 0, key_bytes: int = DEFAULT_KEY_BYTES, max_probe: int = DEFAULT_MAX_PROBE,
+                 lock_timeout: float = DEFAULT_LOCK_TIMEOUT):
+        stripes = max(1, min(int(stripes), int(slots)))
+        self.stripes = stripes
+        self.stripe_slots = max(1, int(slots) // stripes)
+        self.slots = self.stripe_slots * stripes
+        self.fields = fields
+        self.evict_field = evict_field
+        self.max_probe = min(max_probe, self.stripe_slots)
+        self.key_bytes = key_bytes
+        self.text_bytes = text_bytes
+        self.lock_timeout = lock_timeout
+        self.lock_failures = 0
+        self._slot = struct.Struct(f'<Q{DIGEST_BYTES}s{key_bytes}s{fields}d' + (f'{text_bytes}s' if text_bytes else ''))
+        self._values = struct.Struct(f'<{fields}d')
+        self._hash = struct.Struct('<Q')
+        self._slot_digest = struct.Struct(f'<Q{DIGEST_BYTES}s')
+        self._count = struct.Struct('<q')
+        # 头部: 每个条带的条目数 + 淘汰次数 + 每个条带锁的持有者 pid（0 为未持有）
+        self._header = struct.Struct(f'<{stripes + 1}q')
+        self._owners_offset = self._header.size
+        self._header_size = self._header.size + stripes * self._count.size
+        self._shm = shared_memory.SharedMemory(create=True, size=self._header_size + self.slots * self._slot.size)
+        # 新建的共享内存已清零，即全部为空槽
+        self._buf = self._shm.buf
+        self._locks = [multiprocessing.Lock() for _ in range(stripes)]
+        # 接管已退出持有者的条带锁时使用，保证只有一个等待者接管
+        self._recovery_lock = multiprocessing.Lock()
+        self._owner = os.getpid()
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def _acquire(self, stripe: int) -> bool:
+        """获取条带锁；持有者已退出时接管，存活的持有者超过 lock_timeout 仍未释放时返回 False"""
+        lock = self._locks[stripe]
+        deadline = None
+        while not lock.acquire(timeout=LOCK_POLL_SECONDS):
+            if self._recover(stripe):
+                break
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + self.lock_timeout - LOCK_POLL_SECONDS
+            elif now >= deadline:
+                self.lock_failures += 1
+                logger.error(f"共享表条带锁 {stripe} 被进程 {self._lock_owner(stripe)} 占用超过 "
+                             f"{self.lock_timeout:g}s，放弃本次操作")
+                return False
+        self._count.pack_into(self._buf, self._owners_offset + stripe * self._count.size, os.getpid())
+        return True
+
+    def _release(self, stripe: int):
+        self._count.pack_into(self._buf, self._owners_offset + stripe * self._count.size, 0)
+        self._locks[stripe].release()
+
+    def _lock_owner(self, stripe: int) -> int:
+        return self._count.unpack_from(self._buf, self._owners_offset + stripe * self._count.size)[0]
+
+    def _recover(self, stripe: int) -> bool:
+        """条带锁的持有者已退出（如被 SIGKILL）时由当前进程接管该锁，返回是否接管"""
+        owner = self._lock_owner(stripe)
+        if owner <= 0 or owner == os.getpid() or _pid_alive(owner):
+            return False
+        if not self._recovery_lock.acquire(timeout=LOCK_POLL_SECONDS):
+            return False
+        try:
+            # 其他等待者可能已先一步接管
+            if self._lock_owner(stripe) != owner:
+                return False
+            self._count.pack_into(self._buf, self._owners_offset + stripe * self._count.size, os.getpid())
+        finally:
+            self._recovery_lock.release()
+        logger.error(f"共享表条带锁 {stripe} 的持有者进程 {owner} 已退出，由进程 {os.getpid()} 接管")
+        return True
+
+    def _add_count(self, header_index: int, delta: int):
+        offset = header_index * self._count.size
+        self._count.pack_into(self._buf, offset, self._count.unpack_from(self._buf, offset)[0] + delta)
+
+    def _locate(self, key: str) -> Tuple[bytes, int, bytes, int, int, int]:
+        """(完整键的编码, 哈希, 摘要, 条带, 条带首槽位, 条带内起始槽位)"""
+        encoded = key.encode('utf-8', 'surrogatepass')
+        h, digest = key_digest(encoded)
+        stripe = h % self.stripes
+        return encoded, h, digest, stripe, stripe * self.stripe_slots, (h // self.stripes) % self.stripe_slots
+
+    def _find(self, digest: bytes, h: int, base: int, home: int) -> Tuple[Optional[int], Optional[int]]:
+        """返回 (键所在槽位的偏移, 可用于插入的槽位偏移)；调用方持有条带锁"""
+        buf, unpack_hash, header, size = self._buf, self._hash.unpack_from, self._header_size, self._slot.size
+        free = None
+        for step in range(self.max_probe):
+            offset = header + (base + (home + step) % self.stripe_slots) * size
+            slot_hash = unpack_hash(buf, offset)[0]
+            if slot_hash == h and self._slot_digest.unpack_from(buf, offset)[1] == digest:
+                return offset, None
+            if slot_hash == EMPTY:
+                return None, offset if free is None else free
+            if slot_hash == DELETED and free is None:
+                free = offset
+        return None, free
+
+    def _victim(self, base: int, home: int) -> int:
+        values_offset = self._slot_digest.size + self.key_bytes
+        best, best_value = None, None
+        for step in range(self.max_probe):
+            offset = self._header_size + (base + (home + step) % self.stripe_slots) * self._slot.size
+            value = self._values.unpack_from(self._buf, offset + values_offset)[self.evict_field]
+            if best is None or value < best_value:
+                best, best_value = offset, value
+        return best
+
+    def _decode(self, record: tuple) -> Tuple[Values, str]:
+        text = record[-1].rstrip(b'\0').decode('utf-8', 'ignore') if self.text_bytes else ''
+        return record[3:3 + self.fields], text
+
+    def update(self, key: str, fn: Callable[[Optional[Values]], Optional[Values]],
+               text: Optional[str] = None) -> Optional[Tuple[Values, str]]:
+        """
+        在条带锁内读-改-写一个条目：fn 收到当前字段（不存在时为 None），返回新字段或 None（删除）
+
+        text 为 None 时保留原文本。返回写入后的 (字段, 文本)，删除或不存在时返回 None。
+        """
+        encoded, h, digest, stripe, base, home = self._locate(key)
+        if not self._acquire(stripe):
+            return None
+        try:
+            offset, free = self._find(digest, h, base, home)
+            if offset is not None:
+                current, current_text = self._decode(self._slot.unpack_from(self._buf, offset))
+            else:
+                current, current_text = None, ''
+            new = fn(current)
+            if new is None:
+                if offset is not None:
+                    self._hash.pack_into(self._buf, offset, DELETED)
+                    self._add_count(stripe, -1)
+                return None
+            if offset is None:
+                if free is not None:
+                    offset = free
+                    self._add_count(stripe, 1)
+                else:
+                    offset = self._victim(base, home)
+                    self._add_count(self.stripes, 1)
+            display = encoded[:self.key_bytes]
+            if not self.text_bytes:
+                self._slot.pack_into(self._buf, offset, h, digest, display, *new)
+                return tuple(map(float, new)), ''
+            encoded_text = (current_text if text is None else text).encode('utf-8')[:self.text_bytes]
+            self._slot.pack_into(self._buf, offset, h, digest, display, *new, encoded_text)
+            return tuple(map(float, new)), encoded_text.decode('utf-8', 'ignore')
+        finally:
+            self._release(stripe)
+
+    def get(self, key: str) -> Optional[Tuple[Values, str]]:
+        _, h, digest, stripe, base, home = self._locate(key)
+        if not self._acquire(stripe):
+            return None
+        try:
+            offset, _ = self._find(digest, h, base, home)
+            return self._decode(self._slot.unpack_from(self._buf, offset)) if offset is not None else None
+        finally:
+            self._release(stripe)
+
+    def delete(self, key: str) -> bool:
+        existed = []
+        self.update(key, lambda values: existed.append(values) or None)
+        return bool(existed and existed[0] is not None)
+
+    def items(self) -> Iterator[Tuple[str, Values, str]]:
+        """逐条带加锁遍历 (键文本, 字段, 文本)；键文本只保存前 key_bytes 字节，超出时为截断形式（仅供展示）"""
+        for stripe in range(self.stripes):
+            if not self._acquire(stripe):
+                continue
+            try:
+                records = []
+                for index in range(stripe * self.stripe_slots, (stripe + 1) * self.stripe_slots):
+                    offset = self._header_size + index * self._slot.size
+                    if self._hash.unpack_from(self._buf, offset)[0] > DELETED:
+                        record = self._slot.unpack_from(self._buf, offset)
+                        records.append((record[2].rstrip(b'\0').decode('utf-8', 'ignore'), *self._decode(record)))
+            finally:
+                self._release(stripe)
+            yield from records
+
+    def __len__(self) -> int:
+        return sum(self._header.unpack_from(self._buf)[:self.stripes])
+
+    @property
+    def evictions(self) -> int:
+        return self._count.unpack_from(self._buf, self.stripes * self._count.size)[0]
+
+    def close(self):
+        """解除映射；创建者进程同时删除共享内存"""
+        if self._buf is None:
+            return
+        self._buf.release()
+        self._buf = None
+        self._shm.close()
+        if os.getpid() == self._owner:
+            self._shm.unlink()
+
+
+class SharedCounters:
+    """
+    按名称计数的共享计数器（单字段 SharedTable），各工作进程累加到同一份
+
+    热路径上的累加先记在本进程，攒够 batch 次或距上次写入超过 flush_seconds 时再加锁写入共享表；
+    本进程读到的是共享值加上未写入的部分，其他进程看到的值最多滞后这一批。
+    计数器按完整名称区分；snapshot 中的名称只保留前 COUNTER_KEY_BYTES 字节。
+    """
+
+    def __init__(self, table: SharedTable, batch: int = 64, flush_seconds: float = 1.0):
+        self.table = table
+        self.batch = batch
+        self.flush_seconds = flush_seconds
+        self._pending: Dict[str, float] = {}
+        self._pid = os.getpid()
+        self._flushed_at = time.monotonic()
+
+    def _local(self) -> Dict[str, float]:
+        # fork 出的子进程继承了父进程未写入的累加，丢弃以免重复计数
+        if self._pid != os.getpid():
+            self._pid, self._pending = os.getpid(), {}
+        return self._pending
+
+    def add(self, name: str, amount: float = 1):
+        pending = self._local()
+        value = pending[name] = pending.get(name, 0) + amount
+        if value >= self.batch or time.monotonic() - self._flushed_at >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        pending = self._local()
+        self._flushed_at = time.monotonic()
+        for name in list(pending):
+            amount = pending.pop(name)
+            self.table.update(name, lambda values: ((values[0] if values else 0) + amount,))
+
+    def get(self, name: str) -> int:
+        entry = self.table.get(name)
+        return int((entry[0][0] if entry else 0) + self._local().get(name, 0))
+
+    def snapshot(self) -> Dict[str, int]:
+        self.flush()
+        return {key: int(values[0]) for key, values, _ in self.table.items()}
+
+
+class LocalCounters(dict):
+    """与 SharedCounters 接口一致的进程内计数器，未启用共享状态时使用"""
+
+    def add(self, name: str, amount: float = 1):
+        self[name] = self.get(name, 0) + amount
+
+    def get(self, name: str, default: int = 0) -> int:
+        return int(super().get(name, default))
+
+    def flush(self):
+        pass
+
+    def snapshot(self) -> Dict[str, int]:
+        return {key: int(value) for key, value in self.items()}
+
+
+class SharedState:
+    """
+    共享状态容器：统一创建共享表，创建者进程退出时删除全部共享内存
+
+    Args:
+        stripes: 每张表的条带（锁）数
+        counter_slots: 计数器表的槽位数
+    """
+
+    def __init__(self, stripes: int = 16, counter_slots: int = 1024):
+        self.stripes = stripes
+        self.tables: List[SharedTable] = []
+        self.counters = SharedCounters(self.table(counter_slots, 1, key_bytes=COUNTER_KEY_BYTES))
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, config) -> Optional['SharedState']:
+        """由 settings.yaml 的 shared_state 段构建；未启用时返回 None"""
+        config = config or {}
+        if not config.get('enabled', False):
+            return None
+        return cls(stripes=int(config.get('stripes', 16)), counter_slots=int(config.get('counter_slots', 1024)))
+
+    def table(self, slots: int, fields: int, evict_field: int = 0, text_bytes: int = 0,
+              key_bytes: int = DEFAULT_KEY_BYTES) -> SharedTable:
+        table = SharedTable(slots, fields, self.stripes, evict_field, text_bytes, key_bytes)
+        self.tables.append(table)
+        return table
+
+    def flush(self):
+        """写入本进程攒下的计数；工作进程退出前调用"""
+        self.counters.flush()
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            'tables': len(self.tables),
+            'bytes': sum(t._shm.size for t in self.tables),
+            'entries': sum(len(t) for t in self.tables),
+            'evictions': sum(t.evictions for t in self.tables),
+            'lock_failures': sum(t.lock_failures for t in self.tables),
+        }
+
+    def close(self):
+        if self.tables and self.tables[0]._buf is not None:
+            self.flush()
+        for table in self.tables:
+            try:
+                table.close()
+            except (BufferError, FileNotFoundError) as e:
+                logger.debug(f"关闭共享内存失败: {e}")
@@ -0,0 +1,226 @@
+"""
+白名单 - IP/CIDR 前缀树与路径前缀树
+在规范化与正则匹配之前判定，受信任的健康检查、内部调用方直接放行；
+查询耗时只与键长（地址位数 / 路径段数）有关，与白名单条目数无关。
+增删条目只修改对应节点，无需重建。
+"""
+import ipaddress
+import logging
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 前缀树节点: [子节点0, 子节点1, 命中的条目]
+_ZERO, _ONE, _ENTRY = 0, 1, 2
+
+
+class CIDRTrie:
+    """按位展开的二进制前缀树，IPv4 与 IPv6 各一棵，最长前缀匹配"""
+
+    def __init__(self):
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+        self._hosts: Dict[Tuple[int, int], str] = {}  # 单主机条目（/32、/128）直接查表
+
+    def insert(self, network: ipaddress._BaseNetwork, entry: str):
+        if network.prefixlen == network.max_prefixlen:
+            self._hosts[(network.version, int(network.network_address))] = entry
+            return
+        node = self._roots[network.version]
+        value, bits = int(network.network_address), network.max_prefixlen
+        for i in range(network.prefixlen):
+            bit = (value >> (bits - 1 - i)) & 1
+            child = node[bit]
+            if child is None:
+                child = node[bit] = [None, None, None]
+            node = child
+        node[_ENTRY] = entry
+
+    def remove(self, network: ipaddress._BaseNetwork):
+        """清除条目标记；空节点保留，不影响查询正确性"""
+        if network.prefixlen == network.max_prefixlen:
+            self._hosts.pop((network.version, int(network.network_address)), None)
+            return
+        node = self._roots[network.version]
+        value, bits = int(network.network_address), network.max_prefixlen
+        for i in range(network.prefixlen):
+            node = node[(value >> (bits - 1 - i)) & 1]
+            if node is None:
+                return
+        node[_ENTRY] = None
+
+    def lookup(self, address: ipaddress._BaseAddress) -> Optional[str]:
+        """返回覆盖该地址的白名单条目（最长前缀），不在白名单时返回 None"""
+        value = int(address)
+        entry = self._hosts.get((address.version, value))
+        if entry is not None:
+            return entry
+        node = self._roots[address.version]
+        bit_index = address.max_prefixlen - 1
+        found = None
+        while node is not None:
+            if node[_ENTRY] is not None:
+                found = node[_ENTRY]
+            if bit_index < 0:
+                break
+            node = node[(value >> bit_index) & 1]
+            bit_index -= 1
+        return found
+
+
+class PathTrie:
+    """按路径段组织的前缀树：条目 ``/health`` 覆盖 ``/health`` 与 ``/health/live``，不覆盖 ``/healthz``"""
+
+    _END = ''  # 子节点字典中保存条目的键（空段不会作为路径段出现）
+
+    def __init__(self):
+        self._root: Dict[str, Any] = {}
+
+    @staticmethod
+    def segments(path: str) -> List[str]:
+        return [segment for segment in path.split('/') if segment]
+
+    def insert(self, path: str, entry: str):
+        node = self._root
+        for segment in self.segments(path):
+            node = node.setdefault(segment, {})
+        node[self._END] = entry
+
+    def remove(self, path: str):
+        node = self._root
+        for segment in self.segments(path):
+            node = node.get(segment)
+            if node is None:
+                return
+        node.pop(self._END, None)
+
+    def lookup(self, path: str) -> Optional[str]:
+        node = self._root
+        entry = node.get(self._END)
+        if entry is not None:
+            return entry
+        for segment in path.split('/'):
+            if not segment:
+                continue
+            node = node.get(segment)
+            if node is None:
+                return None
+            entry = node.get(self._END)
+            if entry is not None:
+                return entry
+        return None
+
+
+class Whitelist:
+    """
+    白名单：条目为 IP、CIDR 网段（v4/v6）或以 ``/`` 开头的路径前缀
+
+    与原先的 ``set`` 接口兼容（add/discard/in/len/迭代），``in`` 判断的是条目本身；
+    请求是否放行用 :meth:`match`。
+    """
+
+    def __init__(self, entries: Iterable[str] = ()):
+        self._entries: Dict[str, Any] = {}  # 条目 -> 解析后的网段或路径
+        self._ips = CIDRTrie()
+        self._paths = PathTrie()
+        self._lock = threading.Lock()
+        for entry in entries:
+            try:
+                self.add(entry)
+            except ValueError as e:
+                logger.warning(f"忽略无效白名单条目 {entry!r}: {e}")
+
+    @staticmethod
+    def parse(item: str):
+        """解析条目：路径返回 str，IP/网段返回 ip_network；格式无效时抛出 ValueError"""
+        item = str(item).strip()
+        if item.startswith('/'):
+            return item
+        try:
+            return ipaddress.ip_network(item, strict=False)
+        except ValueError:
+            raise ValueError(f"白名单条目须为 IP、CIDR 网段或以 / 开头的路径: {item}") from None
+
+    def add(self, item: str):
+        item = str(item).strip()
+        key = self.parse(item)
+        with self._lock:
+            if item in self._entries:
+                return
+            self._entries[item] = key
+            if isinstance(key, str):
+                self._paths.insert(key, item)
+            else:
+                self._ips.insert(key, item)
+
+    def update(self, items: Iterable[str]):
+        for item in items:
+            self.add(item)
+
+    def discard(self, item: str):
+        item = str(item).strip()
+        with self._lock:
+            key = self._entries.pop(item, None)
+            if key is None:
+                return
+            # 同一网段/路径可能有其他写法的条目（如 10.0.0.1 与 10.0.0.1/32），移除后需补回
+            if isinstance(key, str):
+                self._paths.remove(key)
+                same = [e for e, k in self._entries.items() if isinstance(k, str) and
+                        PathTrie.segments(k) == PathTrie.segments(key)]
+                if same:
+                    self._paths.insert(key, same[0])
+            else:
+                self._ips.remove(key)
+                same = [e for e, k in self._entries.items() if k == key]
+                if same:
+                    self._ips.insert(key, same[0])
+
+    def remove(self, item: str):
+        if str(item).strip() not in self._entries:
+            raise KeyError(item)
+        self.discard(item)
+
+    def __contains__(self, item) -> bool:
+        return str(item).strip() in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def match_ip(self, ip: str) -> Optional[str]:
+        if not ip:
+            return None
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        return self._ips.lookup(address)
+
+    def match_path(self, url: str) -> Optional[str]:
+        """
+        判定原始 URL 的路径是否在白名单内
+
+        只看 ``?``/``#`` 之前的部分；含 ``..``、``%``、``\\`` 的路径可能经解码或归一化后指向别处，
+        一律不走白名单，交给正常检测。
+        """
+        if not url:
+            return None
+        path = url.split('?', 1)[0].split('#', 1)[0]
+        if '..' in path or '%' in path or '\\' in path or not path.startswith('/'):
+            return None
+        return self._paths.lookup(path)
+
+    def match(self, request: Dict[str, Any]) -> Optional[str]:
+        """请求命中的白名单条目（先 IP 后路径），未命中返回 None"""
+        if not self._entries:
+            return None
+        return self.match_ip(request.get('source_ip') or '') or self.match_path(request.get('url') or '')
+
+    def get_stats(self) -> Dict[str, int]:
+        ips = sum(1 for key in self._entries.values() if not isinstance(key, str))
+        return {'total': len(self._entries), 'ips': ips, 'paths': len(self._entries) - ips}
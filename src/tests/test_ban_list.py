@@ -0,0 +1,68 @@
+"""
+封禁名单测试 - 时间轮到期、自动封禁阈值与检测前拒绝
+"""
+from src.core.ban_list import BanList, TimerWheel
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_timer_wheel_expires_in_order_across_rotations():
+    wheel = TimerWheel(tick_seconds=1.0, slots=8, now=0.0)
+    wheel.schedule('a', 2.5)
+    wheel.schedule('b', 20.0)  # 超过一圈
+    assert wheel.advance(2.0) == []
+    assert wheel.advance(3.0) == ['a']
+    assert wheel.advance(16.0) == []
+    assert wheel.advance(25.0) == ['b']
+    assert wheel.pending == 0
+
+
+def test_auto_ban_after_threshold_and_expiry():
+    clock = FakeClock()
+    bans = BanList(threshold=3, window_seconds=10, ban_seconds=60, clock=clock)
+    assert bans.record_block('1.2.3.4') is None
+    clock.now += 11  # 窗口过期，计数重新开始
+    assert bans.record_block('1.2.3.4') is None
+    assert bans.record_block('1.2.3.4') is None
+    entry = bans.record_block('1.2.3.4')
+    assert entry is not None and entry.source == 'auto'
+    assert bans.check('1.2.3.4') is entry and entry.hits == 1
+    assert bans.check('5.6.7.8') is None
+
+    clock.now += 61
+    assert bans.check('1.2.3.4') is None
+    assert bans.get_stats()['active'] == 0 and bans.stats.expired == 1
+
+    bans.ban('9.9.9.9')  # 永久封禁
+    clock.now += 10 ** 6
+    assert '9.9.9.9' in bans and bans.unban('9.9.9.9') and '9.9.9.9' not in bans
+
+
+def test_repeat_attacker_banned_before_detection():
+    from main import WAFSystem
+
+    waf = WAFSystem()
+    # 自动封禁默认关闭（blocking.auto_ban），这里显式开启
+    waf.web_app.blacklist.auto_ban = True
+    waf.web_app.blacklist.threshold = 2
+    attack = {'url': '/q?id=1 union select 1', 'method': 'GET', 'body': '', 'source_ip': '203.0.113.9'}
+    for i in range(2):
+        result = waf.detect_request(dict(attack, url=f"{attack['url']},{i}"))
+        assert result['category'] == 'sql_injection'
+    result = waf.detect_request({'url': '/index.html', 'method': 'GET', 'body': '', 'source_ip': '203.0.113.9'})
+    assert result['blocked'] and result['category'] == 'banned'
+
+    client = waf.web_app.app.test_client()
+    data = client.get('/api/blacklist').get_json()
+    assert data['bans'][0]['ip'] == '203.0.113.9' and data['bans'][0]['hits'] == 1
+    assert client.post('/api/blacklist', json={'ip': 'nope'}).status_code == 400
+    assert client.post('/api/blacklist', json={'ip': '198.51.100.1', 'ttl_seconds': 30}).status_code == 200
+    assert client.delete('/api/blacklist/203.0.113.9').status_code == 200
+    assert not waf.detect_request({'url': '/index.html', 'method': 'GET', 'body': '',
+                                   'source_ip': '203.0.113.9'})['blocked']
@@ -0,0 +1,34 @@
+"""
+性能基准工具测试 - 语料可复现性、分位数与基线回归判定
+"""
+from src.utils.benchmark import compare_to_baseline, generate_corpus, percentile
+
+
+def test_corpus_is_reproducible():
+    first = generate_corpus(200, attack_ratio=0.3, seed=7)
+    assert first == generate_corpus(200, attack_ratio=0.3, seed=7)
+    assert first != generate_corpus(200, attack_ratio=0.3, seed=8)
+    assert len({r['source_ip'] for r in first}) == 200
+    assert any(r['label'] != 'normal' for r in first)
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 99.9) == 100
+    assert percentile([], 50) == 0.0
+
+
+def test_compare_to_baseline_scales_by_calibration():
+    baseline = {'calibration_ns': 1000,
+                'results': {'detect': {'p50_us': 100.0, 'p99_us': 200.0, 'ops_per_sec': 5000.0}}}
+    # 当前机器慢一倍：延迟翻倍不算回归
+    slower_machine = {'calibration_ns': 2000,
+                      'results': {'detect': {'p50_us': 210.0, 'p99_us': 400.0, 'ops_per_sec': 2500.0}}}
+    assert compare_to_baseline(slower_machine, baseline, tolerance=0.25) == []
+
+    regressed = {'calibration_ns': 1000,
+                 'results': {'detect': {'p50_us': 180.0, 'p99_us': 210.0, 'ops_per_sec': 4900.0}}}
+    items = compare_to_baseline(regressed, baseline, tolerance=0.25)
+    assert [(i['benchmark'], i['metric']) for i in items] == [('detect', 'p50_us')]
@@ -0,0 +1,85 @@
+"""
+训练数据管道测试 - NDJSON 流式读取、特征分片缓存与复用
+"""
+import json
+
+import numpy as np
+
+from src.core.dataset import build_feature_cache, iter_labeled_requests, parse_label
+from src.core.features import FeatureExtractor
+
+
+def _write_ndjson(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def _sample_records(n):
+    records = []
+    for i in range(n):
+        if i % 2:
+            records.append({'method': 'GET', 'url': f'/api/user?id={i} OR 1=1', 'label': 'attack'})
+        else:
+            records.append({'text': f'GET /static/app_{i}.js', 'label': 0})
+    return records
+
+
+def test_parse_label():
+    """多种标签写法统一为 0/1"""
+    assert parse_label('attack') == 1
+    assert parse_label(True) == 1
+    assert parse_label(0) == 0
+    assert parse_label('benign') == 0
+    assert parse_label('unknown') is None
+    assert parse_label(5) is None
+
+
+def test_iter_labeled_requests_skips_invalid(tmp_path):
+    """非法JSON与缺失标签的行被跳过并计数"""
+    path = tmp_path / 'train.jsonl'
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"text": "GET /", "label": 0}\n')
+        f.write('not json\n')
+        f.write('{"text": "GET /a"}\n')
+        f.write('\n')
+        f.write('{"url": "/x?q=<script>", "method": "POST", "label": 1}\n')
+    stats = {}
+    items = list(iter_labeled_requests([str(path)], stats=stats))
+    assert items == [('GET /', 0), ('POST /x?q=<script> ', 1)]
+    assert stats == {'records': 2, 'skipped': 2}
+
+
+def test_feature_cache_shards_and_reuse(tmp_path):
+    """分片内容与直接提取一致，第二次构建直接复用缓存"""
+    path = tmp_path / 'train.jsonl'
+    records = _sample_records(25)
+    _write_ndjson(path, records)
+    cache_dir = tmp_path / 'cache'
+
+    manifest = build_feature_cache([str(path)], str(cache_dir), feature_dim=64,
+                                   shard_size=10, workers=2)
+    assert manifest.total == 25
+    assert manifest.attacks == 12
+    assert [s['count'] for s in manifest.shards] == [10, 10, 5]
+
+    extractor = FeatureExtractor(64)
+    texts = [text for text, _ in iter_labeled_requests([str(path)])]
+    features, labels = manifest.load_shard(1)
+    assert isinstance(features, np.memmap)
+    np.testing.assert_allclose(features, extractor.extract_batch(texts[10:20]), rtol=1e-6)
+    assert labels.tolist() == [i % 2 for i in range(10, 20)]
+
+    shard_file = manifest.root / manifest.shards[0]['features']
+    mtime = shard_file.stat().st_mtime_ns
+    again = build_feature_cache([str(path)], str(cache_dir), feature_dim=64,
+                                shard_size=10, workers=2)
+    assert again.key == manifest.key
+    assert shard_file.stat().st_mtime_ns == mtime
+
+    # 数据变化后缓存键随之变化
+    _write_ndjson(path, records[:20])
+    changed = build_feature_cache([str(path)], str(cache_dir), feature_dim=64,
+                                  shard_size=10, workers=0)
+    assert changed.key != manifest.key
+    assert changed.total == 20
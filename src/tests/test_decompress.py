@@ -0,0 +1,43 @@
+"""
+请求体流式解压测试 - 分块输出、多层编码与解压炸弹上限
+"""
+import gzip
+import zlib
+
+import pytest
+
+from src.utils.decompress import (RATIO_CHECK_FLOOR, DecompressionError, DecompressionLimitError,
+                                  StreamingDecompressor, iter_decompressed, parse_content_encoding)
+
+
+def test_chunks_are_bounded_and_reassemble():
+    payload = b''.join(b'line %d\n' % i for i in range(50000))
+    chunks = list(iter_decompressed(gzip.compress(payload), ['gzip'], chunk_size=4096, max_ratio=0))
+    assert max(len(c) for c in chunks) <= 4096 and b''.join(chunks) == payload
+    # 多个 gzip 成员拼接、deflate 的 zlib 与裸格式、两层编码
+    assert b''.join(iter_decompressed(gzip.compress(b'a') + gzip.compress(b'b'), ['gzip'])) == b'ab'
+    raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    assert b''.join(iter_decompressed(raw.compress(b'x') + raw.flush(), ['deflate'])) == b'x'
+    layered = gzip.compress(zlib.compress(b'nested'))
+    assert b''.join(iter_decompressed(layered, parse_content_encoding('deflate, gzip'))) == b'nested'
+
+
+def test_bomb_stops_before_full_expansion():
+    bomb = gzip.compress(b'\0' * (50 * 1024 * 1024))
+    decompressor = StreamingDecompressor(['gzip'], max_output_bytes=0, max_ratio=100)
+    with pytest.raises(DecompressionLimitError):
+        for _ in decompressor.feed(bomb):
+            pass
+    # 膨胀比按 zlib 实际消耗的输入计算，超限前最多多产出一块（不足 RATIO_CHECK_FLOOR 时不检查）
+    assert decompressor.input_bytes < len(bomb)
+    assert decompressor.output_bytes <= (max(100 * decompressor.input_bytes, RATIO_CHECK_FLOOR)
+                                         + decompressor.chunk_size)
+    with pytest.raises(DecompressionLimitError):
+        list(iter_decompressed(gzip.compress(b'a' * 100000), ['gzip'], max_output_bytes=50000, max_ratio=0))
+
+
+def test_invalid_data_and_unsupported_encoding():
+    with pytest.raises(DecompressionError):
+        list(iter_decompressed(b'not gzip', ['gzip']))
+    with pytest.raises(DecompressionError):
+        list(iter_decompressed(b'x', ['br']))
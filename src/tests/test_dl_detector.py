@@ -0,0 +1,128 @@
+"""
+DL检测器测试 - 推理缓存、模型热更新（需要 PyTorch）
+"""
+import threading
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from src.core.dl_detector import DLDetector
+
+
+def test_prediction_cache_hits_and_invalidation(tmp_path):
+    """规范化后相同的请求命中缓存，保存新检查点后缓存失效"""
+    detector = DLDetector(model_path=str(tmp_path / 'model.pth'), feature_dim=64,
+                          device='cpu', cache_size=2)
+
+    _, prob, details = detector.predict('GET /health')
+    assert details['cache_hit'] is False
+    _, cached_prob, details = detector.predict('get /HEALTH')
+    assert details['cache_hit'] is True
+    assert cached_prob == prob
+
+    stats = detector.prediction_cache.get_stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+
+    # LRU 淘汰：容量为 2 时第三个不同请求挤掉最旧的
+    detector.predict('GET /a')
+    detector.predict('GET /b')
+    assert detector.predict('GET /health')[2]['cache_hit'] is False
+
+    # 保存不改变权重，缓存继续有效；加载检查点后缓存失效
+    old_version = detector.prediction_cache.model_version
+    detector.save_model()
+    assert detector.prediction_cache.model_version == old_version
+    detector.load_model()
+    version = detector.prediction_cache.model_version
+    assert version != old_version
+    assert detector.prediction_cache.get_stats()['size'] == 0
+    assert detector.predict('GET /health')[2]['cache_hit'] is False
+
+    # 重新加载同一检查点得到相同版本号
+    detector.load_model()
+    assert detector.prediction_cache.model_version == version
+
+
+def test_hot_swap_keeps_in_flight_model(tmp_path):
+    """切换期间在途推理持有旧模型，引用归零后旧模型才被释放"""
+    model_path = tmp_path / 'model.pth'
+    detector = DLDetector(model_path=str(model_path), feature_dim=64, device='cpu')
+    detector.save_model()
+
+    with detector.registry.acquire() as old_handle:
+        old_model = old_handle.model
+        assert detector.registry.reload_async() is True
+        detector.registry.loader_thread.join(timeout=30)
+        status = detector.registry.get_status()
+        assert status['state'] == 'ready'
+        assert detector.registry.current is not old_handle
+        # 旧句柄仍被引用，不会被释放
+        assert old_handle.model is old_model
+    assert old_handle.model is None
+    assert detector.predict('GET /index.html')[2]['model_version'] == status['version']
+
+
+def test_model_info_holds_reference_during_swap(tmp_path):
+    """get_model_info 使用期间持有句柄，并发切换不会释放正在读取的模型"""
+    detector = DLDetector(model_path=str(tmp_path / 'model.pth'), feature_dim=64, device='cpu')
+    old_handle = detector.registry.current
+    old_model = old_handle.model
+    parameters = old_model.parameters
+    seen = []
+
+    def parameters_during_swap(*args, **kwargs):
+        if not seen:
+            detector.registry.publish(DLDetector(model_path=str(tmp_path / 'other.pth'), feature_dim=64,
+                                                 device='cpu').model, 'swapped')
+        seen.append(old_handle.model)
+        return parameters(*args, **kwargs)
+
+    old_model.parameters = parameters_during_swap
+    info = detector.get_model_info()
+    assert info['total_parameters'] > 0
+    assert seen and all(model is old_model for model in seen)
+    assert old_handle.model is None  # 引用归零后释放
+
+
+def test_failed_reload_keeps_current_model(tmp_path):
+    """损坏的检查点或金丝雀校验失败时保留当前模型"""
+    model_path = tmp_path / 'model.pth'
+    detector = DLDetector(model_path=str(model_path), feature_dim=64, device='cpu')
+    handle = detector.registry.current
+    model_path.write_bytes(b'not a checkpoint')
+    with pytest.raises(Exception):
+        detector.registry.reload()
+    assert detector.registry.current is handle
+    assert detector.registry.get_status()['state'] == 'failed'
+
+    detector.save_model()
+    detector.registry.min_canary_accuracy = 1.01
+    with pytest.raises(ValueError):
+        detector.registry.reload()
+    assert detector.registry.current is handle
+
+
+def test_concurrent_predict_during_swaps(tmp_path):
+    """并发推理与反复切换不会出错"""
+    model_path = tmp_path / 'model.pth'
+    detector = DLDetector(model_path=str(model_path), feature_dim=64, device='cpu',
+                          cache_size=0)
+    detector.save_model()
+    errors = []
+
+    def worker():
+        for i in range(50):
+            _, _, details = detector.predict(f'GET /item/{i}')
+            if 'error' in details:
+                errors.append(details['error'])
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for _ in range(5):
+        detector.registry.reload()
+    for t in threads:
+        t.join()
+    assert errors == []
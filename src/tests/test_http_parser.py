@@ -0,0 +1,53 @@
+"""
+原始HTTP解析测试 - 请求头偏移、Content-Length/chunked 分帧、CRLF 请求体与连续请求
+"""
+import pytest
+
+from src.utils.http_parser import HTTPIncompleteError, HTTPParseError, parse_http_request
+
+
+def test_content_length_body_is_zero_copy_and_keeps_crlf():
+    data = (b'POST /login?next=%2F HTTP/1.1\r\nHost: example.com\r\nCookie: a=1\r\ncookie: b=2\r\n'
+            b'Content-Length: 12\r\n\r\nuser=a\r\npw=bGET /next HTTP/1.1\r\nHost: x\r\n\r\n')
+    request = parse_http_request(data)
+    assert request.body.obj is data and bytes(request.body) == b'user=a\r\npw=b'
+    assert request.header('HOST') == b'example.com'
+    assert request.to_request()['headers'] == {'Host': 'example.com', 'Cookie': 'a=1; b=2',
+                                               'Content-Length': '12'}
+    assert request.to_request()['query_string'] == 'next=%2F'
+
+    pipelined = parse_http_request(data, request.consumed)
+    assert (pipelined.method, pipelined.target, pipelined.consumed) == ('GET', '/next', len(data))
+
+
+def test_chunked_body_with_extensions_and_trailers():
+    data = (b'POST /upload HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'5;name=x\r\nhello\r\n7\r\n, world\r\n0\r\nX-Checksum: 1\r\n\r\n')
+    request = parse_http_request(data)
+    assert request.chunked and len(request.body_chunks) == 2
+    assert bytes(request.body) == b'hello, world' and request.consumed == len(data)
+    with pytest.raises(HTTPIncompleteError):
+        parse_http_request(data[:-10])
+    assert bytes(parse_http_request(data[:70], lenient=True).body) == b'hello'
+
+
+@pytest.mark.parametrize('data', [
+    b'POST / HTTP/1.1\r\nContent-Length: 3\r\nTransfer-Encoding: chunked\r\n\r\n0\r\n\r\n',
+    b'POST / HTTP/1.1\r\nContent-Length: 3\r\nContent-Length: 4\r\n\r\nabcd',
+    b'POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n',
+    b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n',
+    b'GET / HTTP/1.1\r\nX-A: 1\r\n folded\r\n\r\n',
+    b'GET\r\n\r\n',
+])
+def test_ambiguous_or_malformed_requests_rejected(data):
+    with pytest.raises(HTTPParseError):
+        parse_http_request(data)
+
+
+def test_lenient_mode_for_captured_dumps():
+    with pytest.raises(HTTPIncompleteError):
+        parse_http_request(b'GET /a HTTP/1.1\nHost: y')
+    request = parse_http_request(b'GET /a HTTP/1.1\nHost: y', lenient=True)
+    assert request.to_request()['headers'] == {'Host': 'y'}
+    request = parse_http_request(b'POST /a HTTP/1.1\nHost: y\n\nq=1\nr=2', lenient=True)
+    assert bytes(request.body) == b'q=1\nr=2'
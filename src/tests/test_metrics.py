@@ -0,0 +1,56 @@
+"""
+运行指标测试 - 分片计数器、直方图与 /metrics 导出
+"""
+import threading
+
+from src.utils.metrics import MetricsRegistry, WAFMetrics
+
+
+def test_sharded_counter_sums_across_threads():
+    registry = MetricsRegistry()
+    counter = registry.counter('test_total', 'test', ('kind',))
+
+    def work():
+        for _ in range(1000):
+            counter.inc('a')
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    counter.inc('b', amount=2)
+
+    assert counter.value('a') == 8000
+    assert counter.value('b') == 2
+    # 已退出线程的分片折叠进基准值，只保留存活线程的分片
+    assert len(counter._shards) == 1
+    assert counter.value('a') == 8000
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('test_seconds', 'test', ('stage',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, 'rules')
+    text = registry.render()
+    assert '# TYPE test_seconds histogram' in text
+    assert 'test_seconds_bucket{stage="rules",le="0.1"} 2' in text
+    assert 'test_seconds_bucket{stage="rules",le="1"} 3' in text
+    assert 'test_seconds_bucket{stage="rules",le="+Inf"} 4' in text
+    assert 'test_seconds_count{stage="rules"} 4' in text
+
+
+def test_metrics_endpoint_exposes_detection_stages():
+    from src.web.app import WAFWebApp
+
+    metrics = WAFMetrics()
+    web_app = WAFWebApp(metrics=metrics)
+    web_app.rule_engine.detect({'url': '/metrics-test?q=<script>', 'method': 'GET', 'body': ''})
+    response = web_app.app.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert 'waf_detection_stage_seconds_count{stage="normalize"} 1' in text
+    assert 'waf_rule_cache_requests_total{result="miss"} 1' in text
+    assert 'waf_attack_log_depth 0' in text
@@ -0,0 +1,75 @@
+"""
+请求规范化差分测试 - 单遍规范化器与原实现逐字节一致
+"""
+import random
+import re
+from urllib.parse import parse_qsl, unquote, urlparse
+
+from src.utils.benchmark import generate_corpus
+from src.utils.web_tools import HTTPRequestParser
+
+
+def reference_normalize(request):
+    """原 normalize_request 实现（unquote + urlparse + parse_qsl + re.sub），作为差分基准"""
+    url = request.get('url', '') or ''
+    method = (request.get('method', '') or 'GET').upper()
+    headers = request.get('headers', {}) or {}
+    body = request.get('body', '') or ''
+
+    decoded_url = unquote(url)
+    parsed = urlparse(decoded_url)
+    query_pairs = parse_qsl(parsed.query, keep_blank_values=True)
+    query_pairs.sort(key=lambda x: (x[0], x[1]))
+    normalized_query = '&'.join([f"{k}={v}" for k, v in query_pairs])
+    normalized_url = parsed.path
+    if normalized_query:
+        normalized_url = f"{normalized_url}?{normalized_query}"
+
+    normalized_body = re.sub(r'\s+', ' ', unquote(body)).strip().lower()
+    normalized_headers = {str(k).lower(): str(v).strip() for k, v in headers.items()}
+
+    return {
+        'method': method,
+        'url': normalized_url.lower(),
+        'headers': normalized_headers,
+        'body': normalized_body,
+        'query_string': normalized_query.lower(),
+        'path': parsed.path.lower(),
+    }
+
+
+EDGE_CASES = [
+    {},
+    {'url': None, 'method': None, 'headers': None, 'body': None},
+    {'url': '', 'body': '   '},
+    {'url': 'http://Example.com:8080/Path;v=1?b=2&a=1#frag', 'method': 'post'},
+    {'url': '//evil.com/x?y=1'},
+    {'url': '  /lead?x=1'},
+    {'url': '/a\tb\r\nc?q=1'},
+    {'url': '/p;jsessionid=AB?x=1;y=2'},
+    {'url': '/dir/p;x/child?q'},
+    {'url': '/a%3Fb%3Dc?d=%2541&&e&=f&g==h'},
+    {'url': '/search?q=a+b%2Bc&q=A'},
+    {'url': '/%23frag?x=1%23y'},
+    {'url': '/x?%E4%BD%A0%E5%A5%BD=%ZZ&bad=%e4%bd'},
+    {'url': '/ΣΑΣ?ΣΣ=Σ.', 'body': 'ΌΣΟΣ İstanbul　\x1ctail'},
+    {'url': b'/bytes%20url?a=1', 'body': b'raw%20bytes  body'},
+    {'url': '/x', 'body': 'a\t\tb\n\nc   d%0A%20e', 'headers': {'X-Test': '  v  ', 1: 2}},
+]
+
+_ALPHABET = list('abcXYZ019/?&=+;:#%._-') + ['%2', '%41', '%3D', '%26', '%2B', '%25', '%C3%A9', '//',
+                                             ' ', '\t', '\n', '　', 'Σ', 'İ', 'ß', '\x00']
+
+
+def _fuzz(rng, length):
+    return ''.join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, length)))
+
+
+def test_normalizer_matches_reference_on_corpus():
+    cases = list(EDGE_CASES) + generate_corpus(2000, attack_ratio=0.3, seed=99)
+    rng = random.Random(2024)
+    for _ in range(5000):
+        cases.append({'method': rng.choice(['get', 'POST', '']), 'url': '/' + _fuzz(rng, 40),
+                      'body': _fuzz(rng, 40), 'headers': {_fuzz(rng, 5): _fuzz(rng, 8)}})
+    for case in cases:
+        assert HTTPRequestParser.normalize_request(case) == reference_normalize(case), case
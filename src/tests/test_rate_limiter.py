@@ -0,0 +1,81 @@
+"""
+限流测试 - 令牌桶补充、LRU 内存上界与检测前拒绝
+"""
+import pytest
+
+from src.core.rate_limiter import RateLimiter, RateLimitRule, SharedTokenBucketTable, TokenBucketTable
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_burst_and_refill():
+    clock = FakeClock()
+    table = TokenBucketTable(rate=2, burst=3, clock=clock)
+    assert [table.allow('a') for _ in range(4)] == [True, True, True, False]
+    assert table.allow('b')  # 各键独立
+    clock.now += 0.5  # 补充 1 个令牌
+    assert table.allow('a') and not table.allow('a')
+    clock.now += 100  # 补充不超过桶容量
+    assert [table.allow('a') for _ in range(4)] == [True, True, True, False]
+
+
+def test_cost_above_burst_is_rejected():
+    from src.core.shared_state import SharedState
+
+    shared = SharedState(stripes=2, counter_slots=16)
+    try:
+        tables = [TokenBucketTable(rate=1, burst=3, clock=FakeClock()),
+                  SharedTokenBucketTable(shared.table(16, 2), rate=1, burst=3, clock=FakeClock())]
+        for table in tables:
+            # 首次出现的键也不放行，且不留下负的令牌余额
+            assert not table.allow('a', cost=4)
+            assert [table.allow('a') for _ in range(4)] == [True, True, True, False]
+    finally:
+        shared.close()
+
+
+def test_lru_keeps_memory_bounded():
+    table = TokenBucketTable(rate=1, burst=1, max_keys=64, shards=4, clock=FakeClock())
+    for i in range(1000):
+        table.allow(f"10.0.{i // 256}.{i % 256}")
+    assert len(table) <= 64 and table.evictions >= 1000 - 64
+
+
+def test_rule_keys_and_path_prefix():
+    limiter = RateLimiter([RateLimitRule('login', key='ip_path', rate=1, burst=2, path_prefix='/login'),
+                           RateLimitRule('api', key='path', rate=1, burst=1, path_prefix='/api/')],
+                          clock=FakeClock())
+    login = {'url': '/login?user=a', 'source_ip': '1.1.1.1'}
+    assert limiter.check(login) is None and limiter.check(login) is None
+    assert limiter.check(login).name == 'login'
+    assert limiter.check(dict(login, source_ip='2.2.2.2')) is None
+    assert limiter.check({'url': '/index.html', 'source_ip': '1.1.1.1'}) is None
+    # path 规则配置前缀时整个前缀共用一个桶，与来源无关
+    assert limiter.check({'url': '/api/a', 'source_ip': '3.3.3.3'}) is None
+    assert limiter.check({'url': '/api/b', 'source_ip': '4.4.4.4'}).name == 'api'
+    assert limiter.get_stats()['rejected'] == {'login': 1, 'api': 1}
+    with pytest.raises(ValueError):
+        RateLimitRule('bad', key='category')
+
+
+def test_flood_rate_limited_before_detection():
+    from main import WAFSystem
+
+    waf = WAFSystem()
+    waf.web_app.rate_limiter = RateLimiter([RateLimitRule('per_ip', rate=0.001, burst=3)])
+    request = {'url': '/index.html', 'method': 'GET', 'body': '', 'source_ip': '198.51.100.7'}
+    assert [waf.detect_request(request)['blocked'] for _ in range(3)] == [False] * 3
+    result = waf.detect_request(request)
+    assert result['blocked'] and result['category'] == 'rate_limited'
+    assert '198.51.100.7' not in waf.web_app.blacklist  # 限流不计入自动封禁
+    assert not waf.detect_request(dict(request, source_ip='198.51.100.8'))['blocked']
+
+    data = waf.web_app.app.test_client().get('/api/ratelimit').get_json()
+    assert data['enabled'] and data['rejected'] == {'per_ip': 1}
+    assert 'waf_rate_limited_total{rule="per_ip"} 1' in waf.metrics.registry.render()
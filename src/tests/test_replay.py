@@ -0,0 +1,54 @@
+"""
+流量回放测试 - 流量读取、回放汇总与规则集判定差异
+"""
+import json
+
+from src.utils.replay import ReplayRecord, diff_verdicts, load_traffic, summarize_replay
+
+
+def test_load_traffic_reads_ndjson_and_raw_dumps(tmp_path):
+    (tmp_path / 'a.jsonl').write_text('\n'.join([
+        json.dumps({'method': 'GET', 'url': '/search?q=1', 'source_ip': '10.0.0.1'}),
+        'not json',
+        json.dumps({'raw': 'POST /login HTTP/1.1\r\nHost: x\r\n\r\nuser=admin'}),
+    ]), encoding='utf-8')
+    (tmp_path / 'b.http').write_text('GET /a HTTP/1.1\nHost: x\n\n###\nGET /b HTTP/1.1\nHost: y\n',
+                                     encoding='utf-8')
+    stats = {}
+    requests = load_traffic([str(tmp_path)], stats=stats)
+    assert [r['url'] for r in requests] == ['/search?q=1', '/login', '/a', '/b']
+    assert requests[0]['source_ip'] == '10.0.0.1'
+    assert requests[1]['body'] == 'user=admin'
+    assert requests[3]['headers'] == {'Host': 'y'} and requests[3]['body'] == ''
+    assert stats == {'records': 4, 'skipped': 1}
+    assert len(load_traffic([str(tmp_path)], limit=2)) == 2
+
+
+def test_raw_dump_keeps_trailing_body_bytes(tmp_path):
+    (tmp_path / 'c.http').write_bytes(b'POST /c HTTP/1.1\r\nHost: z\r\n\r\nq=1 \t\r\n\r\n###\n'
+                                      b'POST /d HTTP/1.1\nHost: z\n\nq=2  \n')
+    requests = load_traffic([str(tmp_path / 'c.http')])
+    # 只去掉分隔行前的换行，请求体末尾的空白与空行保留
+    assert [r['body'] for r in requests] == ['q=1 \t\r\n', 'q=2  \n']
+
+
+def test_summarize_and_diff_verdicts():
+    requests = [{'method': 'GET', 'url': f'/p{i}'} for i in range(3)]
+    baseline = [ReplayRecord(0, False, 'normal', '', 100_000, 90_000),
+                ReplayRecord(1, True, 'xss', 'XSS_SCRIPT_TAG', 300_000, 250_000),
+                ReplayRecord(2, False, 'normal', '', 200_000, 180_000)]
+    candidate = [ReplayRecord(0, True, 'sql_injection', 'SQL_UNION', 100_000, 90_000),
+                 ReplayRecord(1, False, 'normal', '', 300_000, 250_000),
+                 ReplayRecord(2, False, 'normal', '', 200_000, 180_000)]
+
+    summary = summarize_replay(baseline, wall_seconds=0.5)
+    assert summary['throughput_rps'] == 6.0
+    assert summary['blocked'] == 1
+    assert summary['latency_us']['p50'] == 200.0
+    assert summary['cpu_by_category']['normal']['requests'] == 2
+    assert 'response_us' not in summary
+
+    diff = diff_verdicts(requests, baseline, candidate)
+    assert (diff['changed'], diff['newly_blocked'], diff['newly_allowed']) == (2, 1, 1)
+    assert diff['transitions'] == {'normal -> sql_injection': 1, 'xss -> normal': 1}
+    assert diff['samples'][0]['url'] == '/p0'
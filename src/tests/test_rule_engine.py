@@ -0,0 +1,432 @@
+"""
+规则引擎测试 - 规则包缓存、写时复制重载、自动重载、正则安全、性能剖析、自适应排序
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+import yaml
+
+from src.core.regex_safety import HAS_REGEX, RISK_EXPONENTIAL, RISK_POLYNOMIAL, analyze_pattern
+from src.core.rule_bundle import plan_order
+from src.core.rule_engine import Rule, RuleEngine, RuleSetValidationError
+from src.core.rule_watcher import RuleWatcher
+
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+def make_engine_config(tmp_path, rule_names=('sql_injection', 'xss'), **rules_options):
+    """在临时目录中复制规则文件并生成配置，返回配置路径"""
+    rule_files = []
+    for name in rule_names:
+        target = tmp_path / f'{name}.yaml'
+        shutil.copy(ROOT_DIR / 'rules' / f'{name}.yaml', target)
+        rule_files.append(str(target))
+    rules_config = {'directories': rule_files, 'bundle_file': str(tmp_path / 'bundle.json')}
+    rules_config.update(rules_options)
+    config_path = tmp_path / 'settings.yaml'
+    config_path.write_text(yaml.safe_dump({'rules': rules_config, 'detection': {'cache_ttl_seconds': 0}}),
+                           encoding='utf-8')
+    return config_path
+
+
+def test_bundle_reused_until_sources_change(tmp_path):
+    """首次从YAML编译并写出规则包，之后直接加载；源文件变化时重建"""
+    config_path = make_engine_config(tmp_path)
+    first = RuleEngine(str(config_path))
+    assert first.get_stats()['rule_bundle']['from_cache'] is False
+    assert (tmp_path / 'bundle.json').exists()
+
+    second = RuleEngine(str(config_path))
+    assert second.get_stats()['rule_bundle']['from_cache'] is True
+    assert [r.name for r in second.execution_plan] == [r.name for r in first.execution_plan]
+    assert second.detect({'url': '/a?id=1 union select 1', 'method': 'GET', 'body': ''})[0]
+
+    # 源文件未变化时重载不替换规则对象
+    ruleset_before = second.ruleset
+    second.reload_rules()
+    assert second.ruleset is ruleset_before
+
+    xss_file = tmp_path / 'xss.yaml'
+    xss_file.write_text(xss_file.read_text(encoding='utf-8').replace('XSS_SCRIPT_TAG', 'XSS_SCRIPT_TAG_V2'),
+                        encoding='utf-8')
+    second.reload_rules()
+    assert 'XSS_SCRIPT_TAG_V2' in {r.name for r in second.rules}
+    assert second.get_stats()['rule_bundle']['from_cache'] is False
+
+
+def test_tampered_bundle_is_rebuilt(tmp_path):
+    """规则包内容被篡改时校验失败，回退到YAML"""
+    config_path = make_engine_config(tmp_path)
+    RuleEngine(str(config_path))
+    bundle_path = tmp_path / 'bundle.json'
+    document = json.loads(bundle_path.read_text(encoding='utf-8'))
+    document['payload']['files'][0]['rules'][0]['patterns'] = ['never-matches']
+    bundle_path.write_text(json.dumps(document), encoding='utf-8')
+
+    engine = RuleEngine(str(config_path))
+    assert engine.get_stats()['rule_bundle']['from_cache'] is False
+    assert engine.detect({'url': '/a?id=1 union select 1', 'method': 'GET', 'body': ''})[0]
+
+
+def test_invalid_reload_keeps_current_ruleset(tmp_path):
+    """新规则文件解析失败时拒绝发布，当前规则集与代数保持不变"""
+    config_path = make_engine_config(tmp_path)
+    engine = RuleEngine(str(config_path))
+    ruleset = engine.ruleset
+    (tmp_path / 'xss.yaml').write_text('rules: [unclosed', encoding='utf-8')
+    with pytest.raises(RuleSetValidationError):
+        engine.reload_rules()
+    assert engine.ruleset is ruleset
+    assert engine.detect({'url': '/s', 'method': 'POST', 'body': '<script>alert(1)</script>'})[0]
+
+
+def test_reload_rejects_broken_config_and_empty_ruleset(tmp_path):
+    """配置无法解析、去掉全部规则文件或禁用全部规则时拒绝发布，防护不会被关闭"""
+    config_path = make_engine_config(tmp_path)
+    engine = RuleEngine(str(config_path))
+    ruleset = engine.ruleset
+    original = config_path.read_text(encoding='utf-8')
+
+    config_path.write_text(original + 'detection: [unclosed\n', encoding='utf-8')
+    with pytest.raises(RuleSetValidationError):
+        engine.reload_rules()
+    assert engine.ruleset is ruleset and engine.rule_files
+
+    config_path.write_text(yaml.safe_dump({'rules': {'directories': []}}), encoding='utf-8')
+    with pytest.raises(RuleSetValidationError):
+        engine.reload_rules()
+
+    for name in ('sql_injection', 'xss'):
+        rule_file = tmp_path / f'{name}.yaml'
+        rule_file.write_text(rule_file.read_text(encoding='utf-8').replace('enabled: true', 'enabled: false'),
+                             encoding='utf-8')
+    config_path.write_text(original, encoding='utf-8')
+    with pytest.raises(RuleSetValidationError):
+        engine.reload_rules()
+    assert engine.ruleset is ruleset
+    assert engine.reload_stats['failed_reloads'] == 3
+    assert engine.detect({'url': "/x?id=1' or 1=1", 'method': 'GET', 'body': ''})[0]
+
+
+def test_reload_flushes_match_cache_by_generation(tmp_path):
+    """发布新规则集后旧代的匹配缓存不再生效"""
+    config_path = make_engine_config(tmp_path)
+    engine = RuleEngine(str(config_path))
+    engine.cache_ttl_seconds = 60
+    request = {'url': '/s?q=<script>', 'method': 'GET', 'body': ''}
+    assert engine.detect(request)[0]
+
+    xss_file = tmp_path / 'xss.yaml'
+    xss_file.write_text(xss_file.read_text(encoding='utf-8').replace('enabled: true', 'enabled: false'),
+                        encoding='utf-8')
+    generation = engine.ruleset.generation
+    engine.reload_rules()
+    assert engine.ruleset.generation == generation + 1
+    assert engine.detect(request)[0] is False
+
+
+def test_detection_never_sees_partial_ruleset(tmp_path):
+    """反复重载期间并发检测始终命中攻击"""
+    config_path = make_engine_config(tmp_path)
+    engine = RuleEngine(str(config_path))
+    sql_file = tmp_path / 'sql_injection.yaml'
+    original = sql_file.read_text(encoding='utf-8')
+    misses = []
+    stop = threading.Event()
+
+    def detect_loop():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            is_attack, _ = engine.detect({'url': f'/a?id={i} union select 1', 'method': 'GET', 'body': ''})
+            if not is_attack:
+                misses.append(i)
+
+    threads = [threading.Thread(target=detect_loop) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for i in range(20):
+        sql_file.write_text(original + f'\n# revision {i}\n', encoding='utf-8')
+        engine.reload_rules()
+    stop.set()
+    for t in threads:
+        t.join()
+    assert misses == []
+    assert engine.ruleset.generation == 21
+
+
+def test_watcher_reloads_only_changed_file(tmp_path):
+    """监视器发现内容变化后重载，只重新解析变化的文件并记录规则数变化"""
+    config_path = make_engine_config(tmp_path)
+    engine = RuleEngine(str(config_path))
+    watcher = RuleWatcher(engine, interval=1)
+    sql_entry = engine.bundle.files[0]
+
+    # 仅修改时间变化、内容不变时不触发重载
+    xss_file = tmp_path / 'xss.yaml'
+    stat = xss_file.stat()
+    os.utime(xss_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert watcher.poll() is False
+    assert engine.ruleset.generation == 1
+
+    rule_data = yaml.safe_load(xss_file.read_text(encoding='utf-8'))
+    rule_data['rules'].append({'name': 'XSS_MARQUEE', 'category': 'xss', 'severity': 'medium',
+                               'patterns': ['<marquee']})
+    xss_file.write_text(yaml.safe_dump(rule_data, allow_unicode=True), encoding='utf-8')
+    assert watcher.poll() is True
+
+    last = engine.get_stats()['reload']['last_reload']
+    assert last['trigger'] == 'watcher'
+    assert last['rule_delta'] == 1
+    assert last['changed_files'] == [str(xss_file)]
+    assert engine.bundle.files[0] is sql_entry
+    assert engine.detect({'url': '/s', 'method': 'POST', 'body': '<marquee>'})[0]
+
+
+def test_watcher_keeps_rules_when_settings_corrupted(tmp_path):
+    """配置文件写坏时监视器拒绝重载：规则集与设置不变、记录错误，修复后恢复自动重载"""
+    config_path = make_engine_config(tmp_path)
+    engine = RuleEngine(str(config_path))
+    watcher = RuleWatcher(engine, interval=1)
+    ruleset, rule_files = engine.ruleset, engine.rule_files
+    original = config_path.read_text(encoding='utf-8')
+
+    config_path.write_text(original + 'rules: [unclosed\n', encoding='utf-8')
+    assert watcher.poll() is False
+    assert watcher.last_error and engine.ruleset is ruleset
+    assert engine.reload_stats['failed_reloads'] == 1
+    assert engine.detect({'url': "/x?id=1' or 1=1", 'method': 'GET', 'body': ''})[0]
+
+    # 配置可解析但去掉了全部规则文件：同样拒绝，并回滚到原规则文件列表
+    config_path.write_text(yaml.safe_dump({'rules': {'directories': []}}), encoding='utf-8')
+    assert watcher.poll() is False
+    assert engine.ruleset is ruleset and engine.rule_files == rule_files
+
+    # 修复后重新加载成功；规则文件未变，沿用当前规则集
+    config_path.write_text(original + '# fixed\n', encoding='utf-8')
+    assert watcher.poll() is False and watcher.last_error is None
+    assert engine.ruleset is ruleset
+
+
+def test_reload_recompiles_only_changed_file(tmp_path):
+    """未变化文件复用已编译规则，归并后的执行计划与整体排序一致"""
+    config_path = make_engine_config(tmp_path, ('sql_injection', 'xss', 'directory_traversal'))
+    engine = RuleEngine(str(config_path))
+    sql_rules = engine.ruleset.compiled[0][1]
+
+    xss_file = tmp_path / 'xss.yaml'
+    rule_data = yaml.safe_load(xss_file.read_text(encoding='utf-8'))
+    rule_data['rules'][0]['cost_level'] = 'fast'
+    rule_data['rules'][0]['priority'] = 0
+    xss_file.write_text(yaml.safe_dump(rule_data, allow_unicode=True), encoding='utf-8')
+    engine.reload_rules()
+
+    assert engine.ruleset.compiled[0][1] is sql_rules
+    assert engine.get_stats()['reload']['last_reload']['recompiled_rules'] == len(rule_data['rules'])
+    expected = plan_order(engine.bundle.rules)
+    assert [engine.rules.index(r) for r in engine.execution_plan] == expected
+    assert engine.execution_plan[0].name == rule_data['rules'][0]['name']
+
+
+def test_regex_analyzer_flags_backtracking_patterns(monkeypatch):
+    """静态分析识别嵌套量词与无界通配，并记录实测最坏耗时"""
+    nested = analyze_pattern(r'^(a|aa)+$')
+    assert nested['risk'] == RISK_EXPONENTIAL
+    wildcard = analyze_pattern(r'(?i)(union.*select|select.*union)')
+    assert wildcard['risk'] == RISK_POLYNOMIAL
+    assert wildcard['reasons'] == ['unbounded_wildcard']
+    assert wildcard['worst_case_ms'] is not None
+    assert analyze_pattern(r'(?i)drop\s+table')['risk'] == 'safe'
+    # 实测耗时随机器负载波动，不参与分级，缓存的规则包在任何机器上分级一致
+    monkeypatch.setattr('src.core.regex_safety._measure', lambda *args: (500.0, True))
+    slow = analyze_pattern(r'(?i)drop\s+table')
+    assert slow['risk'] == 'safe' and slow['reasons'] == [] and slow['timed_out']
+
+
+def test_engine_reports_risky_patterns(tmp_path):
+    config_path = make_engine_config(tmp_path)
+    engine = RuleEngine(str(config_path))
+    flagged = {r['pattern'] for r in engine.get_regex_report()}
+    assert '(?i)(union.*select|select.*union)' in flagged
+    assert engine.get_stats()['regex']['patterns_by_risk'][RISK_POLYNOMIAL] >= 1
+
+
+@pytest.mark.skipif(not HAS_REGEX, reason='需要 regex 模块')
+def test_regex_timeout_bounds_hostile_input():
+    """灾难性回溯的正则在超时后返回，并按配置视为命中"""
+    rule = Rule(name='EVIL', category='test', patterns=[r'^(a|aa)+$'], severity='low',
+                engine='regex', timeout=0.05)
+    start = time.monotonic()
+    assert rule.match('a' * 5000 + '!') is True
+    assert time.monotonic() - start < 1.0
+    assert rule.timeouts == 1
+
+    rule = Rule(name='EVIL', category='test', patterns=[r'^(a|aa)+$'], severity='low',
+                engine='regex', timeout=0.05, timeout_blocks=False)
+    assert rule.match('a' * 5000 + '!') is False
+
+
+def test_rule_profile_counts_hits_and_samples(tmp_path):
+    config_path = make_engine_config(tmp_path)
+    engine = RuleEngine(str(config_path))
+    engine.profile_sample_every = 1
+    for i in range(5):
+        engine.detect({'url': f'/s?q=<script>{i}', 'method': 'GET', 'body': ''})
+    engine.detect({'url': '/api/users', 'method': 'GET', 'body': ''})
+
+    profile = engine.get_rule_profile(sort_by='hits')
+    top = profile['rules'][0]
+    assert top['name'] == 'XSS_SCRIPT_TAG'
+    assert top['evaluations'] == 6 and top['matches'] == 5
+    assert top['sampled'] == 6 and top['avg_us'] > 0
+    assert sum(p['sampled_hits'] for p in top['patterns']) >= top['matches']
+    assert all(r['evaluations'] == 6 for r in profile['rules'])
+    with pytest.raises(ValueError):
+        engine.get_rule_profile(sort_by='unknown')
+
+    engine.reset_rule_profile()
+    assert engine.get_rule_profile()['rules'][0]['evaluations'] == 0
+
+
+def test_first_match_with_adaptive_ordering(tmp_path):
+    """first 模式命中即停止；重排后常命中的规则在同层内提前，层间顺序不变"""
+    config_path = make_engine_config(tmp_path)
+    config = yaml.safe_load(config_path.read_text(encoding='utf-8'))
+    config['detection'].update({'match_mode': 'first', 'adaptive_ordering': True, 'profile_sample_every': 1})
+    config_path.write_text(yaml.safe_dump(config), encoding='utf-8')
+    engine = RuleEngine(str(config_path))
+
+    is_attack, matches = engine.detect({'url': '/s?q=<script>', 'method': 'GET',
+                                        'body': "' or 1=1 union select 1"})
+    assert is_attack and len(matches) == 1
+
+    tier = [r.name for r in engine.execution_plan if r.cost_level == 'accurate']
+    target = 'SQL_DROP_TABLE'
+    assert tier.index(target) > 0
+    for i in range(20):
+        engine.detect({'url': f'/api/{i}', 'method': 'POST', 'body': f'drop table users{i}'})
+    ruleset = engine.ruleset
+    assert engine.optimize_plan() is True
+    assert engine.ruleset.generation == ruleset.generation
+    reordered = [r.cost_level for r in engine.execution_plan]
+    assert reordered == sorted(reordered, key=engine.cost_rank.get)
+    assert [r.name for r in engine.execution_plan if r.cost_level == 'accurate'][0] == target
+
+
+def test_multilayer_decoding_catches_encoded_payloads(tmp_path):
+    """双重编码、HTML实体与 \\xNN/\\uNNNN 转义按规范形式匹配，无需单独的编码变体规则"""
+    config_path = make_engine_config(tmp_path, ('xss', 'directory_traversal'))
+    engine = RuleEngine(str(config_path))
+    assert not next(r for r in engine.rules if r.name == 'XSS_ENCODED').enabled
+
+    payloads = [
+        ({'url': '/files?path=%252e%252e%252fetc%252fpasswd'}, 'DIR_TRAVERSAL_UNIX'),
+        ({'url': '/c', 'body': 'text=&lt;script&gt;alert(1)&lt;/script&gt;'}, 'XSS_SCRIPT_TAG'),
+        ({'url': '/c', 'body': 'text=&#x3c;script&#62;'}, 'XSS_SCRIPT_TAG'),
+        ({'url': '/c', 'body': '{"text": "\\u003cscript\\u003e"}'}, 'XSS_SCRIPT_TAG'),
+        ({'url': '/c?q=\\x3cscript\\x3e'}, 'XSS_SCRIPT_TAG'),
+        # 编码的 # 与 & 不能把后面的载荷截成 fragment
+        ({'url': '/search?q=%23%3Cscript%3Ealert(1)%3C/script%3E'}, 'XSS_SCRIPT_TAG'),
+        ({'url': '/f?x=%23&file=../../etc/passwd'}, 'DIR_TRAVERSAL_UNIX'),
+        ({'url': '/a?q=%26%2360%3Bscript%26%2362%3B'}, 'XSS_SCRIPT_TAG'),
+    ]
+    for request, rule_name in payloads:
+        is_attack, matches = engine.detect(dict(request, method='POST'))
+        assert is_attack and rule_name in [m['rule_name'] for m in matches], request
+
+    assert engine.detect({'url': '/api/items?page=2', 'method': 'GET', 'body': 'a=1&b=%41'}) == (False, [])
+
+    config = yaml.safe_load(config_path.read_text(encoding='utf-8'))
+    config['detection']['decode_max_depth'] = 0
+    config_path.write_text(yaml.safe_dump(config), encoding='utf-8')
+    assert not RuleEngine(str(config_path)).detect({'url': '/c', 'body': 'text=&#x3c;script&#62;'})[0]
+
+
+def test_headers_inspected_individually_with_cookie_attribution(tmp_path):
+    """请求头逐个检查：命中归属到具体请求头或 Cookie，未列入检查的请求头不参与匹配"""
+    config_path = make_engine_config(tmp_path)
+    engine = RuleEngine(str(config_path))
+    headers = {'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': "gzip' or 1=1 --",
+               'Cookie': 'theme=dark; session=abc%27%20or%201%3D1%20--'}
+    is_attack, matches = engine.detect({'url': '/', 'method': 'GET', 'headers': headers})
+    assert is_attack and {m['location'] for m in matches} == {'cookie:session'}
+    assert all('{' not in m['matched_text'] for m in matches)
+
+    is_attack, matches = engine.detect({'url': '/', 'method': 'GET',
+                                        'headers': {'Referer': '<script>alert(1)</script>'}})
+    assert is_attack and matches[0]['location'] == 'header:referer'
+
+    config = yaml.safe_load(config_path.read_text(encoding='utf-8'))
+    config['detection'].update(inspect_headers=[], skip_headers=['cookie'])
+    config_path.write_text(yaml.safe_dump(config), encoding='utf-8')
+    is_attack, matches = RuleEngine(str(config_path)).detect({'url': '/', 'method': 'GET', 'headers': headers})
+    assert is_attack and {m['location'] for m in matches} == {'header:accept-encoding'}
+
+
+def test_structured_body_targets_filenames_and_json_fields(tmp_path):
+    """multipart 文件名单独检查，上传文件内容不整体扫描；JSON 命中归属到字段路径"""
+    config_path = make_engine_config(tmp_path, ('sql_injection', 'xss', 'malicious_file'))
+    engine = RuleEngine(str(config_path))
+    upload = ('--b\r\nContent-Disposition: form-data; name="note"\r\n\r\nsee report.exe\r\n'
+              '--b\r\nContent-Disposition: form-data; name="f"; filename="{name}"\r\n\r\n'
+              + '\x00MZ' + 'A' * 2_000_000 + '<script>\r\n--b--\r\n')
+    headers = {'Content-Type': 'multipart/form-data; boundary=b'}
+
+    is_attack, matches = engine.detect({'url': '/upload', 'method': 'POST', 'headers': headers,
+                                        'body': upload.replace('{name}', 'shell.PHP')})
+    assert is_attack and [(m['rule_name'], m['location']) for m in matches] == [('SHELL_UPLOAD', 'filename:f')]
+    # 字段值与二进制文件内容不参与 malicious_file 规则，也不被其他规则整体扫描
+    assert engine.detect({'url': '/upload2', 'method': 'POST', 'headers': headers,
+                          'body': upload.replace('{name}', 'report.pdf')}) == (False, [])
+
+    # 浏览器生成的 boundary 大小写混合，必须按原样匹配
+    boundary = '----WebKitFormBoundary7MA4YWxkTrZu0gW'
+    is_attack, matches = engine.detect({
+        'url': '/upload3', 'method': 'POST',
+        'headers': {'Content-Type': f'Multipart/Form-Data; boundary={boundary}'},
+        'body': upload.replace('--b', '--' + boundary).replace('{name}', 'shell.php')})
+    assert is_attack and [(m['rule_name'], m['location']) for m in matches] == [('SHELL_UPLOAD', 'filename:f')]
+
+    is_attack, matches = engine.detect({'url': '/api', 'method': 'POST',
+                                        'headers': {'Content-Type': 'application/json'},
+                                        'body': '{"user": {"bio": "<script>alert(1)</script>"}}'})
+    assert is_attack and matches[0]['location'] == 'field:user.bio'
+    # 无法解析时退回整体扫描
+    assert engine.detect({'url': '/api2', 'method': 'POST', 'headers': {'Content-Type': 'application/json'},
+                          'body': '{"broken": <script>'})[0]
+
+
+def test_compressed_body_scanned_while_streaming(tmp_path):
+    """gzip 请求体解压后匹配，跨块载荷由重叠窗口覆盖；解压炸弹按配置拦截"""
+    import gzip
+
+    config_path = make_engine_config(tmp_path)
+    engine = RuleEngine(str(config_path))
+    engine.decompress_max_ratio = 0  # 填充内容压缩比极高
+    headers = {'Content-Type': 'text/plain', 'Content-Encoding': 'gzip'}
+    payload = 'a' * (64 * 1024 - 4) + '<script>x'  # "<scr" | "ipt>" 落在两个解压块中
+    is_attack, matches = engine.detect({'url': '/c', 'method': 'POST', 'headers': headers,
+                                        'body': gzip.compress(payload.encode())})
+    assert is_attack and matches[0]['location'] == 'body:gzip'
+    assert engine.detect({'url': '/c2', 'method': 'POST', 'headers': headers,
+                          'body': gzip.compress(b'hello world')}) == (False, [])
+
+    engine.decompress_max_ratio = 100
+    is_attack, matches = engine.detect({'url': '/c3', 'method': 'POST', 'headers': headers,
+                                        'body': gzip.compress(b'\0' * (20 * 1024 * 1024))})
+    assert is_attack and matches[0]['category'] == 'decompression_bomb'
+    assert engine.get_stats()['decompression'] == {'bodies': 3, 'limited': 1, 'invalid': 0}
+
+    # first_match: 解压流中命中后即停止，不再评估其余规则与目标
+    engine.first_match = True
+    engine.decompress_max_ratio = 0
+    body = gzip.compress(('<script>' + 'a' * 200_000 + "' union select 1 --").encode())
+    is_attack, matches = engine.detect({'url': '/c4/../../etc/passwd', 'method': 'POST', 'headers': headers,
+                                        'body': body})
+    assert is_attack and len(matches) == 1 and matches[0]['location'] == 'body:gzip'
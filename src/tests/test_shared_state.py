@@ -0,0 +1,167 @@
+"""
+共享状态测试 - 共享表读写与淘汰、跨进程封禁与限流一致
+"""
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+
+from src.core.ban_list import SharedBanList
+from src.core.rate_limiter import RateLimiter, RateLimitRule
+from src.core.shared_state import SharedState
+
+fork = multiprocessing.get_context('fork')
+
+
+@pytest.fixture
+def shared():
+    state = SharedState(stripes=4, counter_slots=64)
+    yield state
+    state.close()
+
+
+def _run(shared, target, *args):
+    def child():
+        target(*args)
+        shared.flush()  # 工作进程退出前写入攒下的计数
+
+    process = fork.Process(target=child)
+    process.start()
+    process.join(10)
+    assert process.exitcode == 0
+
+
+def test_table_update_get_delete(shared):
+    table = shared.table(64, 2, text_bytes=8)
+    assert table.update('a', lambda v: (1, 2), text='中文原因超出截断') == ((1.0, 2.0), '中文')
+    assert table.update('a', lambda v: (v[0] + 1, v[1]))[0] == (2.0, 2.0)
+    assert table.get('a') == ((2.0, 2.0), '中文') and len(table) == 1
+    assert table.delete('a') and not table.delete('a')
+    assert table.get('a') is None and len(table) == 0
+    # 删除标记的槽位可以重用
+    table.update('a', lambda v: (3, 0))
+    assert table.get('a')[0] == (3.0, 0.0) and len(table) == 1
+
+
+def test_long_keys_sharing_a_prefix_stay_distinct(shared):
+    table = shared.table(64, 1, key_bytes=16)
+    prefix = '1.2.3.4|/' + 'a' * 64
+    table.update(prefix + '/x', lambda v: (1,))
+    table.update(prefix + '/y', lambda v: (2,))
+    assert table.get(prefix + '/x')[0] == (1.0,) and table.get(prefix + '/y')[0] == (2.0,)
+    assert table.get(prefix) is None and len(table) == 2
+    # 键文本只用于展示，按 key_bytes 截断
+    assert {key for key, _, _ in table.items()} == {prefix[:16]}
+
+
+def test_table_is_bounded_and_evicts_smallest(shared):
+    table = shared.table(32, 1, evict_field=0)
+    for i in range(1000):
+        table.update(f"k{i}", lambda v, i=i: (i,))
+    assert len(table) <= 32 and table.evictions >= 1000 - 32
+    # 淘汰的总是探测范围内最小（最旧）的条目，最后写入的键仍在
+    assert table.get('k999')[0] == (999.0,)
+    assert table.get('k999' + '\0') is None  # 只有键完全相同才算命中
+    assert all(values[0] >= 1000 - 32 * 8 for _, values, _ in table.items())
+
+
+def _hold_lock(table, held):
+    def hold(values):
+        held.set()
+        time.sleep(60)
+        return values
+
+    table.update('k', hold)
+
+
+def test_lock_held_by_killed_worker_is_recovered(shared):
+    table = shared.table(64, 1)
+    table.update('k', lambda v: (1,))
+    held = fork.Event()
+    process = fork.Process(target=_hold_lock, args=(table, held))
+    process.start()
+    assert held.wait(10)
+
+    # 持有者存活时超过 lock_timeout 放弃本次操作，而不是一直等下去
+    table.lock_timeout = 0.2
+    assert table.update('k', lambda v: (v[0] + 1,)) is None and table.lock_failures == 1
+
+    # 持有者被 SIGKILL 后等待者接管条带锁
+    os.kill(process.pid, signal.SIGKILL)
+    process.join(10)
+    start = time.monotonic()
+    assert table.update('k', lambda v: (v[0] + 1,)) == ((2.0,), '')
+    assert time.monotonic() - start < 1
+    assert table.get('k')[0] == (2.0,)
+
+
+def _ban_and_block(bans):
+    bans.ban('9.9.9.9', 60, '子进程封禁')
+    for _ in range(2):
+        bans.record_block('1.2.3.4')
+
+
+def test_bans_and_offense_counters_are_shared_across_processes(shared):
+    bans = SharedBanList(shared, slots=256, threshold=3, window_seconds=60, ban_seconds=60)
+    bans.record_block('1.2.3.4')
+    _run(shared, _ban_and_block, bans)
+    # 子进程的封禁立即可见；两个进程的拦截累计达到阈值，自动封禁
+    assert bans.check('9.9.9.9').reason == '子进程封禁'
+    assert '1.2.3.4' in bans and bans.check('1.2.3.4').source == 'auto'
+    stats = bans.get_stats()
+    assert stats['active'] == 2 and stats['auto_bans'] == 1 and stats['manual_bans'] == 1
+    assert bans.stats.offenses == 3 and bans.stats.hits == 2
+    assert bans.unban('9.9.9.9') and bans.check('9.9.9.9') is None
+
+
+def test_shared_ban_expiry_and_permanent(shared):
+    now = [1000.0]
+    bans = SharedBanList(shared, slots=64, clock=lambda: now[0])
+    bans.ban('1.1.1.1', 10)
+    bans.ban('2.2.2.2')
+    now[0] += 11
+    assert bans.check('1.1.1.1') is None and bans.stats.expired == 1
+    entry = bans.check('2.2.2.2')
+    assert entry.expires_at is None and entry.hits == 1
+    assert [b['ip'] for b in bans.list_bans()] == ['2.2.2.2'] and bans.list_bans()[0]['permanent']
+
+
+def test_counters_batch_writes_and_drop_inherited_pending(shared):
+    counters = shared.counters
+    counters.add('x', 3)
+    assert counters.get('x') == 3 and counters.table.get('x') is None  # 尚未写入共享表
+    _run(shared, lambda: counters.add('x', 2))
+    assert counters.get('x') == 5  # 子进程丢弃继承的 3，只写入自己的 2
+    assert counters.snapshot() == {'x': 5}
+
+
+def _consume(limiter, count):
+    for _ in range(count):
+        limiter.check({'url': '/', 'source_ip': '5.5.5.5'})
+
+
+def test_rate_limit_buckets_are_shared_across_processes(shared):
+    limiter = RateLimiter([RateLimitRule('per_ip', rate=0.001, burst=10)], max_keys=64, shared=shared)
+    _run(shared, _consume, limiter, 6)
+    results = [limiter.check({'url': '/', 'source_ip': '5.5.5.5'}) for _ in range(5)]
+    assert [r is None for r in results] == [True] * 4 + [False]
+    assert limiter.check({'url': '/', 'source_ip': '6.6.6.6'}) is None
+    stats = limiter.get_stats()
+    assert stats['allowed'] == 11 and stats['rejected'] == {'per_ip': 1}
+    assert stats['rules'][0]['tracked_keys'] == 2
+
+
+def test_request_metrics_sum_across_workers(shared):
+    from src.utils.metrics import WAFMetrics
+
+    metrics = WAFMetrics()
+    metrics.use_shared_counters(shared.counters)
+    metrics.requests.inc('blocked', 'xss')
+    _run(shared, lambda: metrics.requests.inc('blocked', 'xss', amount=2))
+    metrics.observe_stage('total', 0.001)
+    text = metrics.render()
+    # 请求计数是所有进程的合计，按进程统计的指标带 worker 标签
+    assert 'waf_requests_total{verdict="blocked",category="xss"} 3' in text
+    assert f'waf_detection_stage_seconds_count{{stage="total",worker="{os.getpid()}"}} 1' in text
@@ -0,0 +1,25 @@
+"""
+启动路径测试 - 纯规则模式不应导入深度学习依赖
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+def test_rule_only_startup_skips_torch():
+    """anomaly_detection 关闭时，导入 main 并初始化系统不会加载 torch"""
+    code = (
+        "import json, sys\n"
+        "import main\n"
+        "waf = main.WAFSystem()\n"
+        "print(json.dumps({'torch': 'torch' in sys.modules, "
+        "'dl': waf.dl_detector is not None}))\n"
+    )
+    proc = subprocess.run([sys.executable, '-c', code], cwd=str(ROOT_DIR),
+                          capture_output=True, text=True, timeout=60)
+    assert proc.returncode == 0, proc.stderr
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    assert result == {'torch': False, 'dl': False}
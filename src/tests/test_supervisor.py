@@ -0,0 +1,125 @@
+"""
+多进程服务测试 - 崩溃补齐、SIGHUP 滚动重启不丢请求、内存上限替换
+"""
+import http.client
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from src.web.supervisor import WorkerSupervisor, worker_rss
+
+fork = multiprocessing.get_context('fork')
+
+
+def app(environ, start_response):
+    """返回处理请求的工作进程 pid 与其加载代数；/slow 模拟耗时请求"""
+    if environ['PATH_INFO'] == '/slow':
+        time.sleep(1.0)
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [f"{os.getpid()} {GENERATION[0]}".encode()]
+
+
+GENERATION = [0]
+
+
+def _get(port, path='/', timeout=10):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        assert response.status == 200
+        pid, generation = response.read().decode().split()
+        return int(pid), int(generation)
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def serve():
+    processes = []
+
+    def start(**options):
+        supervisor = WorkerSupervisor(app, '127.0.0.1', 0, timeout=5, check_interval=0.05, **options)
+        supervisor.bind()
+        process = fork.Process(target=supervisor.run)
+        process.start()
+        processes.append(process)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                _get(supervisor.port, timeout=1)
+                return process, supervisor.port
+            except (OSError, AssertionError):
+                assert time.monotonic() < deadline, "服务未启动"
+                time.sleep(0.05)
+
+    yield start
+    for process in processes:
+        process.terminate()
+        process.join(10)
+        assert process.exitcode == 0
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_crashed_worker_is_replaced(serve):
+    _, port = serve(workers=1)
+    pid, _ = _get(port)
+    os.kill(pid, signal.SIGKILL)
+    _wait_for(lambda: _get(port)[0] != pid)
+
+
+def test_sighup_rolls_workers_without_dropping_requests(serve):
+    def reload():
+        GENERATION[0] += 1  # 在主进程中执行，之后 fork 的工作进程继承新状态
+
+    process, port = serve(workers=2, on_reload=reload)
+    slow = {}
+    slow_thread = threading.Thread(target=lambda: slow.update(result=_get(port, '/slow')))
+    slow_thread.start()
+    time.sleep(0.2)
+
+    errors, served = [], []
+    stop = threading.Event()
+
+    def load():
+        while not stop.is_set():
+            try:
+                served.append(_get(port))
+            except Exception as e:  # 任何失败都说明重启时丢了请求
+                errors.append(e)
+
+    client = threading.Thread(target=load)
+    client.start()
+    os.kill(process.pid, signal.SIGHUP)
+    _wait_for(lambda: served and served[-1][1] == 1)
+    time.sleep(0.2)
+    stop.set()
+    client.join()
+    slow_thread.join()
+
+    assert errors == []
+    # 重启前开始的耗时请求由旧进程处理完
+    assert slow['result'][1] == 0
+    assert {pid for pid, generation in served if generation == 1}.isdisjoint(
+        {pid for pid, generation in served if generation == 0})
+
+
+def test_worker_over_memory_ceiling_is_replaced(serve):
+    _, port = serve(workers=1, max_memory_bytes=1)
+    pid, _ = _get(port)
+    _wait_for(lambda: _get(port)[0] != pid)
+
+
+def test_worker_rss():
+    assert worker_rss(os.getpid()) > 0
+    assert worker_rss(2 ** 22 + 1) is None
@@ -0,0 +1,65 @@
+"""
+白名单测试 - CIDR/路径前缀树匹配、增删不重建、检测前放行
+"""
+import pytest
+
+from src.core.whitelist import Whitelist
+
+
+def test_cidr_trie_longest_prefix_and_ipv6():
+    whitelist = Whitelist(['10.0.0.0/8', '10.1.2.3', '2001:db8::/32', '192.168.1.0/24'])
+    assert whitelist.match_ip('10.200.3.4') == '10.0.0.0/8'
+    assert whitelist.match_ip('10.1.2.3') == '10.1.2.3'
+    assert whitelist.match_ip('192.168.1.77') == '192.168.1.0/24'
+    assert whitelist.match_ip('192.168.2.1') is None
+    assert whitelist.match_ip('2001:db8:1::5') == '2001:db8::/32'
+    assert whitelist.match_ip('2001:db9::1') is None
+    assert whitelist.match_ip('::ffff:10.9.9.9') == '10.0.0.0/8'
+    assert whitelist.match_ip('not-an-ip') is None
+
+    whitelist.discard('10.0.0.0/8')
+    assert whitelist.match_ip('10.200.3.4') is None
+    assert whitelist.match_ip('10.1.2.3') == '10.1.2.3'
+
+
+def test_path_prefix_matches_whole_segments_only():
+    whitelist = Whitelist(['/health', '/static/'])
+    assert whitelist.match_path('/health') == '/health'
+    assert whitelist.match_path('/health/live?verbose=1') == '/health'
+    assert whitelist.match_path('/static/js/app.js') == '/static/'
+    assert whitelist.match_path('/healthz') is None
+    # 可能经解码/归一化指向别处的路径不走白名单
+    assert whitelist.match_path('/health/../admin') is None
+    assert whitelist.match_path('/health%2f..%2fadmin') is None
+
+
+def test_set_compatible_interface():
+    whitelist = Whitelist()
+    whitelist.add('192.168.1.1')
+    whitelist.add('/internal')
+    assert '192.168.1.1' in whitelist and '/internal' in whitelist
+    assert sorted(whitelist) == ['/internal', '192.168.1.1'] and len(whitelist) == 2
+    with pytest.raises(ValueError):
+        whitelist.add('example.com')
+    whitelist.discard('missing')
+    whitelist.discard('/internal')
+    assert list(whitelist) == ['192.168.1.1']
+
+
+def test_whitelisted_request_bypasses_detection():
+    from main import WAFSystem
+
+    waf = WAFSystem()
+    attack = {'url': '/health?q=<script>alert(1)</script>', 'method': 'GET', 'body': '',
+              'source_ip': '172.16.5.5'}
+    assert waf.detect_request(attack)['blocked']
+
+    client = waf.web_app.app.test_client()
+    assert client.post('/api/whitelist', json={'item': '172.16.0.0/12'}).status_code == 200
+    assert client.post('/api/whitelist', json={'item': 'bad entry'}).status_code == 400
+    result = waf.detect_request(attack)
+    assert not result['blocked'] and result['category'] == 'whitelisted'
+    assert '172.16.0.0/12' in client.get('/api/whitelist').get_json()['whitelist']
+
+    assert client.delete('/api/whitelist/172.16.0.0/12').status_code == 200
+    assert waf.detect_request(dict(attack, source_ip='172.16.5.6'))['blocked']
@@ -0,0 +1,255 @@
+"""
+检测性能基准 - 语料生成、计时与基线对比
+供 scripts/benchmark.py 使用；语料由固定随机种子生成，结果可复现
+"""
+import gc
+import json
+import platform
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import yaml
+
+BENCHMARK_FORMAT_VERSION = 1
+
+# 参与回归门禁的指标：延迟越大越差，吞吐越小越差；p999 噪声较大，默认只记录不门禁
+GATED_METRICS = ('p50_us', 'p99_us', 'ops_per_sec')
+
+_WORDS = ('user', 'order', 'item', 'search', 'profile', 'cart', 'news', 'report', 'account',
+          'invoice', 'product', 'category', 'page', 'blog', 'comment', 'photo', 'settings')
+_STATIC = ('/static/js/app.{}.js', '/static/css/main.{}.css', '/images/banner_{}.png', '/favicon.ico')
+_AGENTS = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36',
+           'Mozilla/5.0 (Macintosh; Intel Mac OS X 13_5) AppleWebKit/605.1.15 Version/16.6 Safari/605.1.15',
+           'curl/8.4.0', 'python-requests/2.31.0')
+
+# 攻击模板：{n} 替换为随机数字，{w} 替换为随机单词
+ATTACK_TEMPLATES = {
+    'sql_injection': [
+        ('GET', '/api/{w}?id={n} UNION SELECT username,password FROM users--', ''),
+        ('POST', '/login', "username=admin' OR '1'='1&password={w}"),
+        ('GET', '/api/{w}?id={n};DROP TABLE {w}', ''),
+        ('POST', '/api/{w}', 'q={n}; exec(xp_cmdshell)'),
+        ('GET', '/report?sort={w}%20or%201%3D1', ''),
+    ],
+    'xss': [
+        ('GET', '/search?q=<script>alert({n})</script>', ''),
+        ('POST', '/comment', 'text=<img src=x onerror=alert({n})>'),
+        ('GET', '/{w}?next=javascript:alert(document.cookie)', ''),
+        ('POST', '/profile', 'bio=%3Cscript%3Efetch("/{w}")%3C/script%3E'),
+    ],
+    'directory_traversal': [
+        ('GET', '/files?path=../../../../etc/passwd', ''),
+        ('GET', '/download?file=..%2f..%2f{w}.conf', ''),
+        ('GET', '/static/..\\..\\windows\\win.ini', ''),
+    ],
+    'malicious_file': [
+        ('POST', '/upload', 'filename=shell{n}.php'),
+        ('POST', '/upload', 'filename={w}.jsp&content=<% exec %>'),
+        ('POST', '/api/{w}/import', 'file=payload{n}.exe'),
+    ],
+}
+
+
+def _fill(template: str, rng: random.Random) -> str:
+    while '{n}' in template or '{w}' in template:
+        template = template.replace('{n}', str(rng.randint(1, 99999)), 1)
+        template = template.replace('{w}', rng.choice(_WORDS), 1)
+    return template
+
+
+def _benign_request(rng: random.Random) -> Dict[str, Any]:
+    kind = rng.random()
+    headers = {'User-Agent': rng.choice(_AGENTS), 'Accept': '*/*',
+               'Cookie': f'session={rng.getrandbits(64):016x}; lang=zh-CN'}
+    if kind < 0.25:
+        return {'method': 'GET', 'url': rng.choice(_STATIC).format(rng.getrandbits(24)),
+                'headers': headers, 'body': ''}
+    if kind < 0.65:
+        path = '/'.join(rng.choice(_WORDS) for _ in range(rng.randint(1, 3)))
+        query = '&'.join(f'{rng.choice(_WORDS)}={rng.randint(1, 5000)}' for _ in range(rng.randint(0, 4)))
+        return {'method': 'GET', 'url': f'/api/{path}' + (f'?{query}' if query else ''),
+                'headers': headers, 'body': ''}
+    if kind < 0.85:
+        fields = {rng.choice(_WORDS): rng.choice(_WORDS) * rng.randint(1, 8) for _ in range(rng.randint(2, 8))}
+        headers['Content-Type'] = 'application/json'
+        return {'method': 'POST', 'url': f'/api/{rng.choice(_WORDS)}', 'headers': headers,
+                'body': json.dumps(fields)}
+    fields = '&'.join(f'{rng.choice(_WORDS)}={rng.choice(_WORDS)}{rng.randint(0, 999)}'
+                      for _ in range(rng.randint(2, 6)))
+    headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    return {'method': 'POST', 'url': f'/{rng.choice(_WORDS)}/submit', 'headers': headers, 'body': fields}
+
+
+def generate_corpus(size: int, attack_ratio: float = 0.2, seed: int = 1234) -> List[Dict[str, Any]]:
+    """
+    生成混合语料：良性请求（静态资源、API查询、JSON/表单提交）与各类攻击变体
+
+    每条请求带 ``label``（normal 或攻击类别）与唯一 ``source_ip``，避免命中匹配缓存。
+    """
+    rng = random.Random(seed)
+    categories = sorted(ATTACK_TEMPLATES)
+    corpus = []
+    for i in range(size):
+        if rng.random() < attack_ratio:
+            category = rng.choice(categories)
+            method, url, body = rng.choice(ATTACK_TEMPLATES[category])
+            request = {'method': method, 'url': _fill(url, rng), 'body': _fill(body, rng),
+                       'headers': {'User-Agent': rng.choice(_AGENTS)}, 'label': category}
+        else:
+            request = _benign_request(rng)
+            request['label'] = 'normal'
+        request['source_ip'] = f'10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}'
+        corpus.append(request)
+    return corpus
+
+
+def write_synthetic_rules(directory: Path, count: int, seed: int = 1234, per_file: int = 200) -> List[str]:
+    """生成 count 条合成规则（不命中常规流量），用于测量规则规模对检测耗时的影响"""
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    levels = ('fast', 'accurate', 'expensive')
+    files = []
+    for start in range(0, count, per_file):
+        rules = []
+        for i in range(start, min(start + per_file, count)):
+            token = ''.join(rng.choice('bcdfghjklmnpqrstvwxz') for _ in range(6))
+            rules.append({
+                'name': f'SYNTHETIC_{i}',
+                'category': 'synthetic',
+                'severity': 'low',
+                'priority': 100 + i,
+                'cost_level': levels[i % 3],
+                'patterns': [f'(?i){token}\\d{{2,}}', f'(?i)x-{token}[:=]\\s*\\w+'],
+            })
+        path = directory / f'synthetic_{start // per_file:04d}.yaml'
+        path.write_text(yaml.safe_dump({'rules': rules}), encoding='utf-8')
+        files.append(str(path))
+    return files
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """最近秩百分位（q 取 0-100），输入须已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(-(-q * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(durations_ns: List[int]) -> Dict[str, float]:
+    """将单次调用耗时（纳秒）汇总为吞吐与延迟分位（微秒）"""
+    values = sorted(durations_ns)
+    total = sum(values)
+    return {
+        'n': len(values),
+        'ops_per_sec': round(len(values) / (total / 1e9), 1) if total else 0.0,
+        'mean_us': round(total / len(values) / 1000, 3) if values else 0.0,
+        'p50_us': round(percentile(values, 50) / 1000, 3),
+        'p99_us': round(percentile(values, 99) / 1000, 3),
+        'p999_us': round(percentile(values, 99.9) / 1000, 3),
+        'max_us': round(values[-1] / 1000, 3) if values else 0.0,
+    }
+
+
+def time_calls(func: Callable[[Any], Any], items: Iterable[Any], warmup: int = 200) -> Dict[str, float]:
+    """逐条计时调用 func(item)；先用前 warmup 条预热，计时期间暂停 GC 以减少抖动"""
+    items = list(items)
+    for item in items[:warmup]:
+        func(item)
+    durations = []
+    perf = time.perf_counter_ns
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for item in items:
+            start = perf()
+            func(item)
+            durations.append(perf() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return summarize(durations)
+
+
+def best_of(summaries: List[Dict[str, float]]) -> Dict[str, float]:
+    """多轮测量取各指标最优值（延迟取最小、吞吐取最大），抑制共享机器上的噪声"""
+    best = dict(summaries[0])
+    for summary in summaries[1:]:
+        for key, value in summary.items():
+            if key == 'ops_per_sec':
+                best[key] = max(best[key], value)
+            elif key != 'n':
+                best[key] = min(best[key], value)
+    best['rounds'] = len(summaries)
+    return best
+
+
+def calibrate(iterations: int = 200000) -> int:
+    """固定纯 Python 工作量的耗时（纳秒，取三次最小值），用于在不同机器间归一化基线"""
+    best = None
+    for _ in range(3):
+        start = time.perf_counter_ns()
+        acc = 0
+        for i in range(iterations):
+            acc += i * i % 7
+        elapsed = time.perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+    }
+
+
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.5,
+                        metrics: Sequence[str] = GATED_METRICS) -> List[Dict[str, Any]]:
+    """
+    与基线对比，返回超出容差的回归项
+
+    基线按两次运行的校准耗时比例换算到当前机器：延迟乘以该比例，吞吐除以该比例。
+    """
+    scale = 1.0
+    if report.get('calibration_ns') and baseline.get('calibration_ns'):
+        scale = report['calibration_ns'] / baseline['calibration_ns']
+    regressions = []
+    for name, base in baseline.get('results', {}).items():
+        current = report.get('results', {}).get(name)
+        if current is None:
+            continue
+        for metric in metrics:
+            if metric not in base or metric not in current or not base[metric]:
+                continue
+            if metric == 'ops_per_sec':
+                expected = base[metric] / scale
+                regressed = current[metric] < expected * (1 - tolerance)
+            else:
+                expected = base[metric] * scale
+                regressed = current[metric] > expected * (1 + tolerance)
+            if regressed:
+                regressions.append({'benchmark': name, 'metric': metric,
+                                    'baseline': round(expected, 3), 'current': current[metric],
+                                    'change': round(current[metric] / expected - 1, 3)})
+    return regressions
+
+
+def load_report(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_report(report: Dict[str, Any], path: str):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+        f.write('\n')
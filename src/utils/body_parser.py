@@ -0,0 +1,183 @@
+"""
+请求体结构化解析 - multipart/form-data 与 JSON
+- multipart 逐个产出分段，分段内容只记录偏移，文件内容按需截取开头部分嗅探，不整体复制
+- JSON 展开为 (路径, 值) 叶子，路径形如 ``user.tags[0]``
+无法解析（边界缺失、分段或叶子过多、JSON 无效）时抛出 BodyParseError，由调用方退回整体扫描。
+"""
+import json
+import re
+from typing import Any, AnyStr, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
+
+DEFAULT_MAX_PARTS = 256
+DEFAULT_JSON_MAX_LEAVES = 2048
+DEFAULT_JSON_MAX_DEPTH = 32
+
+_BOUNDARY = re.compile(r'boundary=(?:"([^"]{1,200})"|([^\s;,]{1,200}))', re.IGNORECASE)
+_DISPOSITION_PARAM = re.compile(r';\s*([\w*.-]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+
+
+class BodyParseError(ValueError):
+    """请求体与声明的格式不符"""
+
+
+def parse_boundary(content_type: str) -> Optional[str]:
+    """取 multipart Content-Type 中的 boundary 参数"""
+    match = _BOUNDARY.search(content_type or '')
+    if match is None:
+        return None
+    return match.group(1) or match.group(2)
+
+
+def _disposition_params(value: str) -> Dict[str, List[str]]:
+    """Content-Disposition 参数，重复出现的参数保留全部取值"""
+    params: Dict[str, List[str]] = {}
+    for key, raw in _DISPOSITION_PARAM.findall(value):
+        raw = raw.strip()
+        if raw.startswith('"') and raw.endswith('"') and len(raw) >= 2:
+            raw = re.sub(r'\\(.)', r'\1', raw[1:-1])
+        key = key.lower()
+        if key.endswith('*'):
+            # RFC 5987: charset'lang'percent-encoded
+            key = key[:-1]
+            _, _, raw = raw.partition("'")
+            _, _, raw = raw.partition("'")
+            raw = unquote(raw)
+        params.setdefault(key, []).append(raw)
+    return params
+
+
+class MultipartPart:
+    """
+    multipart 分段：请求头已解析，内容为原请求体中的 [start, end) 区间
+
+    Attributes:
+        headers: 小写请求头名 -> 值
+        name: 表单字段名
+        filenames: Content-Disposition 中的全部文件名（filename 与 filename* 可能不一致，都要检查）
+    """
+
+    __slots__ = ('headers', 'name', 'filenames', '_body', 'start', 'end')
+
+    def __init__(self, headers: Dict[str, str], body: AnyStr, start: int, end: int):
+        self.headers = headers
+        params = _disposition_params(headers.get('content-disposition', ''))
+        self.name = (params.get('name') or [''])[0]
+        self.filenames = params.get('filename') or []
+        self._body = body
+        self.start = start
+        self.end = end
+
+    @property
+    def is_file(self) -> bool:
+        return bool(self.filenames)
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get('content-type', '')
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+    def head(self, limit: int) -> AnyStr:
+        """内容的前 limit 个字符/字节"""
+        return self._body[self.start:min(self.end, self.start + limit)]
+
+    def value(self) -> AnyStr:
+        return self._body[self.start:self.end]
+
+
+def iter_multipart(body: AnyStr, boundary: str, max_parts: int = DEFAULT_MAX_PARTS) -> Iterator[MultipartPart]:
+    """
+    逐个产出 multipart 分段；body 可以是 str 或 bytes
+
+    Raises:
+        BodyParseError: 找不到边界、缺少结束边界、分段头不完整或分段数超过 max_parts
+    """
+    is_text = isinstance(body, str)
+    delimiter = ('--' + boundary) if is_text else ('--' + boundary).encode('latin-1')
+    newline, dash = ('\n', '--') if is_text else (b'\n', b'--')
+    next_delimiter = newline + delimiter
+
+    position = body.find(delimiter)
+    if position < 0 or (position > 0 and body[position - 1:position] != newline):
+        raise BodyParseError("multipart 请求体中找不到边界")
+    count = 0
+    while True:
+        position += len(delimiter)
+        if body[position:position + 2] == dash:
+            return
+        line_end = body.find(newline, position)
+        if line_end < 0:
+            raise BodyParseError("multipart 边界行不完整")
+        header_start = line_end + 1
+        headers: Dict[str, str] = {}
+        cursor = header_start
+        while True:
+            line_end = body.find(newline, cursor)
+            if line_end < 0:
+                raise BodyParseError("multipart 分段头不完整")
+            line = body[cursor:line_end]
+            cursor = line_end + 1
+            if not is_text:
+                line = line.decode('utf-8', 'replace')
+            line = line.rstrip('\r')
+            if not line:
+                break
+            key, sep, value = line.partition(':')
+            if sep:
+                headers[key.strip().lower()] = value.strip()
+        data_end = body.find(next_delimiter, cursor)
+        if data_end < 0:
+            raise BodyParseError("multipart 缺少结束边界")
+        content_end = data_end - 1 if body[data_end - 1:data_end] == ('\r' if is_text else b'\r') else data_end
+        count += 1
+        if count > max_parts:
+            raise BodyParseError(f"multipart 分段数超过 {max_parts}")
+        yield MultipartPart(headers, body, cursor, max(cursor, content_end))
+        position = data_end + 1
+
+
+def looks_binary(sample: AnyStr) -> bool:
+    """嗅探：含 NUL 或大量无法解码的字符即视为二进制内容"""
+    if isinstance(sample, str):
+        return '\x00' in sample or sample.count('\ufffd') * 8 > len(sample)
+    return b'\x00' in sample
+
+
+def iter_json_leaves(value: Any, path: str = '', max_depth: int = DEFAULT_JSON_MAX_DEPTH,
+                     max_leaves: int = DEFAULT_JSON_MAX_LEAVES) -> Iterator[Tuple[str, str]]:
+    """
+    将已解析的 JSON 展开为 (路径, 文本) 叶子；null 不产出，超过 max_depth 的子树整体序列化为一个叶子
+
+    Raises:
+        BodyParseError: 叶子数超过 max_leaves
+    """
+    count = 0
+    stack = [(path, value, 0)]
+    while stack:
+        path, node, depth = stack.pop()
+        if isinstance(node, (dict, list)) and depth >= max_depth:
+            node = json.dumps(node, ensure_ascii=False)
+        if isinstance(node, dict):
+            items = [(f"{path}.{key}" if path else str(key), child) for key, child in node.items()]
+        elif isinstance(node, list):
+            items = [(f"{path}[{index}]", child) for index, child in enumerate(node)]
+        else:
+            if node is None:
+                continue
+            count += 1
+            if count > max_leaves:
+                raise BodyParseError(f"JSON 叶子数超过 {max_leaves}")
+            yield path, node if isinstance(node, str) else json.dumps(node)
+            continue
+        # 逆序入栈，按文档顺序产出
+        stack.extend((child_path, child, depth + 1) for child_path, child in reversed(items))
+
+
+def parse_json_body(body: AnyStr) -> Any:
+    try:
+        return json.loads(body)
+    except (ValueError, RecursionError) as e:
+        raise BodyParseError(f"JSON 请求体无效: {e}") from None
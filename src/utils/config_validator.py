@@ -30,12 +30,14 @@ class ServerConfig(BaseModel):
     workers: int = Field(default=1, ge=1, le=64)
     timeout: int = Field(default=30, ge=1, le=600)
     max_request_size: str = Field(default="10MB")
+    max_worker_memory: str = Field(default="1GB")
 
 
 class RulesConfig(BaseModel):
     auto_reload: bool = Field(default=False)
     reload_interval: int = Field(default=300, ge=0)
     directories: List[str] = Field(default_factory=list)
+    bundle_file: str = Field(default="cache/rule_bundle.json")
 
     @validator("directories", each_item=True)
     def validate_rule_paths(cls, v: str) -> str:
@@ -53,6 +55,38 @@ class BlockingConfig(BaseModel):
     enabled: bool = Field(default=True)
     response_code: int = Field(default=403, ge=100, le=599)
     response_message: str = Field(default="Request blocked by WAF")
+    auto_ban: bool = Field(default=False)
+    ban_threshold: int = Field(default=10, ge=1)
+    ban_window_seconds: int = Field(default=60, ge=1)
+    ban_seconds: int = Field(default=600, ge=1)
+
+
+class RateLimitRuleConfig(BaseModel):
+    name: str
+    key: str = Field(default="ip")
+    rate: float = Field(default=100.0, gt=0)
+    burst: float = Field(default=200.0, ge=1)
+    path_prefix: str = Field(default="")
+
+    @validator("key")
+    def validate_key(cls, v: str) -> str:
+        if v not in {"ip", "path", "ip_path"}:
+            raise ValueError("rate_limit.rules[].key 必须是 ip、path 或 ip_path")
+        return v
+
+
+class RateLimitConfig(BaseModel):
+    enabled: bool = Field(default=False)
+    max_keys: int = Field(default=100000, ge=1)
+    shards: int = Field(default=16, ge=1, le=1024)
+    rules: List[RateLimitRuleConfig] = Field(default_factory=list)
+
+
+class SharedStateConfig(BaseModel):
+    enabled: bool = Field(default=False)
+    stripes: int = Field(default=16, ge=1, le=1024)
+    ban_slots: int = Field(default=65536, ge=16)
+    counter_slots: int = Field(default=1024, ge=16)
 
 
 class DetectionConfig(BaseModel):
@@ -62,6 +96,52 @@ class DetectionConfig(BaseModel):
     anomaly_detection: bool = Field(default=False)
     threshold: float = Field(default=0.7, ge=0.0, le=1.0)
     cache_ttl_seconds: int = Field(default=5, ge=0, le=3600)
+    decode_max_depth: int = Field(default=3, ge=0, le=10)
+    inspect_headers: List[str] = Field(default_factory=lambda: ["cookie", "user-agent", "referer",
+                                                                "x-forwarded-for", "x-real-ip", "origin",
+                                                                "host", "content-type"])
+    skip_headers: List[str] = Field(default_factory=list)
+    structured_body: bool = Field(default=True)
+    file_sniff_bytes: int = Field(default=4096, ge=0)
+    decompress_bodies: bool = Field(default=True)
+    decompress_max_bytes: int = Field(default=10 * 1024 * 1024, ge=0)
+    decompress_max_ratio: float = Field(default=100.0, ge=0)
+    decompress_limit_action: str = Field(default="block")
+    model_path: str = Field(default="models/saved/dl_model.pth")
+    dl_cache_size: int = Field(default=10000, ge=0)
+    canary_min_accuracy: float = Field(default=0.0, ge=0.0, le=1.0)
+    regex_engine: str = Field(default="auto")
+    regex_timeout_ms: int = Field(default=100, ge=0)
+    regex_timeout_action: str = Field(default="block")
+    rule_profiling: bool = Field(default=True)
+    profile_sample_every: int = Field(default=64, ge=1)
+    match_mode: str = Field(default="all")
+    adaptive_ordering: bool = Field(default=False)
+    adaptive_interval_seconds: int = Field(default=30, ge=1)
+
+    @validator("regex_engine")
+    def validate_regex_engine(cls, v: str) -> str:
+        if v not in {"auto", "re", "regex"}:
+            raise ValueError("detection.regex_engine 必须是 auto、re 或 regex")
+        return v
+
+    @validator("match_mode")
+    def validate_match_mode(cls, v: str) -> str:
+        if v not in {"all", "first"}:
+            raise ValueError("detection.match_mode 必须是 all 或 first")
+        return v
+
+    @validator("regex_timeout_action")
+    def validate_timeout_action(cls, v: str) -> str:
+        if v not in {"block", "skip"}:
+            raise ValueError("detection.regex_timeout_action 必须是 block 或 skip")
+        return v
+
+    @validator("decompress_limit_action")
+    def validate_decompress_limit_action(cls, v: str) -> str:
+        if v not in {"block", "skip"}:
+            raise ValueError("detection.decompress_limit_action 必须是 block 或 skip")
+        return v
 
 
 class WAFConfig(BaseModel):
@@ -84,6 +164,8 @@ class Settings(BaseModel):
     logging: LoggingConfig = Field(default_factory=LoggingConfig)
     whitelist: WhitelistConfig = Field(default_factory=WhitelistConfig)
     blocking: BlockingConfig = Field(default_factory=BlockingConfig)
+    rate_limit: RateLimitConfig = Field(default_factory=RateLimitConfig)
+    shared_state: SharedStateConfig = Field(default_factory=SharedStateConfig)
 
 
 def load_and_validate_config(path: str) -> Settings:
@@ -0,0 +1,151 @@
+"""
+请求体流式解压 - Content-Encoding: gzip / deflate
+- 每次最多产出 chunk_size 字节，解压结果逐块交给调用方，不在内存中拼出完整请求体
+- 输出总量与膨胀比（输出/已消耗输入）超限时抛出 DecompressionLimitError，防御解压炸弹
+"""
+import zlib
+from typing import Iterator, List, Optional, Union
+
+DEFAULT_MAX_OUTPUT_BYTES = 10 * 1024 * 1024
+DEFAULT_MAX_RATIO = 100
+DEFAULT_CHUNK_SIZE = 64 * 1024
+# 输出低于该值时不检查膨胀比：很小的请求体本身压缩比就可能很高
+RATIO_CHECK_FLOOR = 64 * 1024
+
+SUPPORTED_ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+
+
+class DecompressionError(ValueError):
+    """压缩数据无效或编码不受支持"""
+
+
+class DecompressionLimitError(DecompressionError):
+    """解压输出或膨胀比超过上限"""
+
+
+def parse_content_encoding(value: str) -> List[str]:
+    """Content-Encoding 编码列表（按应用顺序），identity 省略"""
+    return [token.strip().lower() for token in (value or '').split(',')
+            if token.strip() and token.strip().lower() != 'identity']
+
+
+class _Stage:
+    """单层解压；deflate 先按 zlib 格式尝试，首块失败时改为裸 deflate（部分客户端如此发送）"""
+
+    def __init__(self, encoding: str):
+        if encoding not in SUPPORTED_ENCODINGS:
+            raise DecompressionError(f"不支持的 Content-Encoding: {encoding}")
+        self.encoding = encoding
+        self.raw_fallback = encoding == 'deflate'
+        self.obj = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding != 'deflate' else zlib.MAX_WBITS)
+        self.started = False
+
+    def next_member(self) -> bytes:
+        """gzip 可由多个成员拼接而成，上一个成员结束后从剩余数据开始解压下一个"""
+        data = self.obj.unused_data
+        self.obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return data
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        try:
+            out = self.obj.decompress(data, max_length)
+        except zlib.error as e:
+            if not self.raw_fallback or self.started:
+                raise DecompressionError(f"{self.encoding} 数据无效: {e}") from None
+            self.raw_fallback = False
+            self.obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.decompress(data, max_length)
+        self.started = True
+        return out
+
+
+class StreamingDecompressor:
+    """
+    逐块解压，可串联多层编码（如 ``Content-Encoding: deflate, gzip``）
+
+    Args:
+        encodings: 按应用顺序的编码列表，解压时逆序处理
+        max_output_bytes: 解压输出上限
+        max_ratio: 输出与 zlib 实际消耗的压缩输入之比的上限，0 为不限（送入但尚未消耗的数据不计入）
+    """
+
+    def __init__(self, encodings: List[str], max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES,
+                 max_ratio: float = DEFAULT_MAX_RATIO, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.stages = [_Stage(encoding) for encoding in reversed(encodings)]
+        self.max_output_bytes = max_output_bytes
+        self.max_ratio = max_ratio
+        self.chunk_size = chunk_size
+        self.input_bytes = 0
+        self.output_bytes = 0
+
+    def _check(self):
+        if self.max_output_bytes and self.output_bytes > self.max_output_bytes:
+            raise DecompressionLimitError(f"解压输出超过 {self.max_output_bytes} 字节")
+        if (self.max_ratio and self.output_bytes > RATIO_CHECK_FLOOR and
+                self.output_bytes > self.max_ratio * max(self.input_bytes, 1)):
+            raise DecompressionLimitError(
+                f"膨胀比超过 {self.max_ratio:g}（{self.input_bytes} -> {self.output_bytes} 字节）")
+
+    def _run(self, index: int, data: bytes) -> Iterator[bytes]:
+        """把 data 送入第 index 层，逐块产出最内层的输出；每层每次最多 chunk_size 字节"""
+        stage = self.stages[index]
+        last = index == len(self.stages) - 1
+        while data:
+            out = stage.decompress(data, self.chunk_size)
+            if index == 0:
+                # 最外层按实际消耗计数：max_length 限制下 zlib 只消耗产出这一块所需的输入
+                remaining = len(stage.obj.unconsumed_tail) + (len(stage.obj.unused_data) if stage.obj.eof else 0)
+                self.input_bytes += len(data) - remaining
+            data = stage.obj.unconsumed_tail
+            if stage.obj.eof and stage.encoding != 'deflate' and stage.obj.unused_data:
+                data = stage.next_member()
+            if not out:
+                if data:
+                    continue
+                break
+            if last:
+                self.output_bytes += len(out)
+                self._check()
+                yield out
+            else:
+                yield from self._run(index + 1, out)
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        """送入一块压缩数据，逐块产出解压结果"""
+        if not self.stages:
+            self.input_bytes += len(data)
+            self.output_bytes += len(data)
+            self._check()
+            if data:
+                yield data
+            return
+        yield from self._run(0, data)
+
+    def finish(self) -> Iterator[bytes]:
+        """输入结束：产出各层缓冲的剩余数据"""
+        for index, stage in enumerate(self.stages):
+            tail = stage.obj.flush()
+            if tail:
+                if index == len(self.stages) - 1:
+                    self.output_bytes += len(tail)
+                    self._check()
+                    yield tail
+                else:
+                    yield from self._run(index + 1, tail)
+
+
+def iter_decompressed(data: Union[bytes, bytearray, memoryview], encodings: List[str],
+                      max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES, max_ratio: float = DEFAULT_MAX_RATIO,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE, input_chunk: Optional[int] = None) -> Iterator[bytes]:
+    """
+    解压完整的压缩请求体，逐块产出
+
+    Args:
+        input_chunk: 每次送入的压缩数据大小；默认与 chunk_size 相同，使膨胀比在解压过程中逐步检查
+    """
+    decompressor = StreamingDecompressor(encodings, max_output_bytes, max_ratio, chunk_size)
+    view = memoryview(data)
+    step = input_chunk or chunk_size
+    for start in range(0, len(view), step):
+        yield from decompressor.feed(bytes(view[start:start + step]))
+    yield from decompressor.finish()
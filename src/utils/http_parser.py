@@ -0,0 +1,249 @@
+"""
+原始HTTP请求解析 - 直接在 bytes/memoryview 上工作
+- 只定位请求行、请求头与请求体的边界并记录偏移，不按行切分、不重新拼接请求体
+- 请求体按 Content-Length 或 chunked 分帧，是原缓冲区的 memoryview 切片，CRLF 原样保留
+- 分帧完成后 consumed 指向下一个请求的起点，可连续解析同一连接上的多个请求
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+DEFAULT_MAX_HEADER_BYTES = 64 * 1024
+
+_LINE_END = re.compile(rb'\r?\n')
+_HEADER_END = re.compile(rb'\r?\n\r?\n')
+# 请求头行（不含换行）: token ":" 可选空白 值；值的首尾空白不计入偏移
+_HEADER_LINE = re.compile(rb"([!#$%&'*+\-.^_`|~0-9A-Za-z]+):[ \t]*(.*?)[ \t]*\Z", re.DOTALL)
+_CHUNK_SIZE = re.compile(rb'[0-9a-fA-F]{1,16}')
+_DIGITS = re.compile(rb'[0-9]{1,19}')
+
+
+class HTTPParseError(ValueError):
+    """报文格式错误（请求行、请求头或分帧无效）"""
+
+
+class HTTPIncompleteError(HTTPParseError):
+    """报文不完整，需要更多数据"""
+
+
+class RawHTTPRequest:
+    """
+    解析结果：请求行与请求头偏移都指向原缓冲区
+
+    Attributes:
+        method/target/version: 请求行（很短，直接解码为 str）
+        header_spans: [(名起, 名止, 值起, 值止)] 偏移列表
+        body_chunks: 请求体分段（memoryview），Content-Length 时只有一段，chunked 时每块一段
+        consumed: 本请求占用的字节数
+    """
+
+    __slots__ = ('buffer', 'method', 'target', 'version', 'header_spans', 'body_chunks',
+                 'header_end', 'consumed', 'chunked')
+
+    def __init__(self, buffer: memoryview, method: str, target: str, version: str,
+                 header_spans: List[Tuple[int, int, int, int]], header_end: int):
+        self.buffer = buffer
+        self.method = method
+        self.target = target
+        self.version = version
+        self.header_spans = header_spans
+        self.header_end = header_end
+        self.body_chunks: List[memoryview] = []
+        self.consumed = header_end
+        self.chunked = False
+
+    def iter_headers(self):
+        """逐个返回 (名, 值) 的 memoryview 切片"""
+        buf = self.buffer
+        for name_start, name_end, value_start, value_end in self.header_spans:
+            yield buf[name_start:name_end], buf[value_start:value_end]
+
+    def get_all(self, name: str) -> List[bytes]:
+        """同名请求头的全部值（名不区分大小写）"""
+        wanted = name.lower().encode('latin-1')
+        return [bytes(value) for key, value in self.iter_headers()
+                if len(key) == len(wanted) and bytes(key).lower() == wanted]
+
+    def header(self, name: str) -> Optional[bytes]:
+        values = self.get_all(name)
+        return b', '.join(values) if values else None
+
+    @property
+    def body(self) -> memoryview:
+        """请求体；chunked 且有多块时合并一次，其余情况为原缓冲区切片"""
+        if not self.body_chunks:
+            return memoryview(b'')
+        if len(self.body_chunks) == 1:
+            return self.body_chunks[0]
+        return memoryview(b''.join(self.body_chunks))
+
+    def to_request(self, encoding: str = 'utf-8') -> Dict[str, Any]:
+        """
+        转为 detect_request 使用的请求字典；同名请求头以 ``, `` 合并（Cookie 以 ``; `` 合并）
+
+        带 Content-Encoding 的请求体保留为 bytes，由规则引擎解压后匹配
+        """
+        headers: Dict[str, str] = {}
+        lowered: Dict[str, str] = {}
+        for key, value in self.iter_headers():
+            name = bytes(key).decode('latin-1')
+            text = bytes(value).decode(encoding, 'replace')
+            existing = lowered.get(name.lower())
+            if existing is None:
+                lowered[name.lower()] = name
+                headers[name] = text
+            else:
+                headers[existing] += ('; ' if name.lower() == 'cookie' else ', ') + text
+        path, _, query = self.target.partition('?')
+        encoded = lowered.get('content-encoding') is not None and \
+            headers[lowered['content-encoding']].strip().lower() not in ('', 'identity')
+        return {
+            'method': self.method,
+            'url': self.target,
+            'version': self.version,
+            'headers': headers,
+            'body': bytes(self.body) if encoded else str(self.body, encoding, 'replace'),
+            'path': path.split('#', 1)[0],
+            'query_string': query.split('#', 1)[0],
+        }
+
+
+def _parse_chunked(request: RawHTTPRequest, buf: memoryview, pos: int, lenient: bool):
+    """chunked 分帧：每块的数据记为一个切片，跳过块扩展与尾部字段"""
+    end_of_buffer = len(buf)
+    while True:
+        line_end = _LINE_END.search(buf, pos)
+        if line_end is None:
+            if lenient:
+                request.consumed = end_of_buffer
+                return
+            raise HTTPIncompleteError("chunked 请求体不完整")
+        size_field = bytes(buf[pos:line_end.start()]).split(b';', 1)[0].strip()
+        if not _CHUNK_SIZE.fullmatch(size_field):
+            raise HTTPParseError(f"无效的 chunk 长度: {size_field[:20]!r}")
+        size = int(size_field, 16)
+        pos = line_end.end()
+        if size == 0:
+            # 尾部字段，直到空行
+            while True:
+                line_end = _LINE_END.search(buf, pos)
+                if line_end is None:
+                    if lenient:
+                        request.consumed = end_of_buffer
+                        return
+                    raise HTTPIncompleteError("chunked 尾部字段不完整")
+                blank = line_end.start() == pos
+                pos = line_end.end()
+                if blank:
+                    request.consumed = pos
+                    return
+        data_end = pos + size
+        if data_end > end_of_buffer:
+            if lenient:
+                request.body_chunks.append(buf[pos:end_of_buffer])
+                request.consumed = end_of_buffer
+                return
+            raise HTTPIncompleteError("chunk 数据不完整")
+        request.body_chunks.append(buf[pos:data_end])
+        crlf = _LINE_END.match(buf, data_end)
+        if crlf is None:
+            if data_end == end_of_buffer and lenient:
+                request.consumed = end_of_buffer
+                return
+            if data_end == end_of_buffer:
+                raise HTTPIncompleteError("chunk 数据不完整")
+            raise HTTPParseError("chunk 数据后缺少 CRLF")
+        pos = crlf.end()
+
+
+def parse_http_request(data: BytesLike, offset: int = 0, lenient: bool = False,
+                       max_header_bytes: int = DEFAULT_MAX_HEADER_BYTES) -> RawHTTPRequest:
+    """
+    从 data[offset:] 解析一个HTTP请求
+
+    Args:
+        data: 原始报文；请求头与请求体的切片引用该缓冲区，不复制
+        offset: 起始偏移（解析同一缓冲区中的下一个请求时传入上一个请求的 consumed）
+        lenient: 抓包文件模式：没有空行时整段视为请求头，没有分帧头时剩余部分都是请求体，
+            请求体被截断时按已有数据返回；否则报文不完整时抛出 HTTPIncompleteError
+        max_header_bytes: 请求行与请求头的最大字节数
+
+    Raises:
+        HTTPParseError: 请求行无效、Content-Length 无效或冲突、同时给出 Content-Length 与 chunked
+    """
+    buf = data if isinstance(data, memoryview) else memoryview(data)
+    if buf.ndim != 1 or buf.itemsize != 1:
+        buf = buf.cast('B')
+    size = len(buf)
+    limit = min(size, offset + max_header_bytes)
+
+    terminator = _HEADER_END.search(buf, offset, limit)
+    if terminator is None:
+        if size - offset > max_header_bytes:
+            raise HTTPParseError(f"请求头超过 {max_header_bytes} 字节")
+        if not lenient:
+            raise HTTPIncompleteError("请求头不完整")
+        # 整段都是请求头，末行可能没有换行
+        headers_end = body_start = size
+    else:
+        headers_end, body_start = terminator.start(), terminator.end()
+
+    line_end = _LINE_END.search(buf, offset, headers_end)
+    line_stop = line_end.start() if line_end else headers_end
+    parts = bytes(buf[offset:line_stop]).decode('latin-1').split()
+    if len(parts) < 2 or len(parts) > 3 or not parts[0].isalpha():
+        raise HTTPParseError(f"无效的请求行: {' '.join(parts)[:80]!r}")
+    version = parts[2] if len(parts) == 3 else 'HTTP/1.1'
+    if not version.startswith('HTTP/'):
+        raise HTTPParseError(f"无效的协议版本: {version[:20]!r}")
+
+    spans = []
+    if line_end is not None:
+        start = line_end.end()
+        while start < headers_end:
+            next_end = _LINE_END.search(buf, start, headers_end)
+            stop = next_end.start() if next_end else headers_end
+            if stop > start:
+                match = _HEADER_LINE.match(buf, start, stop)
+                if match is not None:
+                    spans.append(match.span(1) + match.span(2))
+                elif not lenient:
+                    # 包括以空白开头的折行（obs-fold），常被用来让前后端对请求头的理解不一致
+                    raise HTTPParseError(f"无效的请求头行: {bytes(buf[start:min(stop, start + 40)])!r}")
+            if next_end is None:
+                break
+            start = next_end.end()
+
+    request = RawHTTPRequest(buf, parts[0].upper(), parts[1], version, spans, body_start)
+    if body_start >= size and terminator is None:
+        request.consumed = size
+        return request
+
+    transfer_encoding = request.header('transfer-encoding')
+    lengths = set(request.get_all('content-length'))
+    if transfer_encoding is not None:
+        if lengths:
+            raise HTTPParseError("同时指定 Content-Length 与 Transfer-Encoding")
+        if transfer_encoding.rsplit(b',', 1)[-1].strip().lower() != b'chunked':
+            raise HTTPParseError(f"不支持的 Transfer-Encoding: {transfer_encoding[:40]!r}")
+        request.chunked = True
+        _parse_chunked(request, buf, body_start, lenient)
+    elif lengths:
+        values = {value.strip() for value in lengths}
+        if len(values) != 1 or not _DIGITS.fullmatch(next(iter(values))):
+            raise HTTPParseError(f"无效的 Content-Length: {sorted(values)!r}")
+        body_end = body_start + int(next(iter(values)))
+        if body_end > size:
+            if not lenient:
+                raise HTTPIncompleteError("请求体不完整")
+            body_end = size
+        if body_end > body_start:
+            request.body_chunks.append(buf[body_start:body_end])
+        request.consumed = body_end
+    elif lenient and body_start < size:
+        request.body_chunks.append(buf[body_start:size])
+        request.consumed = size
+    else:
+        request.consumed = body_start
+    return request
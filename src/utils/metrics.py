@@ -0,0 +1,292 @@
+"""
+运行指标 - Prometheus 文本格式（exposition format 0.0.4）导出
+计数器与直方图按线程分片：热路径只写当前线程自己的分片，不加锁；
+采集时汇总所有分片，已退出线程的分片折叠进基准值，避免线程池/每请求线程导致分片无限增长。
+多工作进程时请求计数写入共享计数表（SharedCounter），其余指标按进程统计并带 worker 标签。
+"""
+import bisect
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 检测耗时直方图的默认桶（秒）：覆盖 10us - 1s
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                   0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+RELOAD_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], *extra: str) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(pair for pair in extra if pair)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _ShardedMetric:
+    """按线程分片的指标基类，每个分片为 {标签值: [数值...]}"""
+
+    kind = 'untyped'
+    per_process = True
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], width: int):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._width = width
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[weakref.ref, Dict[LabelValues, List[float]]]] = []
+        self._retired: Dict[LabelValues, List[float]] = {}
+
+    def _shard(self) -> Dict[LabelValues, List[float]]:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+        return shard
+
+    def _slot(self, labels: LabelValues) -> List[float]:
+        shard = self._shard()
+        slot = shard.get(labels)
+        if slot is None:
+            slot = shard[labels] = [0.0] * self._width
+        return slot
+
+    @staticmethod
+    def _merge_into(target: Dict[LabelValues, List[float]], shard: Dict[LabelValues, List[float]]):
+        for labels, values in list(shard.items()):
+            slot = target.get(labels)
+            if slot is None:
+                target[labels] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    slot[i] += value
+
+    def collect(self) -> Dict[LabelValues, List[float]]:
+        """汇总所有分片；已退出线程的分片并入基准值后丢弃"""
+        with self._lock:
+            alive = []
+            for thread_ref, shard in self._shards:
+                thread = thread_ref()
+                if thread is None or not thread.is_alive():
+                    self._merge_into(self._retired, shard)
+                else:
+                    alive.append((thread_ref, shard))
+            self._shards = alive
+            total = {labels: list(values) for labels, values in self._retired.items()}
+            for _, shard in alive:
+                self._merge_into(total, shard)
+        return total
+
+    def render(self, extra: str = '') -> List[str]:
+        """extra 为附加在每个样本上的标签（如 worker="pid"）"""
+        raise NotImplementedError
+
+
+class Counter(_ShardedMetric):
+    """单调递增计数器"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames, width=1)
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._slot(labels)[0] += amount
+
+    def value(self, *labels: str) -> float:
+        return self.collect().get(labels, [0.0])[0]
+
+    def render(self, extra: str = '') -> List[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, labels, extra)} {_format_value(values[0])}'
+                for labels, values in sorted(self.collect().items())]
+
+
+class SharedCounter:
+    """
+    跨进程累计的计数器：数值存放在共享计数表（SharedCounters）中，任一工作进程输出的都是所有进程的合计
+
+    计数表中的键为 "指标名|标签值|..."；写入按 SharedCounters 的批量策略，其他进程的增量最多滞后一批。
+    """
+
+    kind = 'counter'
+    per_process = False
+
+    def __init__(self, name: str, documentation: str, counters, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.counters = counters
+        self.labelnames = tuple(labelnames)
+        self._prefix = name + '|'
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.counters.add(self._prefix + '|'.join(labels), amount)
+
+    def value(self, *labels: str) -> float:
+        return float(self.counters.get(self._prefix + '|'.join(labels)))
+
+    def collect(self) -> Dict[LabelValues, List[float]]:
+        total = {}
+        for key, value in self.counters.snapshot().items():
+            if key.startswith(self._prefix):
+                labels = tuple(key[len(self._prefix):].split('|')) if self.labelnames else ()
+                total[labels] = [float(value)]
+        return total
+
+    def render(self, extra: str = '') -> List[str]:
+        # 已是所有进程的合计，不加 worker 标签
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(values[0])}'
+                for labels, values in sorted(self.collect().items())]
+
+
+class Histogram(_ShardedMetric):
+    """直方图：每个分片记录各桶计数（非累积）、总和与样本数"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, width=len(self.buckets) + 3)
+
+    def observe(self, value: float, *labels: str):
+        slot = self._slot(labels)
+        slot[bisect.bisect_left(self.buckets, value)] += 1
+        slot[-2] += value
+        slot[-1] += 1
+
+    def render(self, extra: str = '') -> List[str]:
+        lines = []
+        for labels, values in sorted(self.collect().items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float('inf'),), values[:-2]):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, extra, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{le} {_format_value(cumulative)}')
+            base = _format_labels(self.labelnames, labels, extra)
+            lines.append(f'{self.name}_sum{base} {_format_value(values[-2])}')
+            lines.append(f'{self.name}_count{base} {_format_value(values[-1])}')
+        return lines
+
+
+class CallbackMetric:
+    """采集时调用回调取值的指标（gauge，或由外部累计的 counter）
+
+    回调返回单个数值，或 {标签值元组: 数值}。per_process 为 False 表示回调读的是跨进程共享的值。
+    """
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], object],
+                 labelnames: Sequence[str] = (), kind: str = 'gauge', per_process: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        self.per_process = per_process
+
+    def render(self, extra: str = '') -> List[str]:
+        try:
+            result = self.callback()
+        except Exception:
+            return []
+        if result is None:
+            return []
+        if not isinstance(result, dict):
+            result = {(): result}
+        return [f'{self.name}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}'
+                for labels, value in sorted(result.items())]
+
+
+class MetricsRegistry:
+    """指标注册表，按注册顺序输出
+
+    worker_label 为 True 时（多工作进程），按进程统计的指标带 worker="<pid>" 标签，
+    每次抓取只反映处理该请求的工作进程。
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self.worker_label = False
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name: str, documentation: str, callback: Callable[[], object],
+                       labelnames: Sequence[str] = (), kind: str = 'gauge',
+                       per_process: bool = True) -> CallbackMetric:
+        """注册回调指标；同名指标重复注册时以最后一次为准"""
+        return self.register(CallbackMetric(name, documentation, callback, labelnames, kind, per_process))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        # fork 后才确定 pid，每次输出时读取
+        worker = f'worker="{os.getpid()}"' if self.worker_label else ''
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render(worker if metric.per_process else ''))
+        return '\n'.join(lines) + '\n'
+
+
+class WAFMetrics:
+    """WAF 检测链路指标"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or MetricsRegistry()
+        self.started_at = time.time()
+        r = self.registry
+        self.requests = r.counter('waf_requests_total', '检测请求数（按判定与攻击类别）',
+                                  ('verdict', 'category'))
+        self.stage_seconds = r.histogram('waf_detection_stage_seconds',
+                                         '各检测阶段耗时（normalize/rules_<tier>/dl/total）', ('stage',))
+        self.rule_cache = r.counter('waf_rule_cache_requests_total', '规则匹配缓存查询（hit/miss）',
+                                    ('result',))
+        self.reload_seconds = r.histogram('waf_rule_reload_duration_seconds', '规则加载/重载耗时',
+                                          ('trigger',), buckets=RELOAD_BUCKETS)
+        self.reloads = r.counter('waf_rule_reloads_total', '规则重载次数（published/rejected）',
+                                 ('trigger', 'result'))
+        r.gauge_callback('waf_uptime_seconds', '进程运行时长', lambda: time.time() - self.started_at)
+
+    def use_shared_counters(self, counters):
+        """
+        多工作进程：请求计数改为写入共享计数表，/metrics 输出所有进程的合计；
+        其余指标（检测耗时、缓存、攻击日志等）仍按进程统计，加 worker 标签区分
+        """
+        self.requests = self.registry.register(SharedCounter(
+            'waf_requests_total', self.requests.documentation, counters, self.requests.labelnames))
+        self.registry.worker_label = True
+
+    def observe_stage(self, stage: str, seconds: float):
+        self.stage_seconds.observe(seconds, stage)
+
+    def render(self) -> str:
+        return self.registry.render()
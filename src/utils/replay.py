@@ -0,0 +1,217 @@
+"""
+流量回放 - 读取抓包流量、汇总回放结果、对比两个规则集版本的判定差异
+供 scripts/replay.py 使用；输入支持NDJSON（每行一个请求）与原始HTTP报文
+"""
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from src.utils.benchmark import percentile
+from src.utils.http_parser import HTTPParseError, parse_http_request
+
+logger = logging.getLogger(__name__)
+
+NDJSON_SUFFIXES = ('.jsonl', '.ndjson', '.json')
+# 原始报文文件内多个请求以 ``###`` 开头的行分隔（与常见 .http 文件写法一致）
+RAW_SEPARATOR = re.compile(rb'^###[^\n]*\n?', re.MULTILINE)
+_LEADING_SPACE = re.compile(rb'\s*')
+REPORT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class ReplayRecord(NamedTuple):
+    """单条请求的回放结果；时间均为纳秒"""
+    index: int
+    blocked: bool
+    category: str
+    rule: str
+    latency_ns: int
+    cpu_ns: int
+    lag_ns: int = 0
+
+
+def _request_from_record(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """NDJSON 记录转请求：``raw`` 字段为原始报文，否则取 method/url/headers/body"""
+    raw = record.get('raw')
+    if isinstance(raw, str) and raw.strip():
+        try:
+            request = parse_http_request(raw.lstrip().encode('utf-8'), lenient=True).to_request()
+        except HTTPParseError:
+            return None
+    elif isinstance(record.get('url'), str):
+        request = {
+            'method': record.get('method') or 'GET',
+            'url': record['url'],
+            'headers': record.get('headers') or {},
+            'body': record.get('body') or '',
+        }
+    else:
+        return None
+    if record.get('source_ip'):
+        request['source_ip'] = record['source_ip']
+    return request
+
+
+def iter_ndjson(path: Path, stats: Dict[str, int]) -> Iterator[Dict[str, Any]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"{path}:{line_no} 不是合法的JSON，已跳过")
+                stats['skipped'] += 1
+                continue
+            request = _request_from_record(record) if isinstance(record, dict) else None
+            if request is None:
+                stats['skipped'] += 1
+                continue
+            yield request
+
+
+def iter_raw_http(path: Path, stats: Dict[str, int]) -> Iterator[Dict[str, Any]]:
+    """
+    按 ``###`` 行切分报文，每段在同一缓冲区上解析
+
+    只去掉分隔行之前的那个换行（属于分隔符），请求体末尾的空格、空行等字节原样保留，
+    回放的请求与抓包内容逐字节一致；文件末尾的最后一段不做任何裁剪。
+    """
+    data = path.read_bytes()
+    view = memoryview(data)
+    separators = list(RAW_SEPARATOR.finditer(data))
+    starts = [0] + [m.end() for m in separators]
+    ends = [m.start() for m in separators] + [len(data)]
+    for index, (start, end) in enumerate(zip(starts, ends)):
+        start = _LEADING_SPACE.match(data, start, end).end()
+        if index < len(separators):
+            if data.endswith(b'\r\n', start, end):
+                end -= 2
+            elif data.endswith(b'\n', start, end):
+                end -= 1
+        if start >= end:
+            continue
+        try:
+            yield parse_http_request(view[start:end], lenient=True).to_request()
+        except HTTPParseError as e:
+            logger.warning(f"{path} 中存在无法解析的HTTP报文，已跳过: {e}")
+            stats['skipped'] += 1
+
+
+def _expand(paths: Iterable[str]) -> Iterator[Path]:
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(p for p in path.rglob('*') if p.is_file())
+        else:
+            yield path
+
+
+def load_traffic(paths: Iterable[str], limit: Optional[int] = None,
+                 stats: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+    """
+    读取抓包流量
+
+    目录按文件名排序展开；.jsonl/.ndjson/.json 按NDJSON读取，其余文件视为原始HTTP报文。
+
+    Args:
+        paths: 文件或目录路径
+        limit: 最多读取的请求数
+        stats: 可选的计数字典，累计 records/skipped
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault('records', 0)
+    stats.setdefault('skipped', 0)
+    requests = []
+    for path in _expand(paths):
+        reader = iter_ndjson if path.suffix.lower() in NDJSON_SUFFIXES else iter_raw_http
+        for request in reader(path, stats):
+            requests.append(request)
+            if limit is not None and len(requests) >= limit:
+                stats['records'] = len(requests)
+                return requests
+    stats['records'] = len(requests)
+    return requests
+
+
+def _latency_summary(values_ns: List[int]) -> Dict[str, float]:
+    values = sorted(values_ns)
+    summary = {f'p{q:g}': round(percentile(values, q) / 1000, 1) for q in REPORT_PERCENTILES}
+    summary['max'] = round(values[-1] / 1000, 1) if values else 0.0
+    return summary
+
+
+def summarize_replay(records: List[ReplayRecord], wall_seconds: float) -> Dict[str, Any]:
+    """
+    汇总一轮回放
+
+    ``latency_us`` 为检测本身耗时；按目标速率回放时 ``response_us`` 额外计入排队延迟
+    （请求计划发出时刻到检测完成），避免速率跟不上时低估延迟。
+    """
+    total = len(records)
+    cpu_total = sum(r.cpu_ns for r in records) or 1
+    by_category: Dict[str, Dict[str, float]] = {}
+    for record in records:
+        entry = by_category.setdefault(record.category, {'requests': 0, 'cpu_ns': 0})
+        entry['requests'] += 1
+        entry['cpu_ns'] += record.cpu_ns
+    cpu_by_category = {
+        category: {
+            'requests': entry['requests'],
+            'cpu_ms': round(entry['cpu_ns'] / 1e6, 3),
+            'cpu_us_per_request': round(entry['cpu_ns'] / entry['requests'] / 1000, 1),
+            'cpu_share': round(entry['cpu_ns'] / cpu_total, 4),
+        }
+        for category, entry in sorted(by_category.items(), key=lambda item: -item[1]['cpu_ns'])
+    }
+    summary = {
+        'requests': total,
+        'blocked': sum(1 for r in records if r.blocked),
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(total / wall_seconds, 1) if wall_seconds > 0 else 0.0,
+        'cpu_seconds': round(sum(r.cpu_ns for r in records) / 1e9, 3),
+        'latency_us': _latency_summary([r.latency_ns for r in records]),
+        'cpu_by_category': cpu_by_category,
+    }
+    if any(r.lag_ns for r in records):
+        summary['response_us'] = _latency_summary([r.latency_ns + r.lag_ns for r in records])
+    return summary
+
+
+def diff_verdicts(requests: List[Dict[str, Any]], baseline: List[ReplayRecord],
+                  candidate: List[ReplayRecord], max_samples: int = 20) -> Dict[str, Any]:
+    """按请求序号对比两个规则集版本的判定，统计新增拦截、新增放行与类别变化"""
+    candidate_by_index = {r.index: r for r in candidate}
+    counts = {'newly_blocked': 0, 'newly_allowed': 0, 'category_changed': 0}
+    transitions: Dict[str, int] = {}
+    samples = []
+    for before in baseline:
+        after = candidate_by_index.get(before.index)
+        if after is None or (before.blocked, before.category) == (after.blocked, after.category):
+            continue
+        if after.blocked and not before.blocked:
+            kind = 'newly_blocked'
+        elif before.blocked and not after.blocked:
+            kind = 'newly_allowed'
+        else:
+            kind = 'category_changed'
+        counts[kind] += 1
+        key = f'{before.category} -> {after.category}'
+        transitions[key] = transitions.get(key, 0) + 1
+        if len(samples) < max_samples:
+            request = requests[before.index]
+            samples.append({
+                'index': before.index, 'kind': kind,
+                'method': request.get('method', ''), 'url': request.get('url', ''),
+                'baseline': {'blocked': before.blocked, 'category': before.category, 'rule': before.rule},
+                'candidate': {'blocked': after.blocked, 'category': after.category, 'rule': after.rule},
+            })
+    return {
+        'compared': len(baseline),
+        'changed': sum(counts.values()),
+        **counts,
+        'transitions': dict(sorted(transitions.items(), key=lambda item: -item[1])),
+        'samples': samples,
+    }
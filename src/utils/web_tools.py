@@ -1,11 +1,22 @@
 """
 Web工具函数 - 请求解析、响应生成等
 """
+import html
 import re
-from typing import Dict, Any, Tuple, List
-from urllib.parse import urlparse, parse_qs, parse_qsl, unquote, urlencode
+from typing import Dict, Any, Tuple, List, Optional
+from urllib.parse import urlparse, parse_qs, unquote, urlencode
 import json
 
+from src.utils.body_parser import BodyParseError, iter_multipart, parse_boundary
+
+# 解码后的 URL 含这些内容时交给 urlparse 处理（scheme、netloc、fragment、控制字符等）
+_URL_NEEDS_PARSE = re.compile(r'[:#\t\r\n]|^//|^[\x00- ]')
+
+# 多层解码：百分号转义、\xNN / \uNNNN 转义
+_PERCENT_ESCAPE = re.compile(r'%[0-9a-fA-F]{2}')
+_BACKSLASH_ESCAPE = re.compile(r'\\(?:x([0-9a-fA-F]{2})|u([0-9a-fA-F]{4}))')
+DEFAULT_DECODE_DEPTH = 3
+
 
 class HTTPRequestParser:
     """HTTP请求解析器"""
@@ -35,8 +46,8 @@ class HTTPRequestParser:
             'body': ''
         }
         
-        # 解析请求头和body
-        header_end = 1
+        # 解析请求头和body（没有空行分隔时整段均为请求头）
+        header_end = len(lines)
         for i in range(1, len(lines)):
             line = lines[i].strip()
             if line == '':
@@ -77,6 +88,20 @@ class HTTPRequestParser:
             except:
                 return {}
         
+        elif 'multipart/form-data' in content_type:
+            boundary = parse_boundary(content_type)
+            data = {}
+            try:
+                for part in iter_multipart(body, boundary) if boundary else ():
+                    if part.is_file:
+                        data[part.name] = {'filename': part.filenames[0], 'content_type': part.content_type,
+                                           'size': part.size}
+                    else:
+                        data[part.name] = part.value()
+            except BodyParseError:
+                return {}
+            return data
+
         elif 'application/x-www-form-urlencoded' in content_type:
             data = {}
             for pair in body.split('&'):
@@ -87,35 +112,100 @@ class HTTPRequestParser:
         
         return {}
 
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """请求体及其字段的规范化：百分号解码，连续空白折叠为单个空格，小写"""
+        if type(text) is not str or '%' in text:
+            text = unquote(text)
+        return ' '.join(text.split()).lower()
+
+    @staticmethod
+    def parse_cookies(cookie_header: str) -> List[Tuple[str, str]]:
+        """
+        解析 Cookie 头为 (名, 值) 列表，保留顺序与重名项
+
+        不做解码；没有 ``=`` 的片段按浏览器的处理方式视为名为空的值。
+        """
+        cookies = []
+        for part in cookie_header.split(';'):
+            name, sep, value = part.partition('=')
+            if not sep:
+                name, value = '', name
+            name, value = name.strip(), value.strip()
+            if name or value:
+                cookies.append((name, value))
+        return cookies
+
+    @staticmethod
+    def request_text(request: Dict[str, Any]) -> str:
+        """拼接请求的文本表示（方法 URL 请求体），供DL推理与训练共用"""
+        return ' '.join([
+            str(request.get('method', '') or ''),
+            str(request.get('url', '') or ''),
+            str(request.get('body', '') or ''),
+        ])
+
     @staticmethod
     def normalize_request(request: Dict[str, Any]) -> Dict[str, Any]:
-        """对请求做统一规范化，减少规则重复覆盖。"""
+        """
+        对请求做统一规范化，减少规则重复覆盖
+
+        - URL: 百分号解码，去掉 fragment/params，查询参数再解码一次（``+`` 视为空格）后按键值排序
+        - body: 百分号解码，连续空白折叠为单个空格并去掉首尾空白
+        - URL、查询串、path、body 统一小写；请求头名小写、值去掉首尾空白
+
+        常见请求只做一遍必要的处理：不含 ``%`` 的字段跳过解码，普通路径不经过 urlparse，
+        path 只小写一次并复用到 url。
+        """
         url = request.get('url', '') or ''
         method = (request.get('method', '') or 'GET').upper()
         headers = request.get('headers', {}) or {}
         body = request.get('body', '') or ''
 
-        # URL 解码 + 解析 + 参数排序（保持解码后的可读形态）
-        decoded_url = unquote(url)
-        parsed = urlparse(decoded_url)
-        query_pairs = parse_qsl(parsed.query, keep_blank_values=True)
-        query_pairs.sort(key=lambda x: (x[0], x[1]))
-        normalized_query = '&'.join([f"{k}={v}" for k, v in query_pairs])
-        normalized_url = parsed.path
+        # URL 解码 + 拆分 path/query（保持解码后的可读形态）
+        decoded_url = unquote(url) if type(url) is not str or '%' in url else url
+        path, _, query = decoded_url.partition('?')
+        if ';' in path or _URL_NEEDS_PARSE.search(decoded_url):
+            parsed = urlparse(decoded_url)
+            path, query = parsed.path, parsed.query
+
+        # 查询参数：与 parse_qsl(keep_blank_values=True) 一致地切分、解码，再排序
+        if query:
+            query_pairs = []
+            for field in query.split('&'):
+                if not field:
+                    continue
+                name, _, value = field.partition('=')
+                if '+' in field or '%' in field:
+                    name = unquote(name.replace('+', ' '))
+                    value = unquote(value.replace('+', ' '))
+                query_pairs.append((name, value))
+            if len(query_pairs) > 1:
+                query_pairs.sort()
+            normalized_query = '&'.join([f"{k}={v}" for k, v in query_pairs])
+        else:
+            normalized_query = ''
+
+        path_lower = path.lower()
         if normalized_query:
-            normalized_url = f"{normalized_url}?{normalized_query}"
+            query_lower = normalized_query.lower()
+            url_lower = f"{path_lower}?{query_lower}"
+        else:
+            query_lower = ''
+            url_lower = path_lower
 
         # 统一大小写与空白
-        normalized_body = re.sub(r'\s+', ' ', unquote(body)).strip().lower()
-        normalized_headers = {str(k).lower(): str(v).strip() for k, v in headers.items()}
+        if body:
+            body = HTTPRequestParser.normalize_text(body)
+        normalized_headers = {str(k).lower(): str(v).strip() for k, v in headers.items()} if headers else {}
 
         return {
             'method': method,
-            'url': normalized_url.lower(),
+            'url': url_lower,
             'headers': normalized_headers,
-            'body': normalized_body,
-            'query_string': normalized_query.lower(),
-            'path': parsed.path.lower(),
+            'body': body,
+            'query_string': query_lower,
+            'path': path_lower,
         }
 
 
@@ -133,6 +223,44 @@ class URLDecoder:
             'unicode_encoded': bool(re.search(r'\\u[0-9a-fA-F]{4}', text))
         }
         return encoding_types
+
+    @staticmethod
+    def decode_layer(text: str) -> str:
+        """
+        解码一层：百分号转义、HTML实体、\\xNN / \\uNNNN 转义
+
+        每种编码先用字符检查（``%``、``&``、``\\``）跳过不适用的层，普通文本几乎零开销。
+        """
+        if '%' in text and _PERCENT_ESCAPE.search(text):
+            text = unquote(text)
+        if '&' in text:
+            text = html.unescape(text)
+        if '\\' in text:
+            text = _BACKSLASH_ESCAPE.sub(lambda m: chr(int(m.group(1) or m.group(2), 16)), text)
+        return text
+
+    @staticmethod
+    def canonicalize(text: str, max_depth: int = DEFAULT_DECODE_DEPTH,
+                     memo: Optional[Dict[str, str]] = None) -> str:
+        """
+        逐层解码直到不再变化（最多 max_depth 层），得到规范形式
+
+        可应对 ``%252e%252e``、``&#x3c;``、``\\x3c`` 等多重/混合编码。
+        memo 为单个请求内的解码缓存，同一文本只解码一次。
+        """
+        if memo is not None:
+            cached = memo.get(text)
+            if cached is not None:
+                return cached
+        current = text
+        for _ in range(max_depth):
+            decoded = URLDecoder.decode_layer(current)
+            if decoded == current:
+                break
+            current = decoded
+        if memo is not None:
+            memo[text] = current
+        return current
     
     @staticmethod
     def decode_all(text: str) -> Dict[str, str]:
@@ -146,7 +274,6 @@ class URLDecoder:
         
         # HTML实体解码
         try:
-            import html
             decoded['html_decoded'] = html.unescape(text)
         except:
             decoded['html_decoded'] = text
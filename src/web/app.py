@@ -2,7 +2,7 @@
 Web管理界面 - Flask应用
 客户端请求监控和规则管理
 """
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file
 from flask_cors import CORS
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -15,6 +15,15 @@ import threading
 import subprocess
 import shlex
 import sys
+import time
+import ipaddress
+import os
+
+from src.core.ban_list import BanList, SharedBanList
+from src.core.rate_limiter import RateLimiter
+from src.core.shared_state import SharedState
+from src.core.whitelist import Whitelist
+from src.utils.metrics import WAFMetrics
 
 logger = logging.getLogger(__name__)
 
@@ -103,8 +112,15 @@ class AttackLog:
 class WAFWebApp:
     """WAF Web应用"""
     
-    def __init__(self, config_path: str = "config/settings.yaml"):
-        """初始化Web应用"""
+    def __init__(self, config_path: str = "config/settings.yaml", rule_engine=None, metrics=None,
+                 shared_state=None):
+        """初始化Web应用
+        
+        Args:
+            rule_engine: 共享的规则引擎实例；未提供时自行创建
+            metrics: 共享的 WAFMetrics；未提供时自行创建，经 /metrics 导出
+            shared_state: 跨进程共享状态；未提供时按配置 shared_state.enabled 创建
+        """
         # 使用绝对路径确保模板和静态文件能被找到
         base_dir = Path(__file__).parent
         self.app = Flask(__name__, 
@@ -114,9 +130,14 @@ class WAFWebApp:
         
         self.config_path = Path(config_path)
         self.attack_log = AttackLog()
-        self.whitelist = set()
-        self.blacklist = set()
-        self.rule_engine = None
+        self.whitelist = Whitelist()
+        self.whitelist_enabled = True
+        self.blacklist = BanList()
+        self.rate_limiter = None  # 未启用限流时为 None
+        self.shared_state = shared_state  # 启用 shared_state 时由 load_config 创建，须在 fork 工作进程之前
+        self.rule_engine = rule_engine
+        self.metrics = metrics or WAFMetrics()
+        self.model_registry = None  # 启用DL异常检测时由 WAFSystem 注入
         self.mode = 'protection'
         self.proxy_process = None
         
@@ -137,25 +158,84 @@ class WAFWebApp:
                 config = yaml.safe_load(f) or {}
             
             # 加载白名单
-            whitelist_file = config.get('whitelist', {}).get('file')
+            whitelist_config = config.get('whitelist', {}) or {}
+            self.whitelist_enabled = bool(whitelist_config.get('enabled', True))
+            whitelist_file = whitelist_config.get('file')
             if whitelist_file and Path(whitelist_file).exists():
                 with open(whitelist_file, 'r', encoding='utf-8') as f:
                     whitelist_data = yaml.safe_load(f) or {}
-                    self.whitelist = set(whitelist_data.get('whitelist_ips', []))
-                    self.whitelist.update(whitelist_data.get('whitelist_paths', []))
+                    self.whitelist = Whitelist(list(whitelist_data.get('whitelist_ips') or []) +
+                                               list(whitelist_data.get('whitelist_paths') or []))
             
             logger.info(f"加载白名单: {len(self.whitelist)} 条")
+
+            # 跨进程共享状态：封禁、拦截计数与限流令牌桶
+            shared_config = config.get('shared_state', {}) or {}
+            if self.shared_state is None:
+                self.shared_state = SharedState.from_config(shared_config)
+                if self.shared_state is not None:
+                    logger.info(f"启用共享内存状态: 条带 {self.shared_state.stripes}")
+            if self.shared_state is not None:
+                # 请求计数跨进程累计；攻击日志与其余指标仍按工作进程各自统计
+                self.metrics.use_shared_counters(self.shared_state.counters)
+
+            # 封禁名单（自动封禁参数）
+            blocking = config.get('blocking', {}) or {}
+            ban_options = dict(auto_ban=bool(blocking.get('auto_ban', False)),
+                               threshold=blocking.get('ban_threshold', 10),
+                               window_seconds=blocking.get('ban_window_seconds', 60),
+                               ban_seconds=blocking.get('ban_seconds', 600))
+            if self.shared_state is not None:
+                self.blacklist = SharedBanList(self.shared_state, slots=int(shared_config.get('ban_slots', 65536)),
+                                               **ban_options)
+            else:
+                self.blacklist = BanList(**ban_options)
+
+            # 限流
+            self.rate_limiter = RateLimiter.from_config(config.get('rate_limit'), shared=self.shared_state)
+            if self.rate_limiter is not None:
+                logger.info(f"加载限流规则: {len(self.rate_limiter.rules)} 条")
         except Exception as e:
             logger.error(f"加载配置失败: {e}")
     
+    def _add_whitelist_item(self, item: str):
+        """添加白名单条目：只在前缀树上插入节点，立即对检测生效"""
+        try:
+            self.whitelist.add(item)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        logger.info(f"添加白名单: {item}")
+        return jsonify({'status': 'success', 'item': item.strip()})
+
     def setup_routes(self):
         """设置路由"""
-        # 初始化规则引擎实例，供 UI 使用
-        try:
-            from src.core.rule_engine import RuleEngine
-            self.rule_engine = RuleEngine(self.config_path)
-        except Exception:
-            self.rule_engine = None
+        # 初始化规则引擎实例，供 UI 使用（由 WAFSystem 传入时与检测共用同一实例）
+        if self.rule_engine is None:
+            try:
+                from src.core.rule_engine import RuleEngine
+                self.rule_engine = RuleEngine(self.config_path)
+            except Exception:
+                self.rule_engine = None
+        if self.rule_engine is not None and self.rule_engine.metrics is None:
+            self.rule_engine.attach_metrics(self.metrics)
+        self.metrics.registry.gauge_callback('waf_attack_log_depth', '内存攻击日志队列当前条数',
+                                             lambda: len(self.attack_log.logs))
+        self.metrics.registry.gauge_callback('waf_attack_log_capacity', '内存攻击日志队列容量',
+                                             lambda: self.attack_log.logs.maxlen)
+        # 封禁与限流计数在启用共享状态时已是所有进程的合计
+        shared = self.shared_state is not None
+        self.metrics.registry.gauge_callback('waf_bans_active', '当前生效的封禁数', lambda: len(self.blacklist),
+                                             per_process=not shared)
+        self.metrics.registry.gauge_callback('waf_ban_hits_total', '被封禁来源的请求数',
+                                             lambda: self.blacklist.stats.hits, kind='counter',
+                                             per_process=not shared)
+        self.metrics.registry.gauge_callback('waf_auto_bans_total', '自动封禁次数',
+                                             lambda: self.blacklist.stats.auto_bans, kind='counter',
+                                             per_process=not shared)
+        self.metrics.registry.gauge_callback(
+            'waf_rate_limited_total', '被限流拒绝的请求数（按限流规则）',
+            lambda: {(name,): count for name, count in self.rate_limiter.rejected.items()}
+            if self.rate_limiter else {}, ('rule',), kind='counter', per_process=not shared)
         
         @self.app.route('/')
         def index():
@@ -175,6 +255,9 @@ class WAFWebApp:
             """获取统计信息"""
             hours = request.args.get('hours', 24, type=int)
             stats = self.attack_log.get_stats(hours=hours)
+            if self.shared_state is not None:
+                # 多工作进程时攻击日志按进程保存，标明统计来自哪个进程
+                stats['worker_pid'] = os.getpid()
             return jsonify(stats)
         
         @self.app.route('/api/logs', methods=['GET'])
@@ -186,7 +269,10 @@ class WAFWebApp:
             log_type = request.args.get('type', None)
             
             logs = self.attack_log.get_logs(limit=limit, filter_type=log_type)
-            return jsonify({'logs': logs, 'count': len(logs)})
+            result = {'logs': logs, 'count': len(logs)}
+            if self.shared_state is not None:
+                result['worker_pid'] = os.getpid()
+            return jsonify(result)
         
         @self.app.route('/api/logs', methods=['POST'])
         def add_log():
@@ -213,12 +299,61 @@ class WAFWebApp:
                     return jsonify({'status': 'error', 'message': str(e)}), 500
             return jsonify({'status': 'error', 'message': 'rule engine not available'}), 500
         
+        @self.app.route('/api/rules/profile', methods=['GET'])
+        def get_rule_profile():
+            """规则命中与耗时剖析，支持 sort=cost|avg|hits|evaluations|name 与 limit"""
+            if not self.rule_engine:
+                return jsonify({'status': 'error', 'message': 'rule engine not available'}), 500
+            limit = request.args.get('limit', None, type=int)
+            try:
+                profile = self.rule_engine.get_rule_profile(sort_by=request.args.get('sort', 'cost'),
+                                                            limit=limit)
+            except ValueError as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 400
+            return jsonify(profile)
+        
+        @self.app.route('/api/rules/profile/reset', methods=['POST'])
+        def reset_rule_profile():
+            """清零规则剖析计数"""
+            if not self.rule_engine:
+                return jsonify({'status': 'error', 'message': 'rule engine not available'}), 500
+            self.rule_engine.reset_rule_profile()
+            return jsonify({'status': 'success'})
+        
+        @self.app.route('/api/model/reload', methods=['POST'])
+        def reload_model():
+            """后台热更新DL模型（加载配置中的检查点，校验通过后原子切换）"""
+            if not self.model_registry:
+                return jsonify({'status': 'error', 'message': 'model registry not available'}), 500
+            data = request.get_json(silent=True) or {}
+            if data.get('wait'):
+                try:
+                    report = self.model_registry.reload()
+                    return jsonify({'status': 'success', 'validation': report,
+                                    'model': self.model_registry.get_status()})
+                except Exception as e:
+                    return jsonify({'status': 'error', 'message': str(e)}), 500
+            if not self.model_registry.reload_async():
+                return jsonify({'status': 'error', 'message': 'model reload already in progress'}), 409
+            return jsonify({'status': 'accepted', 'model': self.model_registry.get_status()}), 202
+        
+        @self.app.route('/api/model/status', methods=['GET'])
+        def model_status():
+            """DL模型注册表状态"""
+            if not self.model_registry:
+                return jsonify({'status': 'disabled'})
+            return jsonify(self.model_registry.get_status())
+        
         @self.app.route('/api/whitelist', methods=['GET'])
         def get_whitelist():
             """获取白名单"""
+            stats = self.whitelist.get_stats()
             return jsonify({
                 'whitelist': list(self.whitelist),
-                'count': len(self.whitelist)
+                'count': stats['total'],
+                'ips': stats['ips'],
+                'paths': stats['paths'],
+                'enabled': self.whitelist_enabled
             })
         
         @self.app.route('/api/whitelist', methods=['POST'])
@@ -238,12 +373,11 @@ class WAFWebApp:
                 except Exception:
                     data = {}
 
-            # 支持多种字段名：item、ip
-            item = data.get('item') or data.get('ip') or None
+            # 支持多种字段名：item、ip、value
+            item = data.get('item') or data.get('ip') or data.get('value') or None
 
             if item:
-                self.whitelist.add(item)
-                return jsonify({'status': 'success', 'item': item})
+                return self._add_whitelist_item(item)
 
             # 尝试解析原始请求体（例如 tests 中使用的原始字符串 data="ip=..."）
             raw = request.get_data(as_text=True) or ''
@@ -251,19 +385,59 @@ class WAFWebApp:
                 try:
                     k, v = raw.split('=', 1)
                     if k.strip() in ('ip', 'item') and v:
-                        self.whitelist.add(v.strip())
-                        return jsonify({'status': 'success', 'item': v.strip()})
+                        return self._add_whitelist_item(v.strip())
                 except Exception:
                     pass
 
             return jsonify({'status': 'error', 'message': 'Invalid item'}), 400
         
-        @self.app.route('/api/whitelist/<item>', methods=['DELETE'])
-        def remove_whitelist(item):
-            """移除白名单项"""
+        @self.app.route('/api/whitelist', methods=['DELETE'])
+        @self.app.route('/api/whitelist/<path:item>', methods=['DELETE'])
+        def remove_whitelist(item=None):
+            """移除白名单项；条目可放在路径中，含 / 的网段或路径也可用 ?item= 传入（路径条目的前导 / 可省略）"""
+            item = item or request.args.get('item') or request.args.get('value') or ''
+            if item not in self.whitelist and '/' + item in self.whitelist:
+                item = '/' + item
             self.whitelist.discard(item)
             return jsonify({'status': 'success'})
 
+        @self.app.route('/api/blacklist', methods=['GET'])
+        def get_blacklist():
+            """封禁名单与命中统计"""
+            return jsonify({'bans': self.blacklist.list_bans(), 'stats': self.blacklist.get_stats()})
+
+        @self.app.route('/api/blacklist', methods=['POST'])
+        def add_blacklist():
+            """手动封禁：{"ip": "...", "ttl_seconds": 600, "reason": "..."}，ttl_seconds 缺省或为 0 时永久封禁"""
+            data = request.get_json(silent=True) or request.form.to_dict() or {}
+            ip = str(data.get('ip') or data.get('item') or '').strip()
+            try:
+                ipaddress.ip_address(ip)
+                ttl = float(data.get('ttl_seconds') or 0)
+            except ValueError:
+                return jsonify({'status': 'error', 'message': 'Invalid ip or ttl_seconds'}), 400
+            if ttl < 0:
+                return jsonify({'status': 'error', 'message': 'ttl_seconds must be >= 0'}), 400
+            entry = self.blacklist.ban(ip, ttl, data.get('reason') or '手动封禁')
+            logger.info(f"封禁 {ip} ({'永久' if not ttl else f'{ttl:g}s'})")
+            return jsonify({'status': 'success', 'ban': entry.to_dict(time.monotonic())})
+
+        @self.app.route('/api/blacklist', methods=['DELETE'])
+        @self.app.route('/api/blacklist/<item>', methods=['DELETE'])
+        def remove_blacklist(item=None):
+            """解除封禁（IPv6 地址也可用 ?item= 传入）"""
+            item = item or request.args.get('item') or ''
+            if not self.blacklist.unban(item):
+                return jsonify({'status': 'error', 'message': 'Not banned'}), 404
+            return jsonify({'status': 'success'})
+
+        @self.app.route('/api/ratelimit', methods=['GET'])
+        def get_rate_limit():
+            """限流规则与拒绝统计"""
+            if self.rate_limiter is None:
+                return jsonify({'enabled': False})
+            return jsonify({'enabled': True, **self.rate_limiter.get_stats()})
+
         @self.app.route('/api/deploy/mode', methods=['POST'])
         def set_mode():
             data = request.get_json() or {}
@@ -319,6 +493,12 @@ class WAFWebApp:
                 pid = self.proxy_process.pid
             return jsonify({'mode': self.mode, 'proxy': {'status': proxy_status, 'pid': pid}})
         
+        @self.app.route('/metrics', methods=['GET'])
+        def metrics():
+            """Prometheus 文本格式指标"""
+            return Response(self.metrics.render(), mimetype='text/plain',
+                            content_type=WAFMetrics.CONTENT_TYPE)
+        
         @self.app.route('/api/health', methods=['GET'])
         def health_check():
             """健康检查"""
@@ -0,0 +1,314 @@
+"""
+多进程服务 - pre-fork 主进程 + 多个工作进程共享监听 socket
+- 主进程先完成规则引擎等的加载再 fork，工作进程以写时复制方式共享已编译的规则；fork 前 gc.freeze()，
+  避免垃圾回收改写对象头导致共享页被复制
+- 工作进程崩溃后自动补齐；常驻内存（RSS）超过上限的工作进程先启动替代进程再优雅退出
+- SIGHUP: 调用 on_reload（重新加载规则）后逐个滚动重启工作进程，新进程就绪后旧进程才停止接受连接，
+  监听 socket 始终由主进程持有，等待中的连接留在内核队列里，不会被拒绝
+- SIGTERM/SIGINT: 所有工作进程处理完进行中的请求后退出，超过 timeout 强制结束
+仅支持提供 os.fork 的平台（Linux/macOS）。
+"""
+import gc
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from werkzeug.serving import make_server
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKLOG = 2048
+# 工作进程启动后这么久内退出视为启动失败，连续失败时补齐间隔按指数退避
+MIN_WORKER_LIFETIME = 2.0
+MAX_RESPAWN_DELAY = 30.0
+# 非优雅退出（启动超时）时 SIGTERM 后等待这么久再 SIGKILL；SIGKILL 的进程不会释放持有的共享表条带锁
+KILL_GRACE_SECONDS = 5.0
+
+
+def worker_rss(pid: int) -> Optional[int]:
+    """进程的常驻内存字节数；读不到 /proc 时返回 None"""
+    try:
+        with open(f'/proc/{pid}/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@dataclass
+class _Worker:
+    pid: int
+    started_at: float
+    retire_deadline: Optional[float] = None  # 已发送 SIGTERM 时的强制结束时刻
+
+
+class WorkerSupervisor:
+    """
+    pre-fork 主进程
+
+    Args:
+        app: WSGI 应用（Flask app），在主进程中已完成初始化
+        workers: 工作进程数
+        timeout: 工作进程优雅退出（处理完进行中的请求）的最长等待秒数，也是新工作进程就绪的最长等待
+        max_memory_bytes: 工作进程 RSS 上限，0 为不限
+        on_reload: SIGHUP 时在主进程中调用（重新加载规则等），之后再滚动重启
+        post_fork: 工作进程 fork 后、开始服务前调用（启动后台线程等）
+        on_worker_exit: 工作进程退出前调用（写入共享计数等）
+    """
+
+    def __init__(self, app, host: str = '0.0.0.0', port: int = 8080, workers: int = 2, timeout: float = 30,
+                 max_memory_bytes: int = 0, on_reload: Optional[Callable[[], None]] = None,
+                 post_fork: Optional[Callable[[], None]] = None, on_worker_exit: Optional[Callable[[], None]] = None,
+                 check_interval: float = 1.0, backlog: int = DEFAULT_BACKLOG):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = max(1, int(workers))
+        self.timeout = float(timeout)
+        self.max_memory_bytes = int(max_memory_bytes or 0)
+        self.on_reload = on_reload
+        self.post_fork = post_fork
+        self.on_worker_exit = on_worker_exit
+        self.check_interval = check_interval
+        self.backlog = backlog
+        self.socket: Optional[socket.socket] = None
+        self.workers: Dict[int, _Worker] = {}
+        self.retiring: Dict[int, _Worker] = {}
+        self.restarts = {'crashed': 0, 'memory': 0, 'reload': 0}
+        self._failures = 0
+        self._stopping = False
+        self._reload_requested = False
+        self._wakeup_r = self._wakeup_w = None
+
+    # ---- 主进程 ----
+
+    def bind(self) -> socket.socket:
+        sock = socket.create_server((self.host, self.port), backlog=self.backlog, reuse_port=False)
+        sock.set_inheritable(True)
+        self.socket = sock
+        self.port = sock.getsockname()[1]
+        return sock
+
+    def _install_signals(self):
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+        signal.set_wakeup_fd(self._wakeup_w)
+        signal.signal(signal.SIGHUP, self._request_reload)
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        # 只用于唤醒主循环，回收由 _reap 完成
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    def _request_reload(self, signum, frame):
+        self._reload_requested = True
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def run(self):
+        """阻塞运行直到收到 SIGTERM/SIGINT"""
+        if self.socket is None:
+            self.bind()
+        self._install_signals()
+        logger.info(f"主进程 {os.getpid()} 监听 {self.host}:{self.port}，启动 {self.num_workers} 个工作进程")
+        # 之后创建的对象不再被追踪扫描，已加载的规则等留在共享页中
+        gc.collect()
+        gc.freeze()
+        try:
+            for _ in range(self.num_workers):
+                self._spawn()
+            while not self._stopping:
+                self._wait(self.check_interval)
+                self._reap()
+                if self._stopping:
+                    break
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self._rolling_restart()
+                self._check_memory()
+                self._kill_overdue()
+                self._maintain()
+        finally:
+            self._shutdown()
+
+    def _wait(self, seconds: float):
+        try:
+            readable, _, _ = select.select([self._wakeup_r], [], [], seconds)
+        except InterruptedError:
+            return
+        if readable:
+            try:
+                os.read(self._wakeup_r, 4096)
+            except BlockingIOError:
+                pass
+
+    def _spawn(self) -> Optional[int]:
+        """fork 一个工作进程并等待其就绪；超时未就绪时结束它并返回 None"""
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            self._worker_main(ready_w)  # 不返回
+        os.close(ready_w)
+        worker = self.workers[pid] = _Worker(pid, time.monotonic())
+        try:
+            readable, _, _ = select.select([ready_r], [], [], self.timeout)
+            ready = bool(readable) and os.read(ready_r, 1) == b'1'
+        except InterruptedError:
+            ready = False
+        finally:
+            os.close(ready_r)
+        if not ready:
+            logger.error(f"工作进程 {pid} 未能在 {self.timeout:g}s 内就绪")
+            self._retire(worker, graceful=False)
+            return None
+        logger.info(f"工作进程 {pid} 已就绪")
+        return pid
+
+    def _retire(self, worker: _Worker, graceful: bool = True):
+        """
+        让工作进程退出：始终先发 SIGTERM，优雅退出时等待处理完进行中的请求（最长 timeout），
+        否则等待 KILL_GRACE_SECONDS；超时后由 _kill_overdue 发 SIGKILL
+        """
+        self.workers.pop(worker.pid, None)
+        worker.retire_deadline = time.monotonic() + (self.timeout if graceful else min(self.timeout, KILL_GRACE_SECONDS))
+        self.retiring[worker.pid] = worker
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _replace(self, worker: _Worker, reason: str):
+        """先启动替代进程再让旧进程退出，服务能力不下降"""
+        if self._spawn() is not None:
+            self.restarts[reason] += 1
+            self._retire(worker)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.retiring.pop(pid, None) is not None:
+                continue
+            worker = self.workers.pop(pid, None)
+            if worker is None or self._stopping:
+                continue
+            lifetime = time.monotonic() - worker.started_at
+            self._failures = self._failures + 1 if lifetime < MIN_WORKER_LIFETIME else 0
+            self.restarts['crashed'] += 1
+            logger.error(f"工作进程 {pid} 意外退出（状态 {os.waitstatus_to_exitcode(status)}，"
+                         f"运行 {lifetime:.1f}s），重新启动")
+
+    def _maintain(self):
+        """补齐工作进程；连续启动即退出时按指数退避，避免 fork 风暴"""
+        while len(self.workers) < self.num_workers and not self._stopping:
+            if self._failures:
+                delay = min(MAX_RESPAWN_DELAY, 0.5 * 2 ** (self._failures - 1))
+                self._wait(delay)
+                self._reap()
+                if self._stopping:
+                    return
+            if self._spawn() is None:
+                self._failures += 1
+
+    def _rolling_restart(self):
+        logger.info("收到 SIGHUP：重新加载后滚动重启工作进程")
+        if self.on_reload is not None:
+            try:
+                self.on_reload()
+            except Exception as e:
+                # 加载失败时继续使用当前状态重启，工作进程不会因此中断
+                logger.error(f"重新加载失败，沿用当前状态: {e}", exc_info=True)
+            gc.collect()
+            gc.freeze()
+        for worker in list(self.workers.values()):
+            if self._stopping:
+                return
+            self._replace(worker, 'reload')
+            self._reap()
+
+    def _check_memory(self):
+        if not self.max_memory_bytes:
+            return
+        for worker in list(self.workers.values()):
+            rss = worker_rss(worker.pid)
+            if rss is not None and rss > self.max_memory_bytes:
+                logger.warning(f"工作进程 {worker.pid} 内存 {rss / 1048576:.0f}MB 超过上限 "
+                               f"{self.max_memory_bytes / 1048576:.0f}MB，替换")
+                self._replace(worker, 'memory')
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for worker in list(self.retiring.values()):
+            if worker.retire_deadline is not None and now >= worker.retire_deadline:
+                logger.warning(f"工作进程 {worker.pid} 未在 {self.timeout:g}s 内退出，强制结束")
+                worker.retire_deadline = None
+                try:
+                    os.kill(worker.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _shutdown(self):
+        logger.info("停止所有工作进程")
+        for worker in list(self.workers.values()):
+            self._retire(worker)
+        deadline = time.monotonic() + self.timeout
+        while self.retiring and time.monotonic() < deadline:
+            self._wait(0.1)
+            self._reap()
+        self._kill_overdue_all()
+        if self.socket is not None:
+            self.socket.close()
+        signal.set_wakeup_fd(-1)
+        for fd in (self._wakeup_r, self._wakeup_w):
+            if fd is not None:
+                os.close(fd)
+
+    def _kill_overdue_all(self):
+        for pid in list(self.retiring):
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.retiring.clear()
+
+    # ---- 工作进程 ----
+
+    def _worker_main(self, ready_w: int):
+        status = 0
+        try:
+            signal.set_wakeup_fd(-1)
+            for fd in (self._wakeup_r, self._wakeup_w):
+                os.close(fd)
+            for signum in (signal.SIGHUP, signal.SIGCHLD):
+                signal.signal(signum, signal.SIG_DFL)
+            # Ctrl+C 会发给整个进程组，由主进程统一发 SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            if self.post_fork is not None:
+                self.post_fork()
+            server = make_server(self.host, self.port, self.app, threaded=True, fd=self.socket.fileno())
+            # 停止时等待进行中的请求处理完，而不是随进程一起被丢弃
+            server.daemon_threads = False
+            signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+            os.write(ready_w, b'1')
+            os.close(ready_w)
+            server.serve_forever()
+            server.server_close()
+            if self.on_worker_exit is not None:
+                self.on_worker_exit()
+        except BaseException:
+            logger.exception(f"工作进程 {os.getpid()} 异常退出")
+            status = 1
+        finally:
+            logging.shutdown()
+            os._exit(status)